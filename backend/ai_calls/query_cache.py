@@ -0,0 +1,163 @@
+import re
+import sys
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from config.constants import (
+    QUERY_CACHE_SIZE,
+    QUERY_CACHE_TTL,
+    SEMANTIC_CACHE_SIZE,
+    SEMANTIC_CACHE_THRESHOLD,
+)
+
+
+def normalise_query(query: str) -> str:
+    '''Lowercases, collapses whitespace and strips surrounding punctuation'''
+    query = re.sub(r"\s+", " ", (query or "").lower()).strip()
+    return query.strip(".,;:!?\"'")
+
+
+class QueryCache:
+    '''
+    Two-tier cache of reranked retrieval results.
+
+    - Exact tier: LRU keyed by (normalised query, top_k).
+    - Semantic tier: reuses the results of a cached query whose embedding is within
+      `semantic_threshold` cosine similarity of the new one (and was cached with top_k >= requested).
+
+    Both tiers evict by size (least recently used first) and TTL, and are cleared
+    whenever the corpus/index version stamp passed to `get_*` / `put` changes.
+    '''
+
+    def __init__(
+        self,
+        max_entries: int = QUERY_CACHE_SIZE,
+        semantic_max_entries: int = SEMANTIC_CACHE_SIZE,
+        ttl_seconds: float = QUERY_CACHE_TTL,
+        semantic_threshold: float = SEMANTIC_CACHE_THRESHOLD,
+    ):
+        self.max_entries = max_entries
+        self.semantic_max_entries = semantic_max_entries
+        self.ttl_seconds = ttl_seconds
+        self.semantic_threshold = semantic_threshold
+
+        self._exact = OrderedDict()     # (query, top_k) -> (expires_at, results)
+        self._semantic = OrderedDict()  # query -> (expires_at, unit embedding, top_k, results)
+        self._version = None
+        self._lock = threading.Lock()
+        self.counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "invalidations": 0}
+
+    # -----------------------------
+    # Lookups
+    # -----------------------------
+
+    def get_exact(self, query, top_k, version=None):
+        '''Returns cached results for the normalised query text, or None'''
+        key = (normalise_query(query), top_k)
+        with self._lock:
+            self._check_version(version)
+            entry = self._exact.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._exact.pop(key, None)
+                return None
+            self._exact.move_to_end(key)
+            self.counters["exact_hits"] += 1
+            return list(entry[1])
+
+    def get_semantic(self, embedding, top_k, version=None):
+        '''
+        Returns the results of the most similar cached query above the threshold, or None.
+        Counts a miss when nothing matches, so call it after `get_exact`.
+        '''
+        unit = _unit(embedding)
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(version)
+            for key in [k for k, e in self._semantic.items() if e[0] < now]:
+                del self._semantic[key]
+
+            candidates = [(k, e) for k, e in self._semantic.items() if e[2] >= top_k]
+            if not candidates:
+                self.counters["misses"] += 1
+                return None
+
+            matrix = np.vstack([e[1] for _, e in candidates])
+            sims = matrix @ unit
+            best = int(np.argmax(sims))
+            if sims[best] < self.semantic_threshold:
+                self.counters["misses"] += 1
+                return None
+
+            key, entry = candidates[best]
+            self._semantic.move_to_end(key)
+            self.counters["semantic_hits"] += 1
+            return list(entry[3][:top_k])
+
+    # -----------------------------
+    # Inserts
+    # -----------------------------
+
+    def put(self, query, top_k, results, embedding=None, version=None):
+        '''Stores results in the exact tier and, if an embedding is given, the semantic tier'''
+        expires_at = time.monotonic() + self.ttl_seconds
+        norm = normalise_query(query)
+        with self._lock:
+            self._check_version(version)
+            self._exact[(norm, top_k)] = (expires_at, list(results))
+            self._exact.move_to_end((norm, top_k))
+            while len(self._exact) > self.max_entries:
+                self._exact.popitem(last=False)
+
+            if embedding is not None and self.semantic_max_entries > 0:
+                self._semantic[norm] = (expires_at, _unit(embedding), top_k, list(results))
+                self._semantic.move_to_end(norm)
+                while len(self._semantic) > self.semantic_max_entries:
+                    self._semantic.popitem(last=False)
+
+    def clear(self):
+        '''Drops every cached entry (counters are kept)'''
+        with self._lock:
+            self._exact.clear()
+            self._semantic.clear()
+
+    # -----------------------------
+    # Stats
+    # -----------------------------
+
+    def hit_rate(self):
+        '''Fraction of lookups served from either tier'''
+        hits = self.counters["exact_hits"] + self.counters["semantic_hits"]
+        total = hits + self.counters["misses"]
+        return hits / total if total else 0.0
+
+    def stats(self):
+        '''Counters plus current tier sizes and overall hit rate'''
+        with self._lock:
+            return {
+                **self.counters,
+                "exact_entries": len(self._exact),
+                "semantic_entries": len(self._semantic),
+                "hit_rate": round(self.hit_rate(), 4),
+            }
+
+    def _check_version(self, version):
+        '''Clears both tiers when the corpus/index version changes. Caller holds the lock.'''
+        if version is None or version == self._version:
+            return
+        if self._version is not None:
+            self._exact.clear()
+            self._semantic.clear()
+            self.counters["invalidations"] += 1
+        self._version = version
+
+
+def _unit(embedding):
+    '''Returns `embedding` as an L2-normalised float32 vector'''
+    vec = np.asarray(embedding, dtype="float32").ravel()
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
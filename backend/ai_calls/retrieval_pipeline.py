@@ -1,25 +1,98 @@
+import re
 import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
-from setup import retriever_setup
+from setup import retriever_setup, tracing
+from config.constants import RERANK_BATCH_SIZE
+from setup.metadata_index import FILTER_FIELDS
 
-def get_response(query, retriever, top_k=10):
+FILTER_TOKEN_RE = re.compile(rf'\b({"|".join(FILTER_FIELDS)}):("[^"]+"|\S+)', re.IGNORECASE)
+
+
+@tracing.traced("get_response")
+def get_response(query, retriever, top_k=10, cache=None, filters=None):
     '''
-    Retrieves relevant questions for a query using the ensemble retriever,
-    then reranks results with a cross-encoder and returns the top_k documents
+    Retrieves relevant questions for a query using the fusion retriever,
+    then reranks results with a cross-encoder and returns the top_k documents.
+
+    If a `query_cache.QueryCache` is given, exact and near-duplicate queries
+    against the same corpus version are answered from it.
+
+    `filters` restricts retrieval to matching questions before scoring, e.g.
+    {"year": 2023, "difficulty": "advanced", "tag": "Calculus"} (see `metadata_index`).
+    Filtered queries bypass the cache.
     '''
-    print("Retrieving relevant questions...")
     if retriever is None or not hasattr(retriever, "get_relevant_documents"):
         raise ValueError("Retriever is not initialised (None or missing get_relevant_documents).")
-    qs = retriever.invoke(query)
+
+    if filters:
+        print("Retrieving relevant questions (filtered)...")
+        qs = retriever.invoke(query, filters=filters)
+        reranker = retriever_setup.load_reranker()
+        return retriever_setup.rerank_documents(reranker, query, qs, top_k=top_k) if qs else []
+
+    query_embedding = None
+    if cache is not None:
+        with tracing.span("cache.lookup") as trace:
+            version = retriever_setup.corpus_version()
+            cached = cache.get_exact(query, top_k, version)
+            if cached is None:
+                query_embedding = retriever_setup.embed_query(retriever, query)
+                cached = cache.get_semantic(query_embedding, top_k, version)
+            trace.set(hit=cached is not None)
+        if cached is not None:
+            print("Serving cached results...")
+            return cached
+
+    print("Retrieving relevant questions...")
+    # Reuse the vector from the semantic cache lookup rather than embedding the query twice
+    qs = retriever.invoke(query) if query_embedding is None else retriever.invoke(query, query_vector=query_embedding)
     print("Loading reranker...")
     reranker = retriever_setup.load_reranker()
     print("Reranking questions...")
     reranked_qs = retriever_setup.rerank_documents(reranker, query, qs, top_k=top_k)
 
+    if cache is not None:
+        cache.put(query, top_k, reranked_qs, embedding=query_embedding, version=version)
+
     return reranked_qs
 
+
+@tracing.traced("get_responses")
+def get_responses(queries, retriever, top_k=10, batch_size=RERANK_BATCH_SIZE, filters=None):
+    '''
+    Batched version of `get_response` for many queries (revision-pack generation, evaluation).
+    Embeds all queries in one call and reranks every (query, candidate) pair in one
+    batched cross-encoder call. Returns one list of documents per query, in query order.
+    `filters` applies to every query.
+    '''
+    if retriever is None or not hasattr(retriever, "get_relevant_documents"):
+        raise ValueError("Retriever is not initialised (None or missing get_relevant_documents).")
+    queries = list(queries)
+    if not queries:
+        return []
+
+    print(f"Retrieving relevant questions for {len(queries)} queries...")
+    candidate_lists = retriever.invoke_batch(queries, filters=filters)
+    reranker = retriever_setup.load_reranker()
+    print("Reranking questions...")
+    return retriever_setup.rerank_batch(reranker, queries, candidate_lists, top_k=top_k, batch_size=batch_size)
+
+
+def parse_filters(text):
+    '''
+    Splits `field:value` filter tokens out of a typed query.
+    Quote values containing spaces, e.g. 'integration year:2023 tag:"Calculus / Definite integrals"'.
+    Returns (query, filters); repeated fields are OR-ed.
+    '''
+    filters = {}
+    for field, value in FILTER_TOKEN_RE.findall(text):
+        filters.setdefault(field.lower(), []).append(value.strip('"'))
+    query = re.sub(r"\s+", " ", FILTER_TOKEN_RE.sub("", text)).strip()
+    return query, filters
+
+
 if __name__ == "__main__":
     from doc_processing import exam_extractor
     from config.constants import PICKLE_PATH
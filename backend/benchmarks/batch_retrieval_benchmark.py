@@ -0,0 +1,98 @@
+'''
+Throughput benchmark for batched retrieval (`retrieval_pipeline.get_responses`).
+
+Runs the syllabus subtopics as queries through the single-query path and through
+`get_responses` with growing batch sizes, reporting queries/sec for each and
+checking that batched results match the single-query results.
+
+Usage:
+    python backend/benchmarks/batch_retrieval_benchmark.py --batch-sizes 1 8 32 128
+'''
+import io
+import sys
+import json
+import time
+import argparse
+import contextlib
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+SRC_ROOT = REPO_ROOT / "backend"
+for p in (REPO_ROOT, SRC_ROOT):
+    if str(p) not in sys.path:
+        sys.path.append(str(p))
+
+from ai_calls import retrieval_pipeline
+from setup import retriever_setup
+from doc_processing.process_questions import load_questions, load_syllabus, syllabus_subtopics
+from config.constants import PROJECT_ROOT
+
+
+def syllabus_queries(n):
+    '''Uses syllabus subtopic names ("Chain rule", "Normal distribution", ...) as queries'''
+    queries = []
+    for path in sorted((PROJECT_ROOT / "data" / "syllabus").glob("*.json")):
+        queries.extend(tag.split(" / ")[-1] for tag in syllabus_subtopics(load_syllabus(path)))
+    queries = list(dict.fromkeys(queries))
+    return (queries * (n // max(len(queries), 1) + 1))[:n]
+
+
+def result_ids(docs):
+    '''Question IDs of a result list, for comparing two retrieval paths'''
+    return [d.metadata.get("id") for d in docs]
+
+
+def run(queries, retriever, batch_sizes, top_k, rerank_batch_size):
+    '''Times the sequential baseline and each batch size; returns result rows'''
+    # Warm-up: load the reranker and touch both indexes once
+    with contextlib.redirect_stdout(io.StringIO()):
+        retrieval_pipeline.get_response(queries[0], retriever, top_k=top_k)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        single = [retrieval_pipeline.get_response(q, retriever, top_k=top_k) for q in queries]
+        single_s = time.perf_counter() - start
+
+    rows = [{"mode": "sequential", "batch_size": 1, "qps": round(len(queries) / single_s, 2), "mismatches": 0}]
+    print(f"{'sequential':<12} qps={rows[0]['qps']:.2f}")
+
+    for batch_size in batch_sizes:
+        batched = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            for i in range(0, len(queries), batch_size):
+                batched.extend(retrieval_pipeline.get_responses(
+                    queries[i : i + batch_size], retriever, top_k=top_k, batch_size=rerank_batch_size
+                ))
+            elapsed = time.perf_counter() - start
+
+        mismatches = sum(result_ids(a) != result_ids(b) for a, b in zip(single, batched))
+        row = {
+            "mode": "batched",
+            "batch_size": batch_size,
+            "qps": round(len(queries) / elapsed, 2),
+            "mismatches": mismatches,
+        }
+        rows.append(row)
+        print(f"{'batch=' + str(batch_size):<12} qps={row['qps']:.2f}  mismatches={mismatches}/{len(queries)}")
+
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=128)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 16, 64, 128])
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--rerank-batch-size", type=int, default=retrieval_pipeline.RERANK_BATCH_SIZE)
+    parser.add_argument("--json", type=str, default=None, help="Optional path to write results as JSON")
+    args = parser.parse_args()
+
+    data = load_questions()
+    retriever = retriever_setup.create_ensemble_retriever(data.get("questions", []))
+    results = run(syllabus_queries(args.queries), retriever, args.batch_sizes, args.top_k, args.rerank_batch_size)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
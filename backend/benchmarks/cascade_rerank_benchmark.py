@@ -0,0 +1,85 @@
+'''
+Cross-encoder cost benchmark for cascade reranking.
+
+Retrieves fused candidates for the syllabus subtopic queries once, then reranks
+them with the full cross-encoder pass and with the cascade at several recall
+biases. Reports per setting:
+    - average cross-encoder pairs per query
+    - average rerank latency
+    - overlap of the top-k with the full rerank (how much recall the cascade gave up)
+
+Usage:
+    python backend/benchmarks/cascade_rerank_benchmark.py --biases 0 0.3 0.6 1
+'''
+import io
+import sys
+import json
+import time
+import argparse
+import contextlib
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+SRC_ROOT = REPO_ROOT / "backend"
+for p in (REPO_ROOT, SRC_ROOT):
+    if str(p) not in sys.path:
+        sys.path.append(str(p))
+
+from setup import retriever_setup
+from doc_processing.process_questions import load_questions
+from benchmarks.batch_retrieval_benchmark import syllabus_queries, result_ids
+
+
+def rerank_all(reranker, queries, candidate_lists, top_k, cascade, recall_bias=None):
+    '''Reranks every query's candidates; returns (results, rerank stats, mean latency ms)'''
+    retriever_setup.reset_rerank_stats()
+    results, latencies = [], []
+    for query, qs in zip(queries, candidate_lists):
+        start = time.perf_counter()
+        kwargs = {"recall_bias": recall_bias} if cascade else {}
+        results.append(retriever_setup.rerank_documents(reranker, query, qs, top_k=top_k, cascade=cascade, **kwargs))
+        latencies.append((time.perf_counter() - start) * 1000)
+    mode = "cascade" if cascade else "full"
+    return results, retriever_setup.rerank_stats()[mode], sum(latencies) / len(latencies)
+
+
+def run(queries, retriever, biases, top_k):
+    '''Compares the full rerank against the cascade at each recall bias'''
+    with contextlib.redirect_stdout(io.StringIO()):
+        candidate_lists = retriever.invoke_batch(queries)
+    reranker = retriever_setup.load_reranker()
+
+    full, stats, latency = rerank_all(reranker, queries, candidate_lists, top_k, cascade=False)
+    rows = [{"mode": "full", "recall_bias": None, "avg_pairs": stats["avg_pairs"],
+             "avg_ms": round(latency, 2), f"overlap@{top_k}": 1.0}]
+    print(f"{'full':<16} pairs/query={stats['avg_pairs']:.1f}  latency={latency:.1f}ms")
+
+    for bias in biases:
+        cascade, stats, latency = rerank_all(reranker, queries, candidate_lists, top_k, cascade=True, recall_bias=bias)
+        overlap = sum(
+            len(set(result_ids(a)) & set(result_ids(b))) / max(len(a), 1)
+            for a, b in zip(full, cascade)
+        ) / len(queries)
+        rows.append({"mode": "cascade", "recall_bias": bias, "avg_pairs": stats["avg_pairs"],
+                     "avg_ms": round(latency, 2), f"overlap@{top_k}": round(overlap, 4)})
+        print(f"{'cascade bias=' + str(bias):<16} pairs/query={stats['avg_pairs']:.1f}  "
+              f"latency={latency:.1f}ms  overlap@{top_k}={overlap:.3f}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--biases", type=float, nargs="+", default=[0.0, 0.3, 0.6, 1.0])
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--json", type=str, default=None, help="Optional path to write results as JSON")
+    args = parser.parse_args()
+
+    data = load_questions()
+    retriever = retriever_setup.create_ensemble_retriever(data.get("questions", []))
+    results = run(syllabus_queries(args.queries), retriever, args.biases, args.top_k)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
@@ -0,0 +1,114 @@
+'''
+Cold-start benchmark for `backend/main.py`.
+
+Launches the app as a subprocess in each startup mode and measures:
+    - time-to-prompt: process start until the first "What do you wish to revise?" prompt
+    - time-to-first-result: query sent until the retrieved questions are printed
+
+Modes: eager (default startup), lazy (--lazy) and lazy+warmup (--lazy --warmup).
+For lazy+warmup the query is sent after --think seconds, imitating a user typing.
+
+Usage:
+    python backend/benchmarks/cold_start_benchmark.py --query integration --runs 3
+'''
+import os
+import sys
+import json
+import time
+import select
+import argparse
+import subprocess
+import numpy as np
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+MAIN = REPO_ROOT / "backend" / "main.py"
+
+MODES = {
+    "eager": [],
+    "lazy": ["--lazy"],
+    "lazy+warmup": ["--lazy", "--warmup"],
+}
+
+PROMPT_MARKER = b"What do you wish to revise?"
+RESULT_MARKER = b"--- AI REVISION ASSISTANT ---"
+
+
+def wait_for(proc, marker, timeout):
+    '''Reads the child's stdout until `marker` appears; returns the time it appeared'''
+    buffer = b""
+    deadline = time.perf_counter() + timeout
+    fd = proc.stdout.fileno()
+    while marker not in buffer:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            raise TimeoutError(f"Timed out waiting for {marker!r}")
+        ready, _, _ = select.select([fd], [], [], remaining)
+        if ready:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise RuntimeError(f"Process exited before {marker!r}:\n{buffer.decode(errors='replace')[-2000:]}")
+            buffer += chunk
+    return time.perf_counter()
+
+
+def run_once(mode_args, query, think_s, timeout):
+    '''Runs the app once; returns (time-to-prompt, time-to-first-result) in seconds'''
+    env = {**os.environ, "PYTHONUNBUFFERED": "1"}
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, str(MAIN), *mode_args],
+        cwd=REPO_ROOT,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        env=env,
+    )
+    try:
+        prompt_at = wait_for(proc, PROMPT_MARKER, timeout)
+        time.sleep(think_s)
+        sent_at = time.perf_counter()
+        proc.stdin.write(f"{query}\n".encode())
+        proc.stdin.flush()
+        result_at = wait_for(proc, RESULT_MARKER, timeout)
+        proc.stdin.write(b"q\n")
+        proc.stdin.flush()
+        proc.wait(timeout=timeout)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+    return prompt_at - start, result_at - sent_at
+
+
+def run(modes, query, runs, think_s, timeout):
+    '''Benchmarks each mode `runs` times and returns median timings'''
+    rows = []
+    for mode in modes:
+        samples = [run_once(MODES[mode], query, think_s, timeout) for _ in range(runs)]
+        row = {
+            "mode": mode,
+            "time_to_prompt_s": round(float(np.median([s[0] for s in samples])), 3),
+            "time_to_first_result_s": round(float(np.median([s[1] for s in samples])), 3),
+            "runs": runs,
+        }
+        rows.append(row)
+        print(f"{mode:<12} time-to-prompt={row['time_to_prompt_s']:.2f}s  "
+              f"time-to-first-result={row['time_to_first_result_s']:.2f}s")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    parser.add_argument("--query", type=str, default="integration")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--think", type=float, default=3.0, help="Seconds between prompt and query (user typing)")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--json", type=str, default=None, help="Optional path to write results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.modes, args.query, args.runs, args.think, args.timeout)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
@@ -0,0 +1,106 @@
+'''
+Throughput benchmark for length-bucketed encoding (`setup/encoding_scheduler.py`).
+
+Compares the models' default batching with the scheduler on the real corpus:
+    - embedding: every question's text (what an index build embeds)
+    - reranking: (query, candidate) pairs for the syllabus subtopic queries
+
+Reports texts/sec, batch count and padding efficiency (real / padded tokens), and
+the largest absolute difference from the default outputs (should be float noise).
+
+Usage:
+    python backend/benchmarks/encoding_benchmark.py --queries 50 --threads 0
+'''
+import io
+import sys
+import json
+import time
+import argparse
+import contextlib
+import numpy as np
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+SRC_ROOT = REPO_ROOT / "backend"
+for p in (REPO_ROOT, SRC_ROOT):
+    if str(p) not in sys.path:
+        sys.path.append(str(p))
+
+from setup import retriever_setup, encoding_scheduler
+from doc_processing.process_questions import load_questions
+from benchmarks.batch_retrieval_benchmark import syllabus_queries
+
+
+def compare(name, default_fn, scheduled_fn, scheduler, n):
+    '''Times the default and scheduled runs of one workload; returns a result row'''
+    start = time.perf_counter()
+    baseline = np.asarray(default_fn())
+    default_s = time.perf_counter() - start
+
+    scheduled = np.asarray(scheduled_fn())
+    stats = scheduler.last_stats
+
+    row = {
+        "workload": name,
+        "texts": n,
+        "default_texts_per_sec": round(n / default_s, 1),
+        "bucketed_texts_per_sec": stats["texts_per_sec"],
+        "speedup": round(stats["texts_per_sec"] / (n / default_s), 2),
+        "batches": stats["batches"],
+        "padding_efficiency": stats["padding_efficiency"],
+        "threads": stats["threads"],
+        "max_abs_diff": float(np.abs(baseline - scheduled).max()) if n else 0.0,
+    }
+    print(f"{name:<10} default={row['default_texts_per_sec']:.0f}/s  bucketed={row['bucketed_texts_per_sec']:.0f}/s  "
+          f"x{row['speedup']:.2f}  padding={row['padding_efficiency']:.0%}  max_diff={row['max_abs_diff']:.2e}")
+    return row
+
+
+def run(docs, queries, retriever, scheduler):
+    '''Benchmarks the embedding and reranking workloads'''
+    texts = [d.page_content.replace("\n", " ") for d in docs]
+    model = retriever_setup.load_embedding()._client
+    model.encode(texts[:8], show_progress_bar=False)  # warm-up, so neither side pays for the first forward pass
+    rows = [compare(
+        "embed",
+        lambda: model.encode(texts, show_progress_bar=False),
+        lambda: scheduler.embed(model, texts),
+        scheduler,
+        len(texts),
+    )]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        candidate_lists = retriever.invoke_batch(queries)
+    pairs = [[q, d.page_content] for q, qs in zip(queries, candidate_lists) for d in qs]
+    reranker = retriever_setup.load_reranker()
+    reranker.predict(pairs[:8], show_progress_bar=False)
+    rows.append(compare(
+        "rerank",
+        lambda: reranker.predict(pairs, show_progress_bar=False),
+        lambda: scheduler.predict(reranker, pairs),
+        scheduler,
+        len(pairs),
+    ))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads (0 = all cores)")
+    parser.add_argument("--token-budget", type=int, default=encoding_scheduler.ENCODE_TOKEN_BUDGET)
+    parser.add_argument("--json", type=str, default=None, help="Optional path to write results as JSON")
+    args = parser.parse_args()
+
+    encoding_scheduler.configure_torch_threads(args.threads)
+    scheduler = encoding_scheduler.EncodingScheduler(token_budget=args.token_budget, threads=args.threads)
+
+    data = load_questions()
+    docs = retriever_setup.questions_to_docs(data.get("questions", []), expand=False)
+    retriever = retriever_setup.create_ensemble_retriever(data.get("questions", []))
+    results = run(docs, syllabus_queries(args.queries), retriever, scheduler)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
@@ -0,0 +1,126 @@
+'''
+Recall / latency / memory benchmark for the FAISS index types in `setup.index_factory`.
+
+Builds each index type over synthetic clustered embeddings (MiniLM-sized by default)
+at several corpus sizes and reports, per type and size:
+    - recall@k against exact flat search
+    - p50 / p95 single-query latency
+    - serialised index size
+    - build (train + add) time
+
+Usage:
+    python backend/benchmarks/faiss_index_benchmark.py --sizes 10000 100000 300000
+'''
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+SRC_ROOT = REPO_ROOT / "backend"
+for p in (REPO_ROOT, SRC_ROOT):
+    if str(p) not in sys.path:
+        sys.path.append(str(p))
+
+from setup import index_factory
+
+
+def synthetic_corpus(n, dim, n_clusters=256, seed=0):
+    '''
+    Clustered, L2-normalised vectors: sentence embeddings of exam questions are far
+    from uniform, and uniform data makes IVF/HNSW look worse than they are
+    '''
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(n_clusters, dim)).astype("float32")
+    labels = rng.integers(0, n_clusters, size=n)
+    vectors = centres[labels] + 0.35 * rng.normal(size=(n, dim)).astype("float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.ascontiguousarray(vectors, dtype="float32")
+
+
+def synthetic_queries(corpus, n_queries, seed=1):
+    '''Queries are perturbed corpus vectors, like paraphrased topic searches'''
+    rng = np.random.default_rng(seed)
+    picks = corpus[rng.choice(len(corpus), n_queries, replace=False)]
+    queries = picks + 0.2 * rng.normal(size=picks.shape).astype("float32")
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return np.ascontiguousarray(queries, dtype="float32")
+
+
+def recall_at_k(found, truth):
+    '''Mean fraction of the exact top-k that the approximate index returned'''
+    hits = [len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]
+    return float(np.mean(hits))
+
+
+def bench_index(index_type, corpus, queries, truth, k):
+    '''Builds one index type and measures recall, latency and memory'''
+    start = time.perf_counter()
+    index = index_factory.create_index(index_type, corpus.shape[1], len(corpus))
+    index_factory.train_index(index, corpus)
+    index_factory.configure_search(index)
+    index.add(corpus)
+    build_s = time.perf_counter() - start
+
+    # Single-query searches: that is how the retriever calls FAISS
+    latencies, found = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        _, ids = index.search(q[None, :], k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        found.append(ids[0])
+
+    return {
+        "index_type": index_type,
+        "n_vectors": len(corpus),
+        f"recall@{k}": round(recall_at_k(found, truth), 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "memory_mb": round(index_factory.index_memory_bytes(index) / 1e6, 2),
+        "build_s": round(build_s, 2),
+    }
+
+
+def run(sizes, index_types, dim, n_queries, k):
+    '''Runs the benchmark grid and returns a list of result rows'''
+    rows = []
+    for n in sizes:
+        print(f"\n--- {n} vectors ---")
+        corpus = synthetic_corpus(n, dim)
+        queries = synthetic_queries(corpus, n_queries)
+
+        exact = index_factory.create_index("flat", dim, n)
+        exact.add(corpus)
+        _, truth = exact.search(queries, k)
+
+        for index_type in index_types:
+            if n < index_factory.min_train_size(index_type):
+                print(f"Skipping {index_type}: corpus too small")
+                continue
+            row = bench_index(index_type, corpus, queries, truth, k)
+            rows.append(row)
+            print(
+                f"{index_type:<9} recall@{k}={row[f'recall@{k}']:.3f}  "
+                f"p50={row['p50_ms']:.2f}ms  p95={row['p95_ms']:.2f}ms  "
+                f"mem={row['memory_mb']:.1f}MB  build={row['build_s']:.1f}s"
+            )
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 50_000, 200_000])
+    parser.add_argument("--types", nargs="+", default=list(index_factory.INDEX_TYPES))
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=25)
+    parser.add_argument("--json", type=str, default=None, help="Optional path to write results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.types, args.dim, args.queries, args.k)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
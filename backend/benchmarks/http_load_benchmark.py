@@ -0,0 +1,129 @@
+'''
+Load test for the HTTP service (`backend/server.py`): throughput and tail latency at
+increasing concurrency.
+
+Each level runs `concurrency` closed-loop clients (one request in flight each, kept-alive
+connection) for --duration seconds against a running server. Queries are syllabus subtopic
+names, handed out in order across levels, so a level only repeats queries (and hits the
+server's query cache) once the list is used up. Reports requests/sec, p50 / p95 / p99
+latency of successful requests, and how many requests were shed with 503 (pool full) or
+cut off with 504 (timeout), which shows where the server stops scaling and starts shedding.
+
+Usage:
+    python backend/main.py --lazy --serve &
+    python backend/benchmarks/http_load_benchmark.py --levels 1 2 4 8 16 32 --duration 20
+    python backend/benchmarks/http_load_benchmark.py --endpoint pack --levels 1 2 4
+'''
+import sys
+import json
+import time
+import argparse
+import itertools
+import threading
+import http.client
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+SRC_ROOT = REPO_ROOT / "backend"
+for p in (REPO_ROOT, SRC_ROOT):
+    if str(p) not in sys.path:
+        sys.path.append(str(p))
+
+from config.constants import PROJECT_ROOT, SERVE_HOST, SERVE_PORT
+from doc_processing.process_questions import load_syllabus, syllabus_subtopics
+
+ENDPOINTS = ("search", "pack")
+
+
+def syllabus_queries():
+    '''Distinct syllabus subtopic names ("Chain rule", "Normal distribution", ...)'''
+    queries = []
+    for path in sorted((PROJECT_ROOT / "data" / "syllabus").glob("*.json")):
+        queries.extend(tag.split(" / ")[-1] for tag in syllabus_subtopics(load_syllabus(path)))
+    return list(dict.fromkeys(queries))
+
+
+def client(url, endpoint, top_k, queries, deadline, results, timeout, backoff):
+    '''
+    One closed-loop client: sends the next query as soon as the previous one is answered,
+    or `backoff` seconds after a 503
+    '''
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+    while time.perf_counter() < deadline:
+        path = f"/{endpoint}?" + urlencode({"q": next(queries), "top_k": top_k})
+        start = time.perf_counter()
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+            status = 0
+        results.append((status, time.perf_counter() - start))
+        if status == 503:
+            time.sleep(backoff)
+    conn.close()
+
+
+def run_level(url, endpoint, concurrency, duration, top_k, queries, timeout, backoff) -> dict:
+    results = []
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=client, args=(url, endpoint, top_k, queries, deadline, results, timeout, backoff))
+        for _ in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    ok = np.array([latency for status, latency in results if status == 200]) * 1000
+    percentile = (lambda q: round(float(np.percentile(ok, q)), 1)) if len(ok) else (lambda q: None)
+    row = {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "ok": len(ok),
+        "rps": round(len(ok) / elapsed, 2),
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+        "rejected_503": sum(1 for status, _ in results if status == 503),
+        "timeouts_504": sum(1 for status, _ in results if status == 504),
+        "errors": sum(1 for status, _ in results if status not in (200, 503, 504)),
+    }
+    print(f"c={concurrency:<4} rps={row['rps']:>8.2f}  p50={row['p50_ms'] or 0:>8.1f} ms  "
+          f"p95={row['p95_ms'] or 0:>8.1f} ms  p99={row['p99_ms'] or 0:>8.1f} ms  "
+          f"ok={row['ok']:<6} 503={row['rejected_503']:<5} 504={row['timeouts_504']:<5} errors={row['errors']}")
+    return row
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", type=str, default=f"http://{SERVE_HOST}:{SERVE_PORT}")
+    parser.add_argument("--endpoint", choices=ENDPOINTS, default="search")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per concurrency level")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=300.0, help="Client-side socket timeout (seconds)")
+    parser.add_argument("--backoff", type=float, default=0.05, help="Seconds a client waits after a 503")
+    parser.add_argument("--json", type=str, default=None, help="Optional path to write results as JSON")
+    args = parser.parse_args()
+
+    queries = itertools.cycle(syllabus_queries() or ["integration"])
+    results = [
+        run_level(args.url, args.endpoint, level, args.duration, args.top_k, queries, args.timeout, args.backoff)
+        for level in args.levels
+    ]
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
@@ -0,0 +1,98 @@
+'''
+Quality and latency benchmark: late-interaction (MaxSim) reranking vs the cross-encoder.
+
+Both rerankers score the same fused candidates for every query in a labelled query set
+(see `evaluation/retrieval_eval.py build`). Reports per reranker:
+    - recall@10, MRR and nDCG@10 against the labels
+    - p50 / p95 rerank latency per query (query encoding included)
+    - overlap@10 of the late-interaction top 10 with the cross-encoder top 10
+and the size of the float16 token index.
+
+Usage:
+    python backend/benchmarks/late_interaction_benchmark.py --queries data/eval/queries_v1.json
+'''
+import io
+import sys
+import json
+import time
+import argparse
+import contextlib
+import numpy as np
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+SRC_ROOT = REPO_ROOT / "backend"
+for p in (REPO_ROOT, SRC_ROOT):
+    if str(p) not in sys.path:
+        sys.path.append(str(p))
+
+from setup import retriever_setup, late_interaction
+from doc_processing.process_questions import load_questions
+from evaluation.retrieval_eval import query_set_path, recall_at_k, reciprocal_rank, ndcg_at_k, percentiles
+from benchmarks.batch_retrieval_benchmark import result_ids
+
+METHODS = ("cross_encoder", "late_interaction")
+
+
+def run(query_set, retriever, top_k):
+    '''Reranks every query's fused candidates with both methods; returns result rows'''
+    items = query_set["queries"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        candidate_lists = retriever.invoke_batch([item["query"] for item in items])
+
+    rankings, rows = {}, []
+    for method in METHODS:
+        reranker = retriever_setup.load_reranker(method)
+        retriever_setup.rerank_documents(reranker, items[0]["query"], candidate_lists[0], top_k=top_k)  # warm-up
+
+        ranked, latencies = [], []
+        for item, qs in zip(items, candidate_lists):
+            start = time.perf_counter()
+            ranked.append(result_ids(retriever_setup.rerank_documents(reranker, item["query"], qs, top_k=top_k, cascade=False)))
+            latencies.append((time.perf_counter() - start) * 1000)
+        rankings[method] = ranked
+
+        relevant = [set(item["relevant"]) for item in items]
+        row = {
+            "method": method,
+            f"recall@{top_k}": round(float(np.mean([recall_at_k(r, rel, top_k) for r, rel in zip(ranked, relevant)])), 4),
+            "mrr": round(float(np.mean([reciprocal_rank(r, rel) for r, rel in zip(ranked, relevant)])), 4),
+            "ndcg@10": round(float(np.mean([ndcg_at_k(r, rel, 10) for r, rel in zip(ranked, relevant)])), 4),
+            "latency_ms": percentiles(latencies),
+        }
+        rows.append(row)
+
+    overlap = np.mean([
+        len(set(a) & set(b)) / max(len(a), 1)
+        for a, b in zip(rankings["cross_encoder"], rankings["late_interaction"])
+    ])
+    rows[1][f"overlap@{top_k}_with_cross_encoder"] = round(float(overlap), 4)
+
+    for row in rows:
+        lat = row["latency_ms"]
+        print(f"{row['method']:<17} recall@{top_k}={row[f'recall@{top_k}']:.3f}  mrr={row['mrr']:.3f}  "
+              f"ndcg@10={row['ndcg@10']:.3f}  p50={lat['p50']:.1f}ms p95={lat['p95']:.1f}ms")
+    print(f"late-interaction overlap@{top_k} with cross-encoder: {overlap:.3f}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=str, default=query_set_path(1))
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--json", type=str, default=None, help="Optional path to write results as JSON")
+    args = parser.parse_args()
+
+    with open(args.queries, "r", encoding="utf-8") as f:
+        query_set = json.load(f)
+
+    data = load_questions()
+    retriever = retriever_setup.create_ensemble_retriever(data.get("questions", []))
+    token_index = late_interaction.sync_token_index(retriever_setup.questions_to_docs(data.get("questions", []), expand=False))
+    print(f"Token index: {len(token_index)} questions, {token_index.nbytes() / 2**20:.1f} MB")
+
+    results = run(query_set, retriever, args.top_k)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
@@ -0,0 +1,121 @@
+'''
+Revision pack assembly benchmark across engines and header overlay modes.
+
+Modes (see `doc_processing/pdf_generator.build_custom_pdf`):
+    merge     pypdf, original path: a fresh reportlab header page rendered and merged per page
+    xobject   pypdf, one header form XObject per source PDF stamped onto pages in a single pass
+    pymupdf   PyMuPDF, native page-range copying and header text insertion
+
+Packs of each size are drawn round-robin from the exam PDFs in EXAM_DIR, so a pack mixes
+several papers like a real query does. Source PDFs are parsed once up front (shared
+`SourcePool` per engine), so only assembly and writing (plus `--optimize`, if given) are timed. Reports median build time,
+pages/sec and output size per mode and pack size.
+
+Usage:
+    python backend/benchmarks/pdf_overlay_benchmark.py --pages 10 50 200 --repeats 5
+'''
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+import numpy as np
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+SRC_ROOT = REPO_ROOT / "backend"
+for p in (REPO_ROOT, SRC_ROOT):
+    if str(p) not in sys.path:
+        sys.path.append(str(p))
+
+from langchain_core.documents import Document
+from config.constants import EXAM_DIR, PDF_OPTIMIZE_PRESETS
+
+from doc_processing import pdf_generator
+from doc_processing.source_pool import SourcePool, READER_FACTORIES
+
+# mode -> (engine, overlay)
+MODES = {
+    "merge": ("pypdf", "merge"),
+    "xobject": ("pypdf", "xobject"),
+    "pymupdf": ("pymupdf", "xobject"),
+}
+
+
+def pack_documents(exams_dir, n_pages, pool):
+    '''`n_pages` page references cycling across every exam PDF in `exams_dir`'''
+    pdfs = sorted(f for f in os.listdir(exams_dir) if f.lower().endswith(".pdf"))
+    if not pdfs:
+        raise ValueError(f"No exam PDFs found in {exams_dir}")
+    page_counts = {}
+    for name in pdfs:
+        with pool.borrow(os.path.join(exams_dir, name)) as reader:
+            page_counts[name] = len(reader.pages)
+
+    docs, next_page = [], dict.fromkeys(pdfs, 0)
+    while len(docs) < n_pages:
+        added = False
+        for name in pdfs:
+            if len(docs) == n_pages:
+                break
+            if next_page[name] < page_counts[name]:
+                next_page[name] += 1
+                docs.append(Document(page_content="", metadata={"exam": Path(name).stem, "page": next_page[name]}))
+                added = True
+        if not added:
+            print(f"Only {len(docs)} pages available in {exams_dir}")
+            break
+    return docs
+
+
+def run(exams_dir, sizes, modes, repeats, optimize=None):
+    pools = {engine: SourcePool(reader_factory=factory) for engine, factory in READER_FACTORIES.items()}
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_pages in sizes:
+            docs = pack_documents(exams_dir, n_pages, pools["pypdf"])
+            for mode in modes:
+                engine, overlay = MODES[mode]
+                pool = pools[engine]
+                output_path = os.path.join(tmp, f"{mode}_{n_pages}.pdf")
+                times = []
+                for _ in range(repeats + 1):  # first run warms the overlay caches
+                    start = time.perf_counter()
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        pdf_generator.build_custom_pdf(docs, exams_dir, output_path, pool=pool,
+                                                      overlay=overlay, engine=engine, optimize=optimize)
+                    times.append(time.perf_counter() - start)
+                seconds = float(np.median(times[1:]))
+                row = {
+                    "mode": mode,
+                    "pages": len(docs),
+                    "build_ms": round(seconds * 1000, 1),
+                    "pages_per_sec": round(len(docs) / seconds, 1),
+                    "size_kb": round(os.path.getsize(output_path) / 1024, 1),
+                }
+                print(f"{mode:<8} pages={row['pages']:<4} build={row['build_ms']:>8.1f} ms  "
+                      f"{row['pages_per_sec']:>8.1f} pages/s  size={row['size_kb']:.0f} KB")
+                results.append(row)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--exams-dir", type=str, default=EXAM_DIR)
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--optimize", type=str, default=None, choices=list(PDF_OPTIMIZE_PRESETS),
+                        help="Output optimisation preset (default: none, assembly only)")
+    parser.add_argument("--json", type=str, default=None, help="Optional path to write results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.exams_dir, args.pages, args.modes, args.repeats, args.optimize)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
@@ -0,0 +1,111 @@
+'''
+Peak memory benchmark: in-memory PdfWriter vs streamed revision pack output.
+
+Modes:
+    pypdf     `build_custom_pdf(engine="pypdf")`, every page held by PdfWriter until the end
+    stream    `build_custom_pdf(engine="stream")`, pages written to the file as they are copied
+    iter      `pdf_stream.iter_custom_pdf`, chunks handed to a consumer that discards them
+
+Each mode runs in a fresh subprocess so peaks do not carry over. The exam PDFs are parsed
+before measuring starts, so the numbers are the cost of assembling and writing a pack on top
+of a warm reader pool. Reports the tracemalloc peak (Python heap) and the growth of the
+process's peak RSS, plus build time and output size.
+
+Usage:
+    python backend/benchmarks/pdf_stream_benchmark.py --pages 300
+'''
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import contextlib
+import subprocess
+import tracemalloc
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+SRC_ROOT = REPO_ROOT / "backend"
+for p in (REPO_ROOT, SRC_ROOT):
+    if str(p) not in sys.path:
+        sys.path.append(str(p))
+
+from config.constants import EXAM_DIR
+
+MODES = ("pypdf", "stream", "iter")
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+
+
+def measure(mode, exams_dir, n_pages) -> dict:
+    '''Runs one mode in this process and returns its measurements'''
+    from doc_processing import pdf_generator, pdf_stream
+    from doc_processing.source_pool import SourcePool
+    from benchmarks.pdf_overlay_benchmark import pack_documents
+
+    pool = SourcePool()
+    docs = pack_documents(exams_dir, n_pages, pool)
+    with tempfile.TemporaryDirectory() as tmp:
+        output_path = os.path.join(tmp, f"{mode}.pdf")
+        rss_before = peak_rss_mb()
+        tracemalloc.start()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            if mode == "iter":
+                size = sum(len(chunk) for chunk in pdf_stream.iter_custom_pdf(docs, exams_dir, pool=pool))
+            else:
+                pdf_generator.build_custom_pdf(docs, exams_dir, output_path, pool=pool, engine=mode, optimize=None)
+                size = os.path.getsize(output_path)
+        seconds = time.perf_counter() - start
+        _, heap_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        "mode": mode,
+        "pages": len(docs),
+        "build_ms": round(seconds * 1000, 1),
+        "heap_peak_mb": round(heap_peak / 2**20, 1),
+        "rss_growth_mb": round(peak_rss_mb() - rss_before, 1),
+        "size_kb": round(size / 1024, 1),
+    }
+
+
+def run(exams_dir, n_pages, modes):
+    results = []
+    for mode in modes:
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", mode, "--exams-dir", exams_dir, "--pages", str(n_pages)],
+            check=True, capture_output=True, text=True,
+        )
+        row = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{row['mode']:<7} pages={row['pages']:<4} build={row['build_ms']:>8.1f} ms  "
+              f"heap peak={row['heap_peak_mb']:>6.1f} MB  rss growth={row['rss_growth_mb']:>6.1f} MB  "
+              f"size={row['size_kb']:.0f} KB")
+        results.append(row)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--exams-dir", type=str, default=EXAM_DIR)
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    parser.add_argument("--child", choices=list(MODES), help=argparse.SUPPRESS)
+    parser.add_argument("--json", type=str, default=None, help="Optional path to write results as JSON")
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child, args.exams_dir, args.pages)))
+        sys.exit(0)
+
+    results = run(args.exams_dir, args.pages, args.modes)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
@@ -0,0 +1,85 @@
+'''
+Memory and throughput benchmark for multi-process query serving (`setup/worker_pool.py`).
+
+Modes:
+    prefork   parent loads models + corpus once, workers are forked and share them copy-on-write
+    spawn     every worker loads its own models + corpus (the naive multi-worker setup)
+
+For each mode and worker count, reports startup time, queries/sec over the syllabus
+subtopic queries, and per-worker RSS / PSS / USS after the run. PSS splits shared pages
+between the processes mapping them, so "total PSS" (workers + parent) is the real host footprint.
+
+Linux only (reads /proc/<pid>/smaps_rollup).
+
+Usage:
+    python backend/benchmarks/worker_memory_benchmark.py --workers 1 2 4 --queries 200
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+SRC_ROOT = REPO_ROOT / "backend"
+for p in (REPO_ROOT, SRC_ROOT):
+    if str(p) not in sys.path:
+        sys.path.append(str(p))
+
+from setup import worker_pool
+from benchmarks.batch_retrieval_benchmark import syllabus_queries
+
+
+def run_mode(mode, workers, queries, top_k):
+    '''Starts a pool, runs every query through it and returns one result row'''
+    start = time.perf_counter()
+    pool = worker_pool.WorkerPool(workers=workers, preload=(mode == "prefork"))
+    pool.start()
+    startup_s = time.perf_counter() - start
+
+    try:
+        start = time.perf_counter()
+        pool.search(queries, top_k=top_k)
+        elapsed = time.perf_counter() - start
+        memory = pool.memory()
+    finally:
+        pool.close()
+
+    parent = worker_pool.process_memory(os.getpid())
+    row = {
+        "mode": mode,
+        "workers": workers,
+        "startup_s": round(startup_s, 2),
+        "qps": round(len(queries) / elapsed, 2),
+        "worker_rss_mb": round(float(np.mean([m["rss_mb"] for m in memory])), 1),
+        "worker_pss_mb": round(float(np.mean([m["pss_mb"] for m in memory])), 1),
+        "worker_uss_mb": round(float(np.mean([m["uss_mb"] for m in memory])), 1),
+        "parent_pss_mb": parent["pss_mb"],
+        "total_pss_mb": round(sum(m["pss_mb"] for m in memory) + parent["pss_mb"], 1),
+    }
+    print(f"{mode:<8} workers={workers:<3} startup={row['startup_s']:.1f}s  qps={row['qps']:.2f}  "
+          f"per-worker rss={row['worker_rss_mb']:.0f}MB pss={row['worker_pss_mb']:.0f}MB "
+          f"uss={row['worker_uss_mb']:.0f}MB  total pss={row['total_pss_mb']:.0f}MB")
+    return row
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=["spawn", "prefork"], choices=["spawn", "prefork"])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--json", type=str, default=None, help="Optional path to write results as JSON")
+    args = parser.parse_args()
+
+    queries = syllabus_queries(args.queries)
+    # spawn runs first: once prefork has preloaded, the parent itself holds the models
+    modes = sorted(args.modes, key=lambda m: m != "spawn")
+    results = [run_mode(mode, n, queries, args.top_k) for mode in modes for n in args.workers]
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
@@ -0,0 +1,241 @@
+'''
+Bulk revision pack generation, e.g. one pack per syllabus subtopic at the start of term.
+
+    python backend/doc_processing/bulk_packs.py --syllabus            # every subtopic in data/syllabus/*.json
+    python backend/doc_processing/bulk_packs.py --topics "Chain rule" "Normal distribution"
+
+Steps:
+    1. retrieval and reranking for every topic in one `retrieval_pipeline.get_responses` batch
+    2. the exam PDFs the results use are parsed once into the process-wide `SourcePool`
+    3. packs are built through `PackCache` on a process pool; workers are forked after
+       step 2, so they share the parsed readers copy-on-write instead of each parsing them
+    4. each pack is linked into the output directory as <nn>-<topic>.pdf, and index.json
+       there lists every pack's questions with per-pack and total timings
+
+Topics whose results land on the same pages resolve to the same cached pack.
+'''
+from __future__ import annotations
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Tuple
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from config.constants import (
+    BULK_PACK_DIR,
+    BULK_PACK_WORKERS,
+    EXAM_DIR,
+    PDF_ENGINE,
+    PDF_ENGINES,
+    PDF_OPTIMIZE_PRESETS,
+    PROJECT_ROOT,
+)
+
+from doc_processing.pack_cache import PackCache
+from doc_processing.pdf_generator import group_pages_by_exam
+from doc_processing.source_pool import default_pool
+from setup import tracing
+
+# Set in the parent before the workers fork (or per worker under spawn)
+_cache = None
+
+
+def syllabus_topics(paths=None) -> List[Tuple[str, str]]:
+    '''
+    (tag, query) for every subtopic in the syllabus files, e.g.
+    ("Calculus / Chain rule", "Chain rule"); defaults to data/syllabus/*.json
+    '''
+    from doc_processing.process_questions import load_syllabus, syllabus_subtopics
+
+    paths = [Path(p) for p in paths] if paths else sorted((PROJECT_ROOT / "data" / "syllabus").glob("*.json"))
+    topics = {}
+    for path in paths:
+        for tag in syllabus_subtopics(load_syllabus(path)):
+            topics.setdefault(tag, tag.split(" / ")[-1])
+    return list(topics.items())
+
+
+def slugify(text: str, max_length=60) -> str:
+    '''Filesystem-safe version of a topic name'''
+    slug = re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")
+    return slug[:max_length].rstrip("-") or "pack"
+
+
+def _init_worker(quiet):
+    if quiet:
+        sys.stdout = open(os.devnull, "w")
+
+
+def _build_pack(docs, exams_dir, engine, optimize):
+    '''Runs in a worker: builds (or finds) one pack without touching the shared cache index'''
+    global _cache
+
+    if _cache is None:
+        _cache = PackCache()
+    hits = _cache.hits
+    stats = {}
+    start = time.perf_counter()
+    try:
+        path = _cache.get_or_build(docs, exams_dir, engine=engine, optimize=optimize, record=False, stats=stats)
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+    cached = _cache.hits > hits
+    return {
+        "path": path,
+        "cached": cached,
+        "build_ms": round((time.perf_counter() - start) * 1000, 1),
+        "pages": stats.get("pages"),
+        "optimize": stats.get("optimize"),
+    }
+
+
+def warm_readers(results, exams_dir, engine=PDF_ENGINE) -> int:
+    '''Parses every exam PDF the results use into the default pool; returns how many'''
+    pool = default_pool(engine)
+    labels = {d.metadata.get("exam") for docs in results for d in docs if d.metadata.get("exam")}
+    paths = {pool.resolve(exams_dir, label) for label in labels} - {None}
+    for name in paths:
+        with pool.borrow(os.path.join(exams_dir, name)):
+            pass
+    return len(paths)
+
+
+def _link(src, dst):
+    '''Hard-links the cached pack into the output directory (copies across filesystems)'''
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+@tracing.traced("bulk_packs.generate")
+def generate_packs(
+    topics: List[Tuple[str, str]],
+    retriever=None,
+    out_dir=None,
+    workers=BULK_PACK_WORKERS,
+    top_k=10,
+    exams_dir=EXAM_DIR,
+    engine=PDF_ENGINE,
+    optimize="default",
+    quiet=True,
+) -> dict:
+    '''
+    Builds one pack per (title, query) topic into `out_dir` (default: a timestamped folder
+    in BULK_PACK_DIR) and writes `out_dir`/index.json. Returns the index.
+    '''
+    global _cache
+    from ai_calls import retrieval_pipeline
+    from setup import retriever_setup
+
+    total_start = time.perf_counter()
+    retriever = retriever or retriever_setup.load_persisted_retriever()
+    if retriever is None:
+        raise ValueError("Retriever has no questions loaded")
+
+    start = time.perf_counter()
+    results = retrieval_pipeline.get_responses([query for _, query in topics], retriever, top_k=top_k)
+    retrieval_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    n_readers = warm_readers(results, exams_dir, engine)
+    readers_s = time.perf_counter() - start
+    print(f"Parsed {n_readers} exam PDFs in {readers_s:.1f}s")
+
+    _cache = PackCache()
+    workers = workers or os.cpu_count() or 1
+    # Fork shares the parsed readers and the loaded models with the workers copy-on-write
+    ctx = mp.get_context("fork" if "fork" in mp.get_all_start_methods() else "spawn")
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker, initargs=(quiet,)) as pool:
+        futures = [pool.submit(_build_pack, docs, exams_dir, engine, optimize) for docs in results]
+        built = [f.result() for f in futures]
+    build_s = time.perf_counter() - start
+
+    out_dir = out_dir or os.path.join(BULK_PACK_DIR, time.strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(out_dir, exist_ok=True)
+    width = len(str(len(topics)))
+    packs = []
+    for i, ((title, query), docs, outcome) in enumerate(zip(topics, results, built), start=1):
+        entry = {
+            "topic": title,
+            "query": query,
+            "questions": [
+                {k: d.metadata.get(k) for k in ("id", "exam", "page", "tags")}
+                for d in docs
+            ],
+            **outcome,
+        }
+        if outcome.get("path"):
+            key = Path(outcome["path"]).stem
+            entry["pages"] = entry["pages"] or sum(len(p) for p in group_pages_by_exam(docs).values())
+            entry["file"] = f"{i:0{width}d}-{slugify(title)}.pdf"
+            _link(outcome["path"], os.path.join(out_dir, entry["file"]))
+            _cache.record(key, query, pages=entry["pages"])
+        packs.append(entry)
+    _cache.evict()
+
+    index = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "engine": engine,
+        "optimize": optimize,
+        "timings": {
+            "retrieval_s": round(retrieval_s, 2),
+            "readers_s": round(readers_s, 2),
+            "build_s": round(build_s, 2),
+            "total_s": round(time.perf_counter() - total_start, 2),
+        },
+        "counts": {
+            "packs": len(packs),
+            "built": sum(1 for p in packs if p.get("path") and not p["cached"]),
+            "cached": sum(1 for p in packs if p.get("cached")),
+            "failed": sum(1 for p in packs if not p.get("path")),
+            "workers": workers,
+        },
+        "packs": packs,
+    }
+    index_path = os.path.join(out_dir, "index.json")
+    with open(index_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2)
+
+    t, c = index["timings"], index["counts"]
+    print(f"{c['packs']} packs ({c['built']} built, {c['cached']} cached, {c['failed']} failed) in {t['total_s']:.1f}s: "
+          f"retrieval {t['retrieval_s']:.1f}s, readers {t['readers_s']:.1f}s, build {t['build_s']:.1f}s "
+          f"on {workers} workers")
+    for p in packs:
+        if p.get("error"):
+            print(f"  FAILED {p['topic']}: {p['error']}")
+    print(f"Index written to {index_path}")
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--topics", nargs="+", help="Topics to build packs for (used as the queries)")
+    source.add_argument("--syllabus", nargs="*", metavar="JSON",
+                        help="Every subtopic of these syllabus files (default: data/syllabus/*.json)")
+    parser.add_argument("--limit", type=int, default=None, help="Only the first N topics")
+    parser.add_argument("--out", type=str, default=None, help="Output directory (default: a timestamped folder in BULK_PACK_DIR)")
+    parser.add_argument("--workers", type=int, default=BULK_PACK_WORKERS, help="PDF build processes (0 = one per CPU)")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--engine", choices=PDF_ENGINES, default=PDF_ENGINE)
+    parser.add_argument("--optimize", choices=["default", *PDF_OPTIMIZE_PRESETS], default="default",
+                        help="Output preset (default: PDF_OPTIMIZE, none for the stream engine)")
+    args = parser.parse_args()
+
+    topics = [(t, t) for t in args.topics] if args.topics else syllabus_topics(args.syllabus)
+    topics = topics[:args.limit] if args.limit else topics
+    generate_packs(topics, out_dir=args.out, workers=args.workers, top_k=args.top_k,
+                   engine=args.engine, optimize=args.optimize)
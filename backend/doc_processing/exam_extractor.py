@@ -426,12 +426,8 @@ def process_exams(pickle_path):
         f for f in os.listdir(EXAM_DIR) if f.endswith(".pdf")
     )
 
-    # Helper to normalize names for comparison
-    def normalize_name(name):
-        return name.lower().replace("-", " ").replace(".pdf", "").strip()
-
     # Create a mapping of normalized names to actual filenames
-    filename_map = {normalize_name(f): f for f in uploaded_exams}
+    filename_map = {helpers.normalize_exam_name(f): f for f in uploaded_exams}
 
     # ---------------------------------------------
     # Load existing pickle
@@ -463,7 +459,7 @@ def process_exams(pickle_path):
                     
                     if raw_exam_name:
                         # Try to resolve to an actual filename
-                        norm_name = normalize_name(raw_exam_name)
+                        norm_name = helpers.normalize_exam_name(raw_exam_name)
                         actual_filename = filename_map.get(norm_name) or raw_exam_name
                         
                         processed_exam_names.add(actual_filename)
@@ -1,6 +1,12 @@
+from __future__ import annotations
+
 import re
-from typing import Iterable, List, Union
-from langchain_core.documents import Document
+import json
+import hashlib
+from typing import TYPE_CHECKING, Iterable, List, Union
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
 
 
 def flatten(items: Iterable[Union[list, tuple, any]]) -> List:
@@ -23,6 +29,53 @@ def docs_to_texts_and_meta(docs: List[Document]):
     )
 
 
+def content_hash(doc: Document) -> str:
+    '''
+    Returns a SHA-1 digest of a Document's indexed text and metadata.
+    Any change to either means the stored vector (or its metadata) is stale.
+    '''
+    payload = json.dumps(
+        {"text": doc.page_content, "metadata": doc.metadata},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def text_hash(text: str) -> str:
+    '''
+    SHA-1 of a text on its own. Embeddings depend on the text only, so metadata
+    changes (e.g. re-tagging) never mark a stored vector stale.
+    '''
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def normalize_exam_name(name: str) -> str:
+    '''
+    Normalises an exam filename or label for matching, e.g. "2023-HSC-Maths.pdf" -> "2023 hsc maths"
+    '''
+    return name.lower().replace("-", " ").replace(".pdf", "").strip()
+
+
+def exam_name_table(filenames: Iterable[str]) -> dict:
+    '''
+    Maps each PDF's lowercased filename and its normalised name to the actual filename,
+    so stored exam labels resolve whether or not they were normalised
+    '''
+    table = {}
+    for f in filenames:
+        if f.endswith(".pdf"):
+            table[normalize_exam_name(f)] = f
+            table[f.lower()] = f
+    return table
+
+
+def resolve_exam_name(table: dict, label: str):
+    '''Looks up an exam label in an `exam_name_table`: exact (lowercased) first, then normalised'''
+    return table.get(label.lower()) or table.get(normalize_exam_name(label))
+
+
 def print_question(data, exam_name, question_number):
     '''
     Prints the specified printed question (e.g. Question 29)
@@ -0,0 +1,223 @@
+'''
+Content-addressed cache of generated revision packs.
+
+A pack is fully determined by the pages it contains, in output order, the bytes of the
+exam PDFs they come from and the generator code. Its key is a SHA-256 over
+
+    PDF_GENERATOR_VERSION, engine, overlay, optimisation options,
+    [(exam PDF, page, SHA-1 of the exam PDF), ...]
+
+so two queries whose results land on the same pages share one file, and replacing an exam
+PDF or bumping the generator version produces a new key. Packs are stored as
+
+    <PACK_CACHE_DIR>/
+        <key>.pdf
+        index.json   {"packs": {key: {"bytes", "pages", "created", "last_used"}},
+                      "queries": {normalised query: key}}
+
+The pack files are the source of truth: a pack missing from the index (written by another
+process, or the index was lost) is still served. Once the directory grows past
+PACK_CACHE_MAX_MB the least recently used packs are deleted.
+'''
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from config.constants import PACK_CACHE_DIR, PACK_CACHE_MAX_MB, PDF_ENGINE
+
+from ai_calls.query_cache import normalise_query
+from doc_processing import pdf_generator
+from doc_processing.source_pool import default_pool
+from setup import tracing
+
+
+def pack_key(sources, fingerprints, engine=PDF_ENGINE, overlay="xobject", optimize="default") -> str:
+    '''
+    Key of the pack built from `sources` ([(pdf filename, pages)], see
+    `pdf_generator.pack_sources`); `fingerprints` maps each filename to its content hash
+    '''
+    payload = json.dumps({
+        "version": pdf_generator.PDF_GENERATOR_VERSION,
+        "engine": engine,
+        "overlay": overlay,
+        "optimize": pdf_generator.optimize_options(optimize, engine),
+        "pages": [[name, page, fingerprints[name]] for name, pages in sources for page in pages],
+    }, separators=(",", ":"), sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class PackCache:
+    '''
+    Builds revision packs through `pdf_generator.build_custom_pdf` only when no pack with
+    the same key exists, and remembers which pack each query produced
+    '''
+
+    def __init__(self, root=PACK_CACHE_DIR, max_bytes=PACK_CACHE_MAX_MB * 2**20, pool=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.pool = pool
+        self.index_path = os.path.join(root, "index.json")
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def path(self, key) -> str:
+        return os.path.join(self.root, f"{key}.pdf")
+
+    def key_for(self, retrieved_docs, exams_dir, engine=PDF_ENGINE, overlay="xobject", optimize="default") -> str | None:
+        '''Key of the pack `retrieved_docs` would produce, or None if no page resolves to a PDF'''
+        pool = self.pool or default_pool(engine)
+        sources = pdf_generator.pack_sources(retrieved_docs, exams_dir, pool)
+        if not sources:
+            return None
+        fingerprints = {name: pool.fingerprint(os.path.join(exams_dir, name)) for name, _ in sources}
+        return pack_key(sources, fingerprints, engine, overlay, optimize)
+
+    @tracing.traced("pack_cache.get_or_build")
+    def get_or_build(self, retrieved_docs, exams_dir, query=None, engine=PDF_ENGINE, overlay="xobject",
+                     optimize="default", record=True, stats=None) -> str | None:
+        '''
+        Path of the pack for `retrieved_docs`, building it on a miss. `query`, if given,
+        is mapped to the pack for `pack_for_query`. Returns None when nothing resolves.
+
+        With `record=False` the index is left alone and nothing is evicted, for callers that
+        build from several processes and call `record` / `evict` once themselves. `stats`,
+        if given, is filled in with the build's stats (see `build_custom_pdf`); it stays
+        empty on a cache hit.
+        '''
+        key = self.key_for(retrieved_docs, exams_dir, engine, overlay, optimize)
+        if key is None:
+            print("No exam pages found for a revision pack")
+            return None
+        path = self.path(key)
+
+        if os.path.exists(path):
+            with self._lock:
+                self.hits += 1
+            if record:
+                self.record(key, query)
+            print(f"PDF reused from cache: {path}")
+            return path
+
+        with self._lock:
+            self.misses += 1
+        os.makedirs(self.root, exist_ok=True)
+        # Unique temporary name: concurrent builds of the same key each write their own
+        # file and the identical results replace one another atomically
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        stats = {} if stats is None else stats
+        try:
+            pdf_generator.build_custom_pdf(retrieved_docs, exams_dir, tmp_path, pool=self.pool, overlay=overlay,
+                                           engine=engine, optimize=optimize, stats=stats)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        if record:
+            self.record(key, query, pages=stats.get("pages"))
+            self.evict(keep=key)
+        return path
+
+    def pack_for_query(self, query) -> str | None:
+        '''Path of the most recent pack built or served for `query`, if still cached'''
+        key = self._load_index()["queries"].get(normalise_query(query))
+        if key is None or not os.path.exists(self.path(key)):
+            return None
+        return self.path(key)
+
+    # -----------------------------
+    # Index and eviction
+    # -----------------------------
+    def _load_index(self) -> dict:
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            index = {}
+        index.setdefault("packs", {})
+        index.setdefault("queries", {})
+        return index
+
+    def _save_index(self, index):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def record(self, key, query=None, pages=None):
+        '''Notes a use of pack `key` in the index, mapping `query` to it'''
+        now = time.time()
+        with self._lock:
+            index = self._load_index()
+            entry = index["packs"].setdefault(key, {"created": now})
+            entry["last_used"] = now
+            if pages is not None:
+                entry["pages"] = pages
+            try:
+                entry["bytes"] = os.path.getsize(self.path(key))
+            except FileNotFoundError:
+                pass
+            if query:
+                index["queries"][normalise_query(query)] = key
+            self._save_index(index)
+
+    def evict(self, keep=None) -> int:
+        '''Deletes least recently used packs until the cache fits in `max_bytes`; returns bytes freed'''
+        with self._lock:
+            index = self._load_index()
+            files = []
+            for entry in os.scandir(self.root) if os.path.isdir(self.root) else []:
+                if entry.name.endswith(".pdf"):
+                    key = entry.name[:-len(".pdf")]
+                    stat = entry.stat()
+                    last_used = index["packs"].get(key, {}).get("last_used", stat.st_mtime)
+                    files.append((last_used, key, stat.st_size))
+
+            total = sum(size for _, _, size in files)
+            freed = 0
+            for _, key, size in sorted(files):
+                if total - freed <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                try:
+                    os.remove(self.path(key))
+                except FileNotFoundError:
+                    pass
+                freed += size
+                self.evictions += 1
+                index["packs"].pop(key, None)
+
+            on_disk = {key for _, key, _ in files}
+            stale = [key for key in index["packs"] if key not in on_disk]
+            for key in stale:
+                del index["packs"][key]
+            if freed or stale:
+                index["queries"] = {q: k for q, k in index["queries"].items() if k in index["packs"]}
+                self._save_index(index)
+            if freed:
+                print(f"Pack cache: evicted {freed / 2**20:.2f} MB")
+            return freed
+
+    def stats(self) -> dict:
+        index = self._load_index()
+        total = self.hits + self.misses
+        return {
+            "packs": len(index["packs"]),
+            "queries": len(index["queries"]),
+            "bytes": sum(p.get("bytes", 0) for p in index["packs"].values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
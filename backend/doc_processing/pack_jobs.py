@@ -0,0 +1,508 @@
+'''
+Background queue for revision pack builds, so a search never waits for PDF assembly.
+
+    queue = PackJobQueue().start()
+    job = queue.submit(docs, query="chain rule")    # returns at once: {"id", "status", ...}
+    queue.get(job["id"])                            # poll: queued -> running -> done | failed
+    queue.wait(job["id"], timeout=60)               # or block until it finishes
+
+A job is identified by its pack key (see pack_cache.py):
+    - a pack that is already cached completes at submission, without queueing
+    - a submission whose key matches a queued or running job returns that job instead of
+      building the same pack twice
+    - a failed build is retried up to JOB_MAX_ATTEMPTS times, with a delay of
+      JOB_RETRY_DELAY seconds doubling after each failure
+
+Two stores, no broker:
+    MemoryJobStore   in-process, for a single server (JOB_BACKEND = "memory")
+    SQLiteJobStore   a SQLite file shared by several processes. Claiming a job takes a
+                     lease of JOB_LEASE seconds, which the building worker renews every
+                     JOB_LEASE / 3 seconds; a job whose worker died is taken over once its
+                     lease runs out. Extra build processes run
+
+                         python backend/doc_processing/pack_jobs.py worker --threads 4
+'''
+from __future__ import annotations
+
+import os
+import sys
+import time
+import uuid
+import pickle
+import sqlite3
+import argparse
+import threading
+import contextlib
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from config.constants import (
+    EXAM_DIR,
+    JOB_BACKEND,
+    JOB_DB_PATH,
+    JOB_LEASE,
+    JOB_MAX_ATTEMPTS,
+    JOB_MAX_QUEUED,
+    JOB_RETENTION,
+    JOB_RETRY_DELAY,
+    JOB_WORKERS,
+    PDF_ENGINE,
+)
+
+from doc_processing.pack_cache import PackCache
+from setup import tracing
+
+STATUSES = ("queued", "running", "done", "failed")
+FIELDS = ("id", "key", "status", "query", "attempts", "max_attempts", "error", "path",
+          "created", "started", "finished", "run_after")
+
+
+class QueueFull(Exception):
+    '''The queue already holds JOB_MAX_QUEUED jobs waiting to run'''
+
+
+def _new_job(key, query, max_attempts, payload, path=None) -> dict:
+    now = time.time()
+    return {
+        "id": uuid.uuid4().hex,
+        "key": key,
+        "status": "done" if path else "queued",
+        "query": query,
+        "attempts": 0,
+        "max_attempts": max_attempts,
+        "error": None,
+        "path": path,
+        "created": now,
+        "started": None,
+        "finished": now if path else None,
+        "run_after": now,
+        "payload": None if path else payload,
+    }
+
+
+def _public(job) -> dict | None:
+    return {k: job[k] for k in FIELDS} if job else None
+
+
+def retry_delay(attempts, base=JOB_RETRY_DELAY) -> float:
+    '''Seconds before the next try of a job that has failed `attempts` times'''
+    return base * 2 ** (attempts - 1)
+
+
+class MemoryJobStore:
+    '''In-process job store; jobs are lost when the process exits'''
+
+    def __init__(self, max_queued=JOB_MAX_QUEUED, retention=JOB_RETENTION):
+        self.max_queued = max_queued
+        self.retention = retention
+        self._jobs = {}  # id -> job, in submission order
+        self._active = {}  # pack key -> id of its queued or running job
+        self._changed = threading.Condition()
+
+    def submit(self, key, payload, query=None, max_attempts=JOB_MAX_ATTEMPTS, path=None):
+        '''Adds a job (done already if `path` is given); returns (job, created)'''
+        with self._changed:
+            self._prune()
+            active = self._active.get(key)
+            if active is not None and path is None:
+                return _public(self._jobs[active]), False
+            if path is None and sum(1 for j in self._jobs.values() if j["status"] == "queued") >= self.max_queued:
+                raise QueueFull(f"{self.max_queued} pack builds already queued")
+            job = _new_job(key, query, max_attempts, payload, path)
+            self._jobs[job["id"]] = job
+            if path is None:
+                self._active[key] = job["id"]
+            self._changed.notify_all()
+            return _public(job), True
+
+    def claim(self, worker, timeout=1.0):
+        '''Marks the next runnable job as running and returns it with its payload, or None'''
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                now = time.time()
+                for job in self._jobs.values():
+                    if job["status"] == "queued" and job["run_after"] <= now:
+                        job.update(status="running", started=now, attempts=job["attempts"] + 1, worker=worker)
+                        return {**_public(job), "payload": job["payload"]}
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._changed.wait(remaining)
+
+    def finish(self, job_id, path):
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is not None and job["status"] == "running":
+                job.update(status="done", path=path, error=None, finished=time.time(), payload=None)
+                self._active.pop(job["key"], None)
+            self._changed.notify_all()
+
+    def fail(self, job_id, error):
+        '''Requeues the job with a delay, or marks it failed once it is out of attempts'''
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is not None and job["status"] == "running":
+                job["error"] = error
+                if job["attempts"] < job["max_attempts"]:
+                    job.update(status="queued", run_after=time.time() + retry_delay(job["attempts"]))
+                else:
+                    job.update(status="failed", finished=time.time(), payload=None)
+                    self._active.pop(job["key"], None)
+            self._changed.notify_all()
+
+    def get(self, job_id) -> dict | None:
+        with self._changed:
+            return _public(self._jobs.get(job_id))
+
+    def wait(self, job_id, timeout=None) -> dict | None:
+        '''Blocks until the job is done or failed (or `timeout` passes); returns it'''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._changed:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None or job["status"] in ("done", "failed"):
+                    return _public(job)
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return _public(job)
+                self._changed.wait(remaining)
+
+    def counts(self) -> dict:
+        with self._changed:
+            counts = dict.fromkeys(STATUSES, 0)
+            for job in self._jobs.values():
+                counts[job["status"]] += 1
+            return counts
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        for job_id in [i for i, j in self._jobs.items() if j["finished"] is not None and j["finished"] < cutoff]:
+            del self._jobs[job_id]
+
+
+class SQLiteJobStore:
+    '''
+    Job store in a SQLite file that any number of processes can submit to and work on.
+    Each thread uses its own connection; claims run in an IMMEDIATE transaction, so two
+    workers never take the same job.
+    '''
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            key TEXT NOT NULL,
+            status TEXT NOT NULL,
+            query TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            error TEXT,
+            path TEXT,
+            created REAL NOT NULL,
+            started REAL,
+            finished REAL,
+            run_after REAL NOT NULL,
+            lease_until REAL,
+            worker TEXT,
+            payload BLOB
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_key ON jobs (key) WHERE status IN ('queued', 'running');
+        CREATE INDEX IF NOT EXISTS jobs_runnable ON jobs (status, run_after);
+    """
+
+    def __init__(self, path=JOB_DB_PATH, max_queued=JOB_MAX_QUEUED, retention=JOB_RETENTION,
+                 lease=JOB_LEASE, poll_interval=0.5):
+        self.path = path
+        self.max_queued = max_queued
+        self.retention = retention
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection().executescript(self.SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def submit(self, key, payload, query=None, max_attempts=JOB_MAX_ATTEMPTS, path=None):
+        '''Adds a job (done already if `path` is given); returns (job, created)'''
+        with self._transaction() as db:
+            db.execute("DELETE FROM jobs WHERE finished < ?", (time.time() - self.retention,))
+            if path is None:
+                active = db.execute("SELECT * FROM jobs WHERE key = ? AND status IN ('queued', 'running')", (key,)).fetchone()
+                if active is not None:
+                    return _public(dict(active)), False
+                (queued,) = db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()
+                if queued >= self.max_queued:
+                    raise QueueFull(f"{self.max_queued} pack builds already queued")
+            job = _new_job(key, query, max_attempts, payload, path)
+            db.execute(
+                f"INSERT INTO jobs ({', '.join(FIELDS)}, payload) VALUES ({', '.join('?' * (len(FIELDS) + 1))})",
+                [job[k] for k in FIELDS] + [job["payload"]],
+            )
+            return _public(job), True
+
+    def claim(self, worker, timeout=1.0):
+        '''
+        Marks the next runnable job as running and returns it with its payload, or None.
+        A running job whose lease has expired (its worker died) is runnable again, unless
+        it has no attempts left, in which case it is failed.
+        '''
+        deadline = time.monotonic() + timeout
+        while True:
+            now = time.time()
+            with self._transaction() as db:
+                db.execute(
+                    "UPDATE jobs SET status = 'failed', finished = ?, payload = NULL, "
+                    "error = COALESCE(error, 'Worker lost (lease expired)') "
+                    "WHERE status = 'running' AND lease_until < ? AND attempts >= max_attempts",
+                    (now, now),
+                )
+                row = db.execute(
+                    "SELECT * FROM jobs WHERE (status = 'queued' AND run_after <= ?) "
+                    "OR (status = 'running' AND lease_until < ?) ORDER BY created LIMIT 1",
+                    (now, now),
+                ).fetchone()
+                if row is not None:
+                    db.execute(
+                        "UPDATE jobs SET status = 'running', started = ?, attempts = attempts + 1, "
+                        "lease_until = ?, worker = ? WHERE id = ?",
+                        (now, now + self.lease, worker, row["id"]),
+                    )
+                    job = dict(row)
+                    job.update(status="running", started=now, attempts=row["attempts"] + 1)
+                    return {**_public(job), "payload": job["payload"]}
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(min(self.poll_interval, max(0.0, deadline - time.monotonic())))
+
+    def finish(self, job_id, path):
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE jobs SET status = 'done', path = ?, error = NULL, finished = ?, payload = NULL "
+                "WHERE id = ? AND status = 'running'",
+                (path, time.time(), job_id),
+            )
+
+    def renew(self, job_id, worker) -> bool:
+        '''Extends the lease of a job `worker` is still running; False if it lost the job'''
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running' AND worker = ?",
+                (time.time() + self.lease, job_id, worker),
+            )
+            return cursor.rowcount > 0
+
+    def fail(self, job_id, error):
+        '''Requeues the job with a delay, or marks it failed once it is out of attempts'''
+        with self._transaction() as db:
+            row = db.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ? AND status = 'running'",
+                             (job_id,)).fetchone()
+            if row is None:
+                return
+            if row["attempts"] < row["max_attempts"]:
+                db.execute("UPDATE jobs SET status = 'queued', error = ?, run_after = ?, lease_until = NULL WHERE id = ?",
+                           (error, time.time() + retry_delay(row["attempts"]), job_id))
+            else:
+                db.execute("UPDATE jobs SET status = 'failed', error = ?, finished = ?, payload = NULL WHERE id = ?",
+                           (error, time.time(), job_id))
+
+    def get(self, job_id) -> dict | None:
+        row = self._connection().execute(f"SELECT {', '.join(FIELDS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def wait(self, job_id, timeout=None) -> dict | None:
+        '''Polls until the job is done or failed (or `timeout` passes); returns it'''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job["status"] in ("done", "failed"):
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                return job
+            time.sleep(self.poll_interval)
+
+    def counts(self) -> dict:
+        rows = self._connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {**dict.fromkeys(STATUSES, 0), **{status: n for status, n in rows}}
+
+
+def open_store(backend=JOB_BACKEND, path=JOB_DB_PATH):
+    if backend == "memory":
+        return MemoryJobStore()
+    if backend == "sqlite":
+        return SQLiteJobStore(path)
+    raise ValueError(f"Unknown job backend '{backend}' (expected 'memory' or 'sqlite')")
+
+
+class PackJobQueue:
+    '''
+    Submits pack builds to a job store and runs `workers` build threads on it. With
+    `workers=0` this process only submits and polls; other processes sharing the SQLite
+    store do the building.
+    '''
+
+    def __init__(self, store=None, workers=JOB_WORKERS, cache=None, exams_dir=EXAM_DIR,
+                 engine=PDF_ENGINE, optimize="default", max_attempts=JOB_MAX_ATTEMPTS):
+        self.store = store or open_store()
+        self.workers = workers
+        self.cache = cache or PackCache()
+        self.exams_dir = exams_dir
+        self.engine = engine
+        self.optimize = optimize
+        self.max_attempts = max_attempts
+        self.submitted = 0
+        self.deduplicated = 0
+        self.cached = 0
+        self._threads = []
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.run_worker, name=f"pack-job-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def submit(self, retrieved_docs, query=None) -> dict | None:
+        '''
+        Queues a build of the pack for `retrieved_docs` and returns its job at once.
+        Returns None when no page resolves to an exam PDF; raises QueueFull when the
+        queue is at capacity.
+        '''
+        key = self.cache.key_for(retrieved_docs, self.exams_dir, self.engine, optimize=self.optimize)
+        if key is None:
+            return None
+        path = self.cache.path(key)
+        if os.path.exists(path):
+            self.cache.record(key, query)
+            job, _ = self.store.submit(key, None, query, self.max_attempts, path=path)
+            with self._lock:
+                self.cached += 1
+            return job
+
+        payload = pickle.dumps({
+            "docs": list(retrieved_docs),
+            "exams_dir": self.exams_dir,
+            "engine": self.engine,
+            "optimize": self.optimize,
+        })
+        job, created = self.store.submit(key, payload, query, self.max_attempts)
+        with self._lock:
+            if created:
+                self.submitted += 1
+            else:
+                self.deduplicated += 1
+        return job
+
+    def get(self, job_id) -> dict | None:
+        return self.store.get(job_id)
+
+    def wait(self, job_id, timeout=None) -> dict | None:
+        return self.store.wait(job_id, timeout)
+
+    def run_worker(self):
+        '''Claims and builds jobs until `close` is called'''
+        worker = f"{os.getpid()}-{threading.current_thread().name}"
+        while not self._stop.is_set():
+            job = self.store.claim(worker, timeout=1.0)
+            if job is not None:
+                self._run(job, worker)
+
+    def _heartbeat(self, job_id, worker, done):
+        '''Renews the job's lease every third of it until `done` is set'''
+        while not done.wait(self.store.lease / 3):
+            try:
+                if not self.store.renew(job_id, worker):
+                    return
+            except sqlite3.Error as e:
+                print(f"Pack job {job_id}: lease renewal failed: {e}")
+
+    def _run(self, job, worker):
+        if not getattr(self.store, "lease", None):  # MemoryJobStore: no lease to keep alive
+            return self._build(job)
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job["id"], worker, done),
+                                     name=f"{threading.current_thread().name}-lease", daemon=True)
+        heartbeat.start()
+        try:
+            self._build(job)
+        finally:
+            done.set()
+            heartbeat.join()
+
+    def _build(self, job):
+        try:
+            with tracing.span("pack_job.build", job=job["id"], attempt=job["attempts"]):
+                spec = pickle.loads(job["payload"])
+                path = self.cache.get_or_build(spec["docs"], spec["exams_dir"], query=job["query"],
+                                               engine=spec["engine"], optimize=spec["optimize"])
+            if path is None:
+                raise ValueError("No exam pages found for a revision pack")
+        except Exception as e:
+            print(f"Pack job {job['id']} failed (attempt {job['attempts']}/{job['max_attempts']}): {e}")
+            self.store.fail(job["id"], f"{type(e).__name__}: {e}")
+        else:
+            self.store.finish(job["id"], path)
+
+    def close(self, timeout=5):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.store.counts(),
+                "submitted": self.submitted,
+                "deduplicated": self.deduplicated,
+                "already_cached": self.cached,
+                "workers": self.workers,
+            }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    worker = sub.add_parser("worker", help="Build queued packs from the SQLite job store")
+    worker.add_argument("--db", type=str, default=JOB_DB_PATH)
+    worker.add_argument("--threads", type=int, default=JOB_WORKERS)
+
+    status = sub.add_parser("status", help="Print job counts, or one job")
+    status.add_argument("job_id", nargs="?")
+    status.add_argument("--db", type=str, default=JOB_DB_PATH)
+
+    args = parser.parse_args()
+    store = SQLiteJobStore(args.db)
+    if args.command == "status":
+        print(store.get(args.job_id) if args.job_id else store.counts())
+    else:
+        queue = PackJobQueue(store, workers=args.threads).start()
+        print(f"Building packs from {args.db} on {args.threads} threads (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            queue.close()
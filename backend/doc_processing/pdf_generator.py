@@ -1,11 +1,35 @@
 import os
 import io
+import sys
+import time
+from pathlib import Path
 from collections import defaultdict
+from functools import lru_cache
 from pypdf import PdfReader, PdfWriter, PageObject
+from pypdf.generic import ArrayObject, DecodedStreamObject, DictionaryObject, FloatObject, NameObject
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 from reportlab.lib import colors  
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from config.constants import (
+    PDF_ENGINE,
+    PDF_ENGINES,
+    PDF_IMAGE_QUALITY,
+    PDF_OPTIMIZE,
+    PDF_OPTIMIZE_PRESETS,
+    PDF_STREAM_OPTIMIZE,
+)
+from setup import tracing
+from doc_processing.source_pool import FITZ_LOCK, default_pool
+
+# Bump whenever a change alters the bytes of generated packs; part of every `PackCache` key
+PDF_GENERATOR_VERSION = 2
+
+# Timings and reader-pool stats of the most recent `build_custom_pdf` call in this process.
+# Concurrent builds overwrite it; pass `stats` to `build_custom_pdf` to get a build's own
+last_build_stats = {}
+
 # -----------------------------
 # Group retrieved docs by exam
 # -----------------------------
@@ -23,6 +47,21 @@ def group_pages_by_exam(docs):
             print(f"Warning: Document missing 'exam' or 'page' metadata: {doc.metadata}")
     return pages_by_exam
 
+
+def pack_sources(docs, exams_dir, pool):
+    '''
+    The pages a pack is built from, in output order: [(pdf filename, sorted 0-based pages)],
+    skipping exams with no matching PDF in `exams_dir`
+    '''
+    sources = []
+    for exam_label, pages in group_pages_by_exam(docs).items():
+        pdf_filename = pool.resolve(exams_dir, exam_label)
+        if not pdf_filename:
+            print(f"Warning: Could not find a PDF matching '{exam_label}' in {exams_dir}")
+            continue
+        sources.append((pdf_filename, sorted(pages)))
+    return sources
+
 # -----------------------------
 # Create header overlay page
 # -----------------------------
@@ -57,55 +96,291 @@ def create_header_page(original_page, label_text):
     merged_page.merge_page(header_page)
     return merged_page
 
+
+@lru_cache(maxsize=256)
+def header_overlay(label_text, width, height):
+    '''
+    Renders the red header once per (label, page size) and returns the overlay page.
+    The text sits where `create_header_page` draws it, so output is unchanged.
+    '''
+    packet = io.BytesIO()
+    can = canvas.Canvas(packet, pagesize=(width, height))
+    can.setFont("Helvetica-Bold", 12)
+    can.setFillColor(colors.red)
+    can.drawString(40, 780, label_text)
+    can.save()
+    packet.seek(0)
+    return PdfReader(packet).pages[0]
+
+
+class HeaderStamper:
+    '''
+    Stamps header overlays onto pages already added to `writer`, in one pass.
+
+    Each (label, page size) overlay is added to the output once as a form XObject; a page
+    is stamped by referencing it from its resources and appending a tiny "Do" content
+    stream. The original content is wrapped in q/Q so its graphics state cannot leak into
+    the stamp. No blank page, no page merge, no per-page overlay copy.
+    '''
+
+    def __init__(self, writer: PdfWriter):
+        self.writer = writer
+        self._xobjects = {}
+        self._save_state = self._stream(b"q\n")
+
+    def _stream(self, data: bytes):
+        stream = DecodedStreamObject()
+        stream.set_data(data)
+        return self.writer._add_object(stream)
+
+    def _xobject(self, label_text, width, height):
+        key = (label_text, width, height)
+        if key not in self._xobjects:
+            overlay = header_overlay(label_text, width, height)
+            form = DecodedStreamObject()
+            form.set_data(overlay.get_contents().get_data())
+            form.update({
+                NameObject("/Type"): NameObject("/XObject"),
+                NameObject("/Subtype"): NameObject("/Form"),
+                NameObject("/BBox"): ArrayObject([FloatObject(0), FloatObject(0), FloatObject(width), FloatObject(height)]),
+                NameObject("/Resources"): overlay["/Resources"].get_object().clone(self.writer),
+            })
+            name = NameObject(f"/HSCHeader{len(self._xobjects)}")
+            draw = self._stream(f"Q q {name} Do Q\n".encode())
+            self._xobjects[key] = (name, self.writer._add_object(form), draw)
+        return self._xobjects[key]
+
+    def stamp(self, page: PageObject, label_text):
+        '''Stamps `label_text` onto a page that belongs to the writer'''
+        width, height = float(page.mediabox.width), float(page.mediabox.height)
+        name, form_ref, draw = self._xobject(label_text, width, height)
+
+        # Copy the resource dicts so pages sharing them (common within one exam) stay independent
+        resources = DictionaryObject(page.get("/Resources", DictionaryObject()).get_object())
+        xobjects = DictionaryObject(resources.get("/XObject", DictionaryObject()).get_object())
+        xobjects[name] = form_ref
+        resources[NameObject("/XObject")] = xobjects
+        page[NameObject("/Resources")] = resources
+
+        contents = page.get("/Contents")
+        if contents is None:
+            existing = []
+        elif isinstance(contents.get_object(), ArrayObject):
+            existing = list(contents.get_object())
+        else:
+            existing = [contents]
+        page[NameObject("/Contents")] = ArrayObject([self._save_state, *existing, draw])
+        return page
+
 # -----------------------------
 # Build custom PDF with labels
 # -----------------------------
+@tracing.traced("pdf.build")
 def build_custom_pdf(
     retrieved_docs,
     exams_dir,
-    output_path
+    output_path,
+    pool=None,
+    overlay="xobject",
+    engine=PDF_ENGINE,
+    optimize="default",
+    stats=None,
 ):
     '''
     Builds a compiled PDF from the original exam pages matching the retrieved documents.
     Each page is overlaid with a red "Source: <filename>" header.
+
+    `engine` picks the assembly backend: "pypdf" (pure Python, with `overlay="xobject"`
+    stamping cached header XObjects via `HeaderStamper` or "merge" for the original
+    per-page `create_header_page`), "pymupdf" (native page copying and text insertion) or
+    "stream" (pages written to the file as they are copied, see `pdf_stream`).
+    Source PDFs come from `pool` (the process-wide `SourcePool` for the engine by default),
+    so papers used by earlier packs are not parsed again.
+
+    `optimize` (a PDF_OPTIMIZE_PRESETS name or an options dict, see `optimize_pdf`) runs
+    on the written file; None skips it. "default" is PDF_OPTIMIZE, or PDF_STREAM_OPTIMIZE
+    for the stream engine.
+
+    `stats`, if given, is a dict filled in with this build's page count, timings and
+    reader-pool stats (also kept in `last_build_stats`).
     '''
-    writer = PdfWriter()
-    pages_by_exam = group_pages_by_exam(retrieved_docs)
-
-    # Pre-list exams to handle name mismatches
-    available_exams = {}
-    if os.path.exists(exams_dir):
-        for f in os.listdir(exams_dir):
-            if f.endswith(".pdf"):
-                # Map normalized name to actual filename
-                norm = f.lower().replace("-", " ").replace(".pdf", "").strip()
-                available_exams[norm] = f
-                # Also map actual filename
-                available_exams[f.lower()] = f
-
-    for exam_label, pages in pages_by_exam.items():
-        # Try exact match first
-        pdf_filename = available_exams.get(exam_label.lower())
-        
-        # If not found, try normalized match
-        if not pdf_filename:
-            norm_label = exam_label.lower().replace("-", " ").replace(".pdf", "").strip()
-            pdf_filename = available_exams.get(norm_label)
+    options = optimize_options(optimize, engine)
+    if engine not in PDF_ENGINES:
+        raise ValueError(f"Unknown PDF engine '{engine}' (expected one of {', '.join(PDF_ENGINES)})")
+    if overlay not in ("xobject", "merge"):
+        raise ValueError(f"Unknown overlay mode '{overlay}' (expected 'xobject' or 'merge')")
+    global last_build_stats
+    pool = pool or default_pool(engine)
+    start = time.perf_counter()
+    hits, misses = pool.hits, pool.misses
 
-        if not pdf_filename:
-            print(f"Warning: Could not find a PDF matching '{exam_label}' in {exams_dir}")
-            continue
+    sources = pack_sources(retrieved_docs, exams_dir, pool)
+    if engine == "pymupdf":
+        n_pages = _assemble_pymupdf(sources, exams_dir, output_path, pool)
+    elif engine == "stream":
+        from doc_processing import pdf_stream
+
+        with open(output_path, "wb") as f:
+            n_pages = pdf_stream.write_sources(sources, exams_dir, f, pool)
+    else:
+        n_pages = _assemble_pypdf(sources, exams_dir, output_path, pool, overlay)
+
+    pack_hits, pack_misses = pool.hits - hits, pool.misses - misses
+    build_stats = {
+        "engine": engine,
+        "pages": n_pages,
+        "build_ms": round((time.perf_counter() - start) * 1000, 1),
+        "reader_hits": pack_hits,
+        "reader_misses": pack_misses,
+        "pool_hit_rate": round(pool.hit_rate(), 3),
+    }
+    if options["dedupe"] or options["compress"] or options["image_dpi"]:
+        build_stats["optimize"] = optimize_pdf(output_path, **options)
+        build_stats["build_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    last_build_stats = build_stats
+    if stats is not None:
+        stats.update(build_stats)
+    print(f"PDF saved as {output_path} ({n_pages} pages in {build_stats['build_ms']:.0f} ms, "
+          f"{pack_hits} cached / {pack_misses} parsed source PDFs, pool hit rate {pool.hit_rate():.0%})")
+    return output_path
+
+
+# -----------------------------
+# Output optimisation
+# -----------------------------
+def optimize_options(optimize, engine=PDF_ENGINE) -> dict:
+    '''Resolves a preset name, "default" (the engine's preset), options dict or None into a full options dict'''
+    if optimize == "default":
+        optimize = PDF_STREAM_OPTIMIZE if engine == "stream" else PDF_OPTIMIZE
+    if optimize is None:
+        return dict(PDF_OPTIMIZE_PRESETS["none"])
+    if isinstance(optimize, str):
+        if optimize not in PDF_OPTIMIZE_PRESETS:
+            raise ValueError(f"Unknown optimize preset '{optimize}' (expected one of {', '.join(PDF_OPTIMIZE_PRESETS)})")
+        return dict(PDF_OPTIMIZE_PRESETS[optimize])
+    unknown = set(optimize) - set(PDF_OPTIMIZE_PRESETS["none"])
+    if unknown:
+        raise ValueError(f"Unknown optimize option(s): {', '.join(sorted(unknown))}")
+    return {**PDF_OPTIMIZE_PRESETS["none"], **optimize}
+
+
+@tracing.traced("pdf.optimize")
+def optimize_pdf(path, dedupe=True, compress=True, image_dpi=None, image_quality=PDF_IMAGE_QUALITY) -> dict:
+    '''
+    Rewrites the PDF at `path` in place with PyMuPDF, whatever engine assembled it:
+    identical objects are merged (`dedupe`), streams are deflated and objects packed into
+    object streams (`compress`), and images displayed above `image_dpi` are downsampled
+    to it as JPEG at `image_quality`. Returns the sizes before and after and the time spent.
+    '''
+    import fitz
+
+    start = time.perf_counter()
+    before = os.path.getsize(path)
+    tmp_path = f"{path}.optimize.tmp"
+    with FITZ_LOCK:
+        doc = fitz.open(path)
+        try:
+            if image_dpi:
+                # "above the cap" is dpi > image_dpi; PyMuPDF wants the target strictly below the threshold
+                doc.rewrite_images(dpi_threshold=image_dpi + 1, dpi_target=image_dpi, quality=image_quality)
+            doc.save(
+                tmp_path,
+                garbage=3 if dedupe else 1,
+                deflate=compress,
+                deflate_images=compress,
+                deflate_fonts=compress,
+                use_objstms=1 if compress else 0,
+            )
+            doc.close()
+            os.replace(tmp_path, path)
+        except Exception:
+            doc.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
 
+    after = os.path.getsize(path)
+    stats = {
+        "bytes_before": before,
+        "bytes_after": after,
+        "bytes_saved": before - after,
+        "optimize_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+    print(f"Optimised {os.path.basename(path)}: {before / 1024:.0f} KB -> {after / 1024:.0f} KB "
+          f"({stats['bytes_saved'] / max(before, 1):.0%} saved) in {stats['optimize_ms']:.0f} ms")
+    return stats
+
+
+def _assemble_pypdf(sources, exams_dir, output_path, pool, overlay):
+    writer = PdfWriter()
+    stamper = HeaderStamper(writer) if overlay == "xobject" else None
+
+    for pdf_filename, pages in sources:
         pdf_path = os.path.join(exams_dir, pdf_filename)
-        reader = PdfReader(pdf_path)
-        for page_num in sorted(pages):
-            if page_num < len(reader.pages):
-                original_page = reader.pages[page_num]
-                labeled_page = create_header_page(original_page, f"Source: {pdf_filename}")
-                writer.add_page(labeled_page)
+        with tracing.span("pdf.read", exam=pdf_filename), pool.borrow(pdf_path) as reader:
+            n_pages = len(reader.pages)
+            with tracing.span("pdf.overlay", exam=pdf_filename, pages=len(pages)):
+                for page_num in pages:
+                    if page_num >= n_pages:
+                        continue
+                    original_page = reader.pages[page_num]
+                    if stamper is not None:
+                        # add_page copies the page into the writer, so the pooled reader stays untouched
+                        stamper.stamp(writer.add_page(original_page), f"Source: {pdf_filename}")
+                    else:
+                        writer.add_page(create_header_page(original_page, f"Source: {pdf_filename}"))
 
-    with open(output_path, "wb") as f:
-        writer.write(f)
+    with tracing.span("pdf.write", pages=len(writer.pages)):
+        with open(output_path, "wb") as f:
+            writer.write(f)
+    return len(writer.pages)
 
-    print(f"PDF saved as {output_path}")
-    return output_path
+
+def page_runs(pages):
+    '''Splits sorted page numbers into (first, last) runs of consecutive pages'''
+    runs = []
+    for page_num in pages:
+        if runs and page_num == runs[-1][1] + 1:
+            runs[-1][1] = page_num
+        else:
+            runs.append([page_num, page_num])
+    return [tuple(r) for r in runs]
+
+
+def _assemble_pymupdf(sources, exams_dir, output_path, pool):
+    import fitz
+
+    # The whole assembly holds FITZ_LOCK (borrowing from the PyMuPDF pool re-enters it)
+    with FITZ_LOCK:
+        out = fitz.open()
+        try:
+            for pdf_filename, pages in sources:
+                pdf_path = os.path.join(exams_dir, pdf_filename)
+                with tracing.span("pdf.read", exam=pdf_filename), pool.borrow(pdf_path) as src:
+                    pages = [p for p in pages if p < src.page_count]
+                    with tracing.span("pdf.overlay", exam=pdf_filename, pages=len(pages)):
+                        first_new = out.page_count
+                        # Consecutive pages are copied in one call; resources shared between them are copied once
+                        for first, last in page_runs(pages):
+                            out.insert_pdf(src, from_page=first, to_page=last)
+                        for i in range(first_new, out.page_count):
+                            stamp_header_fitz(out[i], f"Source: {pdf_filename}")
+
+            with tracing.span("pdf.write", pages=out.page_count):
+                out.save(output_path, garbage=1, deflate=True)
+            return out.page_count
+        finally:
+            out.close()
+
+
+def stamp_header_fitz(page, label_text):
+    '''
+    Draws the red header with PyMuPDF at the spot `create_header_page` uses: baseline 780pt
+    above the bottom of the page, 40pt from the left, Helvetica-Bold 12
+    '''
+    import fitz
+
+    # PDF user space has its origin bottom-left; PyMuPDF's unrotated page space top-left.
+    # Like the pypdf overlay, the label is drawn in unrotated space and turns with the page.
+    point = fitz.Point(40, page.mediabox.height - 780)
+    page.insert_text(point, label_text, fontname="hebo", fontsize=12, color=(1, 0, 0))
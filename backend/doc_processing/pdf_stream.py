@@ -0,0 +1,338 @@
+'''
+Streaming revision pack output.
+
+`PdfWriter` keeps every copied page, with its content streams and resources, in memory
+until `write()` serialises the whole document at the end. `StreamingPackWriter` instead
+serialises each page, and every object it references, as soon as the page is added, to
+any binary sink with a `write` method (file, socket, HTTP response body, upload buffer).
+Afterwards it only keeps object offsets. Objects shared by pages of the same source PDF
+(fonts, images, the reference sheet) are written once. The page tree, catalog and
+cross-reference table go last, which the PDF format allows.
+
+Emitted source objects are also dropped from the pooled reader's object cache, so a large
+pack never has all of its pages resident at once; they are re-read from the source bytes if
+another pack needs them.
+
+    with open(path, "wb") as f:
+        stream_custom_pdf(docs, EXAM_DIR, f)
+
+    for chunk in iter_custom_pdf(docs, EXAM_DIR):   # e.g. an HTTP streaming response
+        send(chunk)
+'''
+import os
+import sys
+from pathlib import Path
+
+from pypdf.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    EncodedStreamObject,
+    FloatObject,
+    IndirectObject,
+    NameObject,
+    NullObject,
+    NumberObject,
+    StreamObject,
+)
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from config.constants import PDF_STREAM_CHUNK_SIZE
+
+from doc_processing.pdf_generator import header_overlay, pack_sources
+from doc_processing.source_pool import default_pool
+from setup import tracing
+
+# Page attributes a page may inherit from its /Pages ancestors; copied onto the page
+# because the source page tree is not written
+INHERITABLE = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+
+class _CountingSink:
+    '''Wraps a sink to track the byte offset, so sinks need neither `tell` nor `seek`'''
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.offset = 0
+
+    def write(self, data):
+        self.sink.write(data)
+        self.offset += len(data)
+        return len(data)
+
+
+class _ChunkBuffer:
+    '''In-memory sink that `iter_custom_pdf` drains between pages'''
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+        return len(data)
+
+    def drain(self, chunk_size, final=False):
+        while len(self.data) >= chunk_size or (final and self.data):
+            chunk = bytes(self.data[:chunk_size])
+            del self.data[:chunk_size]
+            yield chunk
+
+
+class StreamingPackWriter:
+    '''
+    Incremental PDF writer for revision packs. `add_page` copies a source page, stamped
+    with a header label, straight to the sink; `close` writes the trailer.
+    '''
+
+    def __init__(self, sink, release=True):
+        self._out = _CountingSink(sink)
+        self.release = release
+        self._offsets = [None]  # object number -> byte offset; object 0 is the free-list head
+        self._copied = {}  # (source reader, generation, idnum) -> object number in the output
+        self._headers = {}  # (label, width, height) -> (XObject name, form object number, draw stream number)
+        self._page_numbers = []
+        self._catalog = self._reserve()
+        self._pages_root = self._reserve()
+        self._save_state = None
+        self._out.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+    @property
+    def pages(self) -> int:
+        return len(self._page_numbers)
+
+    @property
+    def bytes_written(self) -> int:
+        return self._out.offset
+
+    # -----------------------------
+    # Object output
+    # -----------------------------
+    def _reserve(self) -> int:
+        self._offsets.append(None)
+        return len(self._offsets) - 1
+
+    def _ref(self, number) -> IndirectObject:
+        return IndirectObject(number, 0, self)
+
+    def _write_object(self, number, obj):
+        self._offsets[number] = self._out.offset
+        self._out.write(f"{number} 0 obj\n".encode())
+        obj.write_to_stream(self._out)
+        self._out.write(b"\nendobj\n")
+
+    def _new_stream(self, data: bytes, entries=None) -> int:
+        stream = DecodedStreamObject()
+        stream.set_data(data)
+        stream.update(entries or {})
+        number = self._reserve()
+        self._write_object(number, stream)
+        return number
+
+    def _copy(self, obj, pending):
+        '''
+        Copy of a source object with its indirect references renumbered for the output.
+        Referenced objects not written yet are queued on `pending`.
+        '''
+        if isinstance(obj, IndirectObject):
+            key = (obj.pdf, obj.generation, obj.idnum)
+            number = self._copied.get(key)
+            if number is None:
+                target = obj.get_object()
+                # Links to pages outside the pack would drag the source page tree in
+                if isinstance(target, DictionaryObject) and target.get("/Type") in ("/Page", "/Pages"):
+                    return NullObject()
+                number = self._copied[key] = self._reserve()
+                pending.append((number, obj))
+            return self._ref(number)
+        if isinstance(obj, StreamObject):
+            if isinstance(obj, EncodedStreamObject):
+                copy = EncodedStreamObject()
+                copy._data = obj._data
+            else:
+                copy = DecodedStreamObject()
+                copy.set_data(obj.get_data())
+            for key, value in obj.items():
+                copy[key] = self._copy(value, pending)
+            return copy
+        if isinstance(obj, DictionaryObject):
+            return DictionaryObject({key: self._copy(value, pending) for key, value in obj.items()})
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self._copy(value, pending) for value in obj)
+        return obj
+
+    def _flush(self, pending, source=None):
+        '''
+        Writes queued source objects (and whatever they reference) to the sink. With
+        `release`, objects of `source` (the borrowed pool reader) are dropped from its
+        cache; other readers, such as the shared cached header overlays, are left intact.
+        '''
+        while pending:
+            number, ref = pending.pop()
+            self._write_object(number, self._copy(ref.get_object(), pending))
+            if self.release and ref.pdf is source:
+                ref.pdf.resolved_objects.pop((ref.generation, ref.idnum), None)
+
+    # -----------------------------
+    # Pages
+    # -----------------------------
+    def _header(self, label_text, width, height, pending):
+        key = (label_text, width, height)
+        if key not in self._headers:
+            overlay = header_overlay(label_text, width, height)
+            resources = self._copy(overlay["/Resources"].get_object(), pending)
+            form = self._new_stream(overlay.get_contents().get_data(), {
+                NameObject("/Type"): NameObject("/XObject"),
+                NameObject("/Subtype"): NameObject("/Form"),
+                NameObject("/BBox"): ArrayObject([FloatObject(0), FloatObject(0), FloatObject(width), FloatObject(height)]),
+                NameObject("/Resources"): resources,
+            })
+            name = NameObject(f"/HSCHeader{len(self._headers)}")
+            draw = self._new_stream(f"Q q {name} Do Q\n".encode())
+            self._headers[key] = (name, form, draw)
+        return self._headers[key]
+
+    def add_page(self, page, label_text=None):
+        '''Writes `page` (a source PdfReader page), stamped with `label_text` if given'''
+        pending = []
+        number = self._reserve()
+        source = None
+        if page.indirect_reference is not None:
+            ref = page.indirect_reference
+            source = ref.pdf
+            self._copied.setdefault((ref.pdf, ref.generation, ref.idnum), number)
+
+        stamped = label_text is not None
+        out = DictionaryObject()
+        for key, value in page.items():
+            if key in ("/Parent", "/B") or (stamped and key in ("/Resources", "/Contents")):
+                continue
+            out[key] = self._copy(value, pending)
+        for key in INHERITABLE:
+            if key not in page and not (stamped and key == "/Resources"):
+                inherited = _inherited(page, key)
+                if inherited is not None:
+                    out[NameObject(key)] = self._copy(inherited, pending)
+        out[NameObject("/Parent")] = self._ref(self._pages_root)
+
+        if stamped:
+            width, height = float(page.mediabox.width), float(page.mediabox.height)
+            name, form, draw = self._header(label_text, width, height, pending)
+            if self._save_state is None:
+                self._save_state = self._new_stream(b"q\n")
+
+            # The page gets its own resource and XObject dicts (the header is added to them);
+            # everything they point at is still shared
+            source = _resolve(page, "/Resources") or DictionaryObject()
+            resources = DictionaryObject({k: self._copy(v, pending) for k, v in source.items() if k != "/XObject"})
+            xobjects = source.get("/XObject")
+            xobjects = DictionaryObject({k: self._copy(v, pending) for k, v in xobjects.get_object().items()}) if xobjects else DictionaryObject()
+            xobjects[name] = self._ref(form)
+            resources[NameObject("/XObject")] = xobjects
+            out[NameObject("/Resources")] = resources
+
+            contents = page.get("/Contents")
+            if contents is None:
+                existing = []
+            elif isinstance(contents.get_object(), ArrayObject):
+                existing = [self._copy(c, pending) for c in contents.get_object()]
+            else:
+                existing = [self._copy(contents, pending)]
+            out[NameObject("/Contents")] = ArrayObject([self._ref(self._save_state), *existing, self._ref(draw)])
+
+        self._flush(pending, source)
+        self._write_object(number, out)
+        self._page_numbers.append(number)
+        return number
+
+    def close(self):
+        '''Writes the page tree, catalog, cross-reference table and trailer'''
+        kids = ArrayObject(self._ref(n) for n in self._page_numbers)
+        self._write_object(self._pages_root, DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): kids,
+            NameObject("/Count"): NumberObject(len(kids)),
+        }))
+        self._write_object(self._catalog, DictionaryObject({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): self._ref(self._pages_root),
+        }))
+
+        xref_offset = self._out.offset
+        lines = [f"xref\n0 {len(self._offsets)}\n", "0000000000 65535 f \n"]
+        lines += [f"{offset:010d} 00000 n \n" for offset in self._offsets[1:]]
+        lines.append(f"trailer\n<< /Size {len(self._offsets)} /Root {self._catalog} 0 R >>\n")
+        lines.append(f"startxref\n{xref_offset}\n%%EOF\n")
+        self._out.write("".join(lines).encode())
+
+
+def _inherited(page, key):
+    node = page.get("/Parent")
+    while node is not None:
+        node = node.get_object()
+        if key in node:
+            return node[key]
+        node = node.get("/Parent")
+    return None
+
+
+def _resolve(page, key):
+    value = page[key] if key in page else _inherited(page, key)
+    return value.get_object() if value is not None else None
+
+
+def _write_sources(writer, sources, exams_dir, pool, per_page=False):
+    '''
+    Adds every page of `sources` to `writer`, yielding after each source PDF, or after
+    each page with `per_page` (the reader is then borrowed per page, so it is never held
+    while the caller has control)
+    '''
+    for pdf_filename, pages in sources:
+        pdf_path = os.path.join(exams_dir, pdf_filename)
+        with tracing.span("pdf.stream", exam=pdf_filename, pages=len(pages)):
+            if per_page:
+                for page_num in pages:
+                    with pool.borrow(pdf_path) as reader:
+                        if page_num < len(reader.pages):
+                            writer.add_page(reader.pages[page_num], f"Source: {pdf_filename}")
+                    yield pdf_filename
+            else:
+                with pool.borrow(pdf_path) as reader:
+                    n_pages = len(reader.pages)
+                    for page_num in pages:
+                        if page_num < n_pages:
+                            writer.add_page(reader.pages[page_num], f"Source: {pdf_filename}")
+                yield pdf_filename
+
+
+def write_sources(sources, exams_dir, sink, pool) -> int:
+    '''Streams the pages of `sources` (see `pdf_generator.pack_sources`) to `sink`; returns the page count'''
+    writer = StreamingPackWriter(sink)
+    for _ in _write_sources(writer, sources, exams_dir, pool):
+        pass
+    writer.close()
+    return writer.pages
+
+
+def stream_custom_pdf(retrieved_docs, exams_dir, sink, pool=None) -> int:
+    '''
+    Writes the revision pack for `retrieved_docs` to `sink` (anything with a binary
+    `write`) page by page and returns the number of pages written
+    '''
+    pool = pool or default_pool("stream")
+    return write_sources(pack_sources(retrieved_docs, exams_dir, pool), exams_dir, sink, pool)
+
+
+def iter_custom_pdf(retrieved_docs, exams_dir, chunk_size=PDF_STREAM_CHUNK_SIZE, pool=None):
+    '''
+    Yields the revision pack as byte chunks of `chunk_size` (the last one shorter).
+    Chunks are handed out after every page, outside the pooled reader's lock, so at most
+    one page plus one chunk is buffered and a slow consumer never blocks other builds.
+    '''
+    pool = pool or default_pool("stream")
+    buffer = _ChunkBuffer()
+    writer = StreamingPackWriter(buffer)
+    for _ in _write_sources(writer, pack_sources(retrieved_docs, exams_dir, pool), exams_dir, pool, per_page=True):
+        yield from buffer.drain(chunk_size)
+    writer.close()
+    yield from buffer.drain(chunk_size, final=True)
@@ -24,6 +24,23 @@ def load_syllabus(path: Path) -> Any:
         return json.load(f)
 
 
+def syllabus_subtopics(syllabus: Any) -> List[str]:
+    '''
+    Lists every leaf of the syllabus as "<topic> / <subtopic>", matching the flat `tags`
+    format produced by `tag_questions_with_llm` (e.g. "Calculus / Chain rule")
+    '''
+    out: List[str] = []
+    for topic, body in (syllabus or {}).items():
+        stack = [body]
+        while stack:
+            node = stack.pop(0)
+            if isinstance(node, dict):
+                stack.extend(node.values())
+            elif isinstance(node, list):
+                out.extend(f"{topic} / {s}" for s in node if isinstance(s, str))
+    return out
+
+
 def extract_syllabus(text: str) -> List[Dict[str, Any]]:
     '''
     Parses a JSON array of tagged questions out of raw LLM response text,
@@ -61,7 +78,8 @@ def build_question_id(exam: str, page: Any, index_in_exam: int) -> str:
 
 def iterate_questions(data: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
     '''
-    Flattens the nested questions structure and returns a list of (question_id, question_dict) pairs
+    Flattens the nested questions structure and returns a list of (question_id, question_dict) pairs.
+    A persisted `id` on the question takes precedence over a freshly built one.
     '''
     all_qs = data.get("questions", [])
     out: List[Tuple[str, Dict[str, Any]]] = []
@@ -73,11 +91,57 @@ def iterate_questions(data: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
                 continue
             exam = str(q.get("exam", "unknown_exam"))
             page = q.get("page", "unknown_page")
-            qid = build_question_id(exam=exam, page=page, index_in_exam=i)
+            qid = q.get("id") or build_question_id(exam=exam, page=page, index_in_exam=i)
             out.append((qid, q))
     return out
 
 
+def assign_question_ids(data: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Stores a stable `id` on every question that does not already have one.
+
+    IDs are never rewritten once assigned, so they can be used as FAISS docstore
+    keys and survive re-tagging or edits to the question text.
+    '''
+    assigned = 0
+    for qid, q in iterate_questions(data):
+        if not q.get("id"):
+            q["id"] = qid
+            assigned += 1
+    if assigned:
+        print(f"Assigned IDs to {assigned} question(s)")
+    return data
+
+
+def withdraw_exam(data: Dict[str, Any], exam: str) -> List[str]:
+    '''
+    Removes every question (and the matching metadata entry) belonging to `exam`.
+    Returns the IDs of the removed questions so they can be deleted from the indexes.
+    '''
+    all_qs = data.get("questions", [])
+    all_metadata = data.get("metadata", [])
+    kept_qs, kept_metadata, removed_ids = [], [], []
+
+    for i, exam_qs in enumerate(all_qs):
+        is_withdrawn = (
+            isinstance(exam_qs, list)
+            and exam_qs
+            and isinstance(exam_qs[0], dict)
+            and exam_qs[0].get("exam") == exam
+        )
+        if is_withdrawn:
+            removed_ids.extend(qid for qid, _ in iterate_questions({"questions": [exam_qs]}))
+            continue
+        kept_qs.append(exam_qs)
+        if i < len(all_metadata):
+            kept_metadata.append(all_metadata[i])
+
+    data["questions"] = kept_qs
+    data["metadata"] = kept_metadata
+    print(f"Withdrew {len(removed_ids)} question(s) from {exam}")
+    return removed_ids
+
+
 def tag_questions_with_llm(
     data: Dict[str, Any],
     *,
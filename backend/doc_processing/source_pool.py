@@ -0,0 +1,189 @@
+'''
+Long-lived pool of parsed exam PDFs for revision pack generation.
+
+Parsing a large exam PDF (xref table + page tree) costs far more than copying a few
+pages out of it, and revision packs keep drawing on the same papers. The pool keeps an
+LRU of parsed `PdfReader`s keyed by (path, mtime, size), so a replaced file is re-parsed
+while an unchanged one never is. Exam labels are resolved to filenames through a table
+built with the same normalisation `exam_extractor` uses, rebuilt only when the exam
+directory changes.
+'''
+import os
+import sys
+import hashlib
+import threading
+import contextlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from config.constants import PDF_READER_POOL_SIZE
+
+from doc_processing.helpers import exam_name_table, resolve_exam_name
+from setup import tracing
+
+
+class SourcePool:
+    '''
+    LRU of parsed PdfReaders (or PyMuPDF documents, via `reader_factory`) plus
+    per-directory exam-name tables.
+
+    pypdf readers are not thread-safe, so `borrow` holds a per-reader lock for the
+    duration of the `with` block; different PDFs can still be read concurrently.
+    PyMuPDF is not thread-safe at all, so a pool of PyMuPDF documents also holds
+    `FITZ_LOCK` while a document is borrowed (taken before the per-reader lock).
+    '''
+
+    def __init__(self, max_readers=PDF_READER_POOL_SIZE, reader_factory=None):
+        self.max_readers = max_readers
+        self._reader_factory = reader_factory
+        self._global_lock = FITZ_LOCK if reader_factory is open_fitz else contextlib.nullcontext()
+        self._readers = OrderedDict()  # (path, mtime_ns, size) -> (reader, lock)
+        self._tables = {}  # exams_dir -> (dir mtime_ns, table)
+        self._fingerprints = {}  # path -> ((mtime_ns, size), sha1 of the file)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # -----------------------------
+    # Exam name resolution
+    # -----------------------------
+    def resolve(self, exams_dir, exam_label):
+        '''Returns the PDF filename in `exams_dir` matching an exam label, or None'''
+        return resolve_exam_name(self.name_table(exams_dir), exam_label)
+
+    def name_table(self, exams_dir) -> dict:
+        '''Exam-name table for a directory; rebuilt only when the directory's mtime changes'''
+        try:
+            mtime = os.stat(exams_dir).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        with self._lock:
+            cached = self._tables.get(exams_dir)
+            if cached is None or cached[0] != mtime:
+                cached = self._tables[exams_dir] = (mtime, exam_name_table(os.listdir(exams_dir)))
+            return cached[1]
+
+    # -----------------------------
+    # Readers
+    # -----------------------------
+    @contextmanager
+    def borrow(self, path):
+        '''
+        Yields a parsed reader for `path`, parsing it only on a miss:
+
+            with pool.borrow(pdf_path) as reader:
+                page = reader.pages[3]
+        '''
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._readers.get(key)
+            if entry is not None:
+                self._readers.move_to_end(key)
+                self.hits += 1
+        if entry is None:
+            with tracing.span("pdf.parse", path=os.path.basename(path)):
+                entry = (self._open(path), threading.Lock())
+            with self._lock:
+                self.misses += 1
+                entry = self._readers.setdefault(key, entry)
+                self._readers.move_to_end(key)
+                self._evict()
+
+        with self._global_lock, entry[1]:
+            yield entry[0]
+
+    def fingerprint(self, path) -> str:
+        '''SHA-1 of the file's bytes, recomputed only when its mtime or size changes'''
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._fingerprints.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        with self._lock:
+            self._fingerprints[path] = (version, digest.hexdigest())
+        return digest.hexdigest()
+
+    def _open(self, path):
+        if self._reader_factory is not None:
+            return self._reader_factory(path)
+        from pypdf import PdfReader
+
+        reader = PdfReader(path)
+        len(reader.pages)  # parse the page tree now rather than inside the borrower's lock
+        return reader
+
+    def _evict(self):
+        # Stale entries for a replaced file go first, then the least recently used
+        live = {}
+        for key in list(self._readers):
+            path = key[0]
+            if path in live:
+                del self._readers[live[path]]
+            live[path] = key
+        while len(self._readers) > self.max_readers:
+            self._readers.popitem(last=False)
+
+    # -----------------------------
+    # Stats
+    # -----------------------------
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "readers": len(self._readers),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate(), 3),
+        }
+
+    def clear(self):
+        with self._lock:
+            self._readers.clear()
+            self._tables.clear()
+            self._fingerprints.clear()
+
+
+# PyMuPDF may only be used from one thread at a time; every fitz call in the process
+# (opening, rendering, page copying, saving) runs under this lock. Reentrant, so a
+# holder can borrow from the PyMuPDF pool.
+FITZ_LOCK = threading.RLock()
+
+
+def open_fitz(path):
+    import fitz
+
+    with FITZ_LOCK:
+        return fitz.open(path)
+
+
+# Reader factory per assembly engine (see `pdf_generator.build_custom_pdf`); None = pypdf
+READER_FACTORIES = {
+    "pypdf": None,
+    "pymupdf": open_fitz,
+    "stream": None,
+}
+
+_default_pools = {}
+_default_lock = threading.Lock()
+
+
+def default_pool(engine="pypdf") -> SourcePool:
+    '''Process-wide pool of `engine` readers shared by every pack build (engines reading
+    with the same factory share one pool)'''
+    factory = READER_FACTORIES[engine]
+    with _default_lock:
+        if factory not in _default_pools:
+            _default_pools[factory] = SourcePool(reader_factory=factory)
+        return _default_pools[factory]
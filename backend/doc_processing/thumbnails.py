@@ -0,0 +1,250 @@
+'''
+Lazily rendered, disk-cached page previews for the frontend.
+
+Exam pages (or the part of a page a question starts on) are rendered with PyMuPDF pixmaps
+on first request, at one of the fixed THUMBNAIL_SIZES, and stored as
+
+    <THUMBNAIL_DIR>/<sha1 of the exam PDF>/<page>-<size>[-<clip hash>].<png|jpg|webp>
+
+Keying on the PDF's content hash (not its name) means a replaced exam PDF never serves
+stale renders, and a renamed one keeps its cache. A repeated preview is a stat and a file
+read; nothing is rendered.
+
+Pages that keep coming up in search results are counted (`record_retrieved`, persisted to
+popular.json) and `prewarm` renders the most frequent ones ahead of time:
+
+    python backend/doc_processing/thumbnails.py prewarm --top 200
+'''
+from __future__ import annotations
+
+import io
+import os
+import sys
+import json
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from config.constants import (
+    EXAM_DIR,
+    THUMBNAIL_DIR,
+    THUMBNAIL_FORMAT,
+    THUMBNAIL_PREWARM,
+    THUMBNAIL_PREWARM_SIZES,
+    THUMBNAIL_SIZES,
+)
+
+from doc_processing.source_pool import default_pool
+from setup import tracing
+
+FORMATS = ("png", "jpg", "webp")
+MEDIA_TYPES = {"png": "image/png", "jpg": "image/jpeg", "webp": "image/webp"}
+
+
+class ThumbnailService:
+    '''
+    Renders and caches page images. Source PDFs are opened through the PyMuPDF
+    `SourcePool`, which holds the process-wide FITZ_LOCK while a document is borrowed.
+    '''
+
+    def __init__(self, root=THUMBNAIL_DIR, exams_dir=EXAM_DIR, pool=None):
+        self.root = root
+        self.exams_dir = exams_dir
+        self.pool = pool or default_pool("pymupdf")
+        self.popular_path = os.path.join(root, "popular.json")
+        self._popular = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.renders = 0
+
+    # -----------------------------
+    # Rendering
+    # -----------------------------
+    def path_for(self, pdf_filename, page, size, fmt=THUMBNAIL_FORMAT, clip=None) -> str:
+        '''Cache path of a render; `page` is 1-based like question metadata'''
+        if size not in THUMBNAIL_SIZES:
+            raise ValueError(f"Unknown thumbnail size '{size}' (expected one of {', '.join(THUMBNAIL_SIZES)})")
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown thumbnail format '{fmt}' (expected one of {', '.join(FORMATS)})")
+        fingerprint = self.pool.fingerprint(os.path.join(self.exams_dir, pdf_filename))
+        name = f"{page}-{size}"
+        if clip is not None:
+            name += "-" + hashlib.sha1(",".join(f"{v:.1f}" for v in clip).encode()).hexdigest()[:10]
+        return os.path.join(self.root, fingerprint, f"{name}.{fmt}")
+
+    def render(self, exam, page, size="preview", fmt=THUMBNAIL_FORMAT, clip=None) -> str | None:
+        '''
+        Path of the rendered image for page `page` (1-based) of `exam` (an exam label or PDF
+        filename), rendering it only if it is not cached. `clip` is an (x0, y0, x1, y1)
+        rectangle in PyMuPDF page coordinates. Returns None if the exam or page does not exist.
+        '''
+        pdf_filename = self.pool.resolve(self.exams_dir, exam)
+        if pdf_filename is None:
+            return None
+        path = self.path_for(pdf_filename, page, size, fmt, clip)
+        if os.path.exists(path):
+            with self._lock:
+                self.hits += 1
+            return path
+
+        with tracing.span("thumbnail.render", exam=pdf_filename, page=page, size=size):
+            # Borrowing holds FITZ_LOCK, so encoding the pixmap stays under it too
+            with self.pool.borrow(os.path.join(self.exams_dir, pdf_filename)) as doc:
+                if not 1 <= page <= doc.page_count:
+                    return None
+                pixmap = doc[page - 1].get_pixmap(dpi=THUMBNAIL_SIZES[size], clip=clip, alpha=False)
+                data = encode(pixmap, fmt)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.renders += 1
+        return path
+
+    def render_question(self, doc, size="preview", fmt=THUMBNAIL_FORMAT) -> str | None:
+        '''
+        Render of the part of the page a question Document starts on: from its first line
+        to the bottom of the page (the extractor keeps no bounding boxes). Falls back to
+        the whole page if the first line cannot be found.
+        '''
+        exam, page = doc.metadata.get("exam"), doc.metadata.get("page")
+        if not exam or page is None:
+            return None
+        return self.render(exam, page, size, fmt, clip=self.question_clip(exam, page, doc.page_content))
+
+    def question_clip(self, exam, page, text):
+        pdf_filename = self.pool.resolve(self.exams_dir, exam)
+        first_line = next((line.strip() for line in (text or "").splitlines() if line.strip()), "")
+        if pdf_filename is None or not first_line:
+            return None
+        with self.pool.borrow(os.path.join(self.exams_dir, pdf_filename)) as pdf:
+            if not 1 <= page <= pdf.page_count:
+                return None
+            fitz_page = pdf[page - 1]
+            hits = fitz_page.search_for(first_line[:60])
+            if not hits:
+                return None
+            rect = fitz_page.rect
+            return (rect.x0, max(rect.y0, hits[0].y0 - 6), rect.x1, rect.y1)
+
+    # -----------------------------
+    # Popularity and pre-warming
+    # -----------------------------
+    def _load_popular(self) -> Counter:
+        if self._popular is None:
+            try:
+                with open(self.popular_path, "r", encoding="utf-8") as f:
+                    self._popular = Counter({tuple(json.loads(k)): v for k, v in json.load(f).items()})
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._popular = Counter()
+        return self._popular
+
+    def record_retrieved(self, docs, save=True):
+        '''Counts the (exam, page) of every retrieved question towards pre-warming'''
+        with self._lock:
+            popular = self._load_popular()
+            for d in docs:
+                exam, page = d.metadata.get("exam"), d.metadata.get("page")
+                if exam and page is not None:
+                    popular[(exam, int(page))] += 1
+            if save:
+                self._save_popular()
+
+    def save(self):
+        '''Writes the retrieval counts, for callers that record with `save=False`'''
+        with self._lock:
+            if self._popular is not None:
+                self._save_popular()
+
+    def _save_popular(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{self.popular_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({json.dumps(list(k)): v for k, v in self._popular.items()}, f)
+        os.replace(tmp_path, self.popular_path)
+
+    def most_popular(self, n=THUMBNAIL_PREWARM):
+        with self._lock:
+            return [key for key, _ in self._load_popular().most_common(n)]
+
+    @tracing.traced("thumbnail.prewarm")
+    def prewarm(self, pages=None, sizes=THUMBNAIL_PREWARM_SIZES, fmt=THUMBNAIL_FORMAT, top=THUMBNAIL_PREWARM) -> dict:
+        '''
+        Renders `pages` ([(exam, page)], default: the `top` most retrieved) at `sizes`;
+        already cached renders are skipped. Returns render / hit counts.
+        '''
+        pages = self.most_popular(top) if pages is None else pages
+        renders, hits = self.renders, self.hits
+        for exam, page in pages:
+            for size in sizes:
+                self.render(exam, page, size, fmt)
+        stats = {"pages": len(pages), "rendered": self.renders - renders, "cached": self.hits - hits}
+        print(f"Pre-warmed {stats['pages']} pages: {stats['rendered']} rendered, {stats['cached']} already cached")
+        return stats
+
+    def stats(self) -> dict:
+        total = self.hits + self.renders
+        return {
+            "hits": self.hits,
+            "renders": self.renders,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+def encode(pixmap, fmt) -> bytes:
+    '''PNG and JPEG come from PyMuPDF; WebP needs Pillow'''
+    if fmt == "png":
+        return pixmap.tobytes("png")
+    if fmt == "jpg":
+        return pixmap.tobytes("jpg", jpg_quality=85)
+    try:
+        from PIL import Image
+    except ImportError as e:
+        raise ValueError("WebP thumbnails need Pillow (pip install pillow)") from e
+
+    buffer = io.BytesIO()
+    Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples).save(buffer, "WEBP", quality=80)
+    return buffer.getvalue()
+
+
+_default_service = None
+_default_lock = threading.Lock()
+
+
+def default_service() -> ThumbnailService:
+    '''Process-wide service shared by main.run and the HTTP layer'''
+    global _default_service
+    with _default_lock:
+        if _default_service is None:
+            _default_service = ThumbnailService()
+        return _default_service
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    prewarm = sub.add_parser("prewarm", help="Render the most frequently retrieved pages")
+    prewarm.add_argument("--top", type=int, default=THUMBNAIL_PREWARM)
+    prewarm.add_argument("--sizes", nargs="+", default=list(THUMBNAIL_PREWARM_SIZES), choices=list(THUMBNAIL_SIZES))
+    prewarm.add_argument("--format", default=THUMBNAIL_FORMAT, choices=FORMATS)
+
+    render = sub.add_parser("render", help="Render one page and print the cached path")
+    render.add_argument("exam")
+    render.add_argument("page", type=int)
+    render.add_argument("--size", default="preview", choices=list(THUMBNAIL_SIZES))
+    render.add_argument("--format", default=THUMBNAIL_FORMAT, choices=FORMATS)
+
+    args = parser.parse_args()
+    service = default_service()
+    if args.command == "prewarm":
+        service.prewarm(sizes=args.sizes, fmt=args.format, top=args.top)
+    else:
+        print(service.render(args.exam, args.page, args.size, args.format))
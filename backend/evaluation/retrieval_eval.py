@@ -0,0 +1,268 @@
+'''
+Offline retrieval quality and latency evaluation.
+
+Two steps:
+    build   Bootstraps a versioned query set from the LLM `syllabus_tags`: one query per
+            syllabus subtopic (the subtopic name), labelled with the IDs of every question
+            tagged with it. Written to data/eval/queries_v<version>.json.
+    run     Runs every query through each pipeline stage (BM25 only, FAISS only, fused,
+            reranked) against the persisted pickle and FAISS index, and writes a JSON
+            report with recall@k, MRR and nDCG@10 plus p50/p95/p99 latency per stage.
+            The indexes are loaded read-only: if they are out of date with the pickle the
+            run stops instead of re-embedding and overwriting what it is measuring.
+
+No network access is needed: Hugging Face models are loaded from the local cache and the
+LLM is never called. Reports are written with sorted keys so they diff cleanly between commits.
+
+Usage:
+    python backend/evaluation/retrieval_eval.py build --version 1
+    python backend/evaluation/retrieval_eval.py run --queries data/eval/queries_v1.json --out eval_report.json
+'''
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import numpy as np
+from pathlib import Path
+from collections import defaultdict
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+SRC_ROOT = REPO_ROOT / "backend"
+for p in (REPO_ROOT, SRC_ROOT):
+    if str(p) not in sys.path:
+        sys.path.append(str(p))
+
+from config.constants import (
+    EVAL_DIR,
+    EVAL_KS,
+    EVAL_MIN_RELEVANT,
+    BM25_TOP_K,
+    FAISS_TOP_K,
+    COLBERT_TOP_K,
+    FAISS_INDEX_TYPE,
+    RERANK_CASCADE,
+    CASCADE_RECALL_BIAS,
+)
+from doc_processing.process_questions import load_questions, iterate_questions
+
+STAGES = ("bm25", "faiss", "fused", "reranked")
+
+
+# =================================================
+# QUERY SET
+# =================================================
+
+def build_query_set(data, version, min_relevant=EVAL_MIN_RELEVANT):
+    '''
+    Builds labelled queries from the LLM syllabus tags: each "<topic> / <subtopic>"
+    tag with at least `min_relevant` questions becomes a query for the subtopic name
+    '''
+    # A set per tag: a question ID that occurs twice in the pickle is one relevant question
+    relevant = defaultdict(set)
+    for qid, q in iterate_questions(data):
+        for tag in q.get("tags") or []:
+            relevant[tag].add(qid)
+
+    queries = []
+    for tag in sorted(relevant):
+        if len(relevant[tag]) < min_relevant:
+            continue
+        queries.append({
+            "id": f"q{len(queries) + 1:03d}",
+            "query": tag.split(" / ")[-1],
+            "tag": tag,
+            "relevant": sorted(relevant[tag]),
+        })
+
+    return {
+        "version": version,
+        "source": "llm syllabus_tags",
+        "min_relevant": min_relevant,
+        "queries": queries,
+    }
+
+
+def query_set_path(version):
+    '''Path of a published query set version'''
+    return os.path.join(EVAL_DIR, f"queries_v{version}.json")
+
+
+# =================================================
+# METRICS
+# =================================================
+
+def recall_at_k(ranked_ids, relevant, k):
+    '''Fraction of the relevant questions found in the top k'''
+    return len(set(ranked_ids[:k]) & relevant) / len(relevant) if relevant else 0.0
+
+
+def reciprocal_rank(ranked_ids, relevant):
+    '''1 / rank of the first relevant question (0 if none)'''
+    for rank, qid in enumerate(ranked_ids, start=1):
+        if qid in relevant:
+            return 1.0 / rank
+    return 0.0
+
+
+def ndcg_at_k(ranked_ids, relevant, k):
+    '''Binary-relevance nDCG'''
+    dcg = sum(1.0 / math.log2(rank + 1) for rank, qid in enumerate(ranked_ids[:k], start=1) if qid in relevant)
+    ideal = sum(1.0 / math.log2(rank + 1) for rank in range(1, min(len(relevant), k) + 1))
+    return dcg / ideal if ideal else 0.0
+
+
+def percentiles(latencies_ms):
+    '''p50 / p95 / p99 of a list of latencies'''
+    return {
+        f"p{p}": round(float(np.percentile(latencies_ms, p)), 3)
+        for p in (50, 95, 99)
+    }
+
+
+# =================================================
+# EVALUATION
+# =================================================
+
+def run_stages(retriever, reranker, query):
+    '''
+    Runs one query through every stage and returns {stage: (ranked question IDs, latency ms)}.
+    The reranked stage reuses the fused candidates, so its latency is the rerank cost only.
+    '''
+    from setup import retriever_setup
+
+    out = {}
+
+    start = time.perf_counter()
+    hits = retriever_setup.bm25_search(retriever.bm25, query, retriever.bm25.k)
+    out["bm25"] = ([d.metadata["id"] for d, _ in hits], (time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    vector = retriever.embedding.embed_query(query)
+    hits = retriever_setup.faiss_search_batch(retriever.vectorstore, [vector], retriever.faiss_k)[0]
+    out["faiss"] = ([d.metadata["id"] for d, _ in hits], (time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    fused = retriever.invoke(query)
+    out["fused"] = ([d.metadata["id"] for d in fused], (time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    reranked = retriever_setup.rerank_documents(reranker, query, fused, top_k=COLBERT_TOP_K)
+    out["reranked"] = ([d.metadata["id"] for d in reranked], (time.perf_counter() - start) * 1000)
+
+    return out
+
+
+def evaluate(query_set, retriever, reranker, per_query=False):
+    '''Evaluates every stage over the query set and returns the report dict'''
+    from setup import retriever_setup
+
+    metrics = {stage: defaultdict(list) for stage in STAGES}
+    latencies = {stage: [] for stage in STAGES}
+    details = []
+
+    # Warm-up so model loading is not counted against the first query
+    run_stages(retriever, reranker, query_set["queries"][0]["query"])
+
+    for item in query_set["queries"]:
+        relevant = set(item["relevant"])
+        results = run_stages(retriever, reranker, item["query"])
+        row = {"id": item["id"], "query": item["query"]}
+
+        for stage, (ranked, latency_ms) in results.items():
+            latencies[stage].append(latency_ms)
+            for k in EVAL_KS:
+                metrics[stage][f"recall@{k}"].append(recall_at_k(ranked, relevant, k))
+            metrics[stage]["mrr"].append(reciprocal_rank(ranked, relevant))
+            metrics[stage]["ndcg@10"].append(ndcg_at_k(ranked, relevant, 10))
+            row[stage] = round(reciprocal_rank(ranked, relevant), 4)
+        details.append(row)
+
+    report = {
+        "query_set_version": query_set["version"],
+        "n_queries": len(query_set["queries"]),
+        "corpus_version": retriever_setup.corpus_version(),
+        "config": {
+            "bm25_top_k": BM25_TOP_K,
+            "faiss_top_k": FAISS_TOP_K,
+            "rerank_top_k": COLBERT_TOP_K,
+            "fusion": retriever.fusion,
+            "weights": list(retriever.weights),
+            "field_leg_weight": retriever.field_weight,
+            "faiss_index_type": FAISS_INDEX_TYPE,
+            "rerank_cascade": RERANK_CASCADE,
+            "cascade_recall_bias": CASCADE_RECALL_BIAS,
+        },
+        "stages": {
+            stage: {
+                **{name: round(float(np.mean(values)), 4) for name, values in metrics[stage].items()},
+                "latency_ms": percentiles(latencies[stage]),
+            }
+            for stage in STAGES
+        },
+    }
+    if per_query:
+        report["per_query_mrr"] = details
+    return report
+
+
+def print_report(report):
+    '''Prints a one-line summary per stage'''
+    print(f"\nQuery set v{report['query_set_version']} ({report['n_queries']} queries)")
+    for stage, values in report["stages"].items():
+        scores = "  ".join(f"{k}={v:.3f}" for k, v in values.items() if k != "latency_ms")
+        lat = values["latency_ms"]
+        print(f"{stage:<9} {scores}  p50={lat['p50']:.1f}ms p95={lat['p95']:.1f}ms p99={lat['p99']:.1f}ms")
+
+
+# =================================================
+# ENTRY POINT
+# =================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="Bootstrap a labelled query set from syllabus tags")
+    build.add_argument("--version", type=int, default=1)
+    build.add_argument("--min-relevant", type=int, default=EVAL_MIN_RELEVANT)
+    build.add_argument("--force", action="store_true", help="Overwrite an existing query set version")
+
+    run = sub.add_parser("run", help="Evaluate every pipeline stage and write a JSON report")
+    run.add_argument("--queries", type=str, default=query_set_path(1))
+    run.add_argument("--out", type=str, default="eval_report.json")
+    run.add_argument("--per-query", action="store_true", help="Include per-query reciprocal ranks")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        path = query_set_path(args.version)
+        if os.path.exists(path) and not args.force:
+            sys.exit(f"{path} already exists; bump --version (query sets are immutable once published) or pass --force")
+        query_set = build_query_set(load_questions(), args.version, args.min_relevant)
+        os.makedirs(EVAL_DIR, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(query_set, f, indent=2, sort_keys=True)
+        print(f"Wrote {len(query_set['queries'])} labelled queries to {path}")
+
+    else:
+        # Fully offline: never reach out to the Hugging Face hub
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+        from setup import retriever_setup
+
+        with open(args.queries, "r", encoding="utf-8") as f:
+            query_set = json.load(f)
+
+        try:
+            retriever = retriever_setup.create_ensemble_retriever(load_questions().get("questions", []), read_only=True)
+        except ValueError as e:
+            sys.exit(str(e))
+        reranker = retriever_setup.load_reranker()
+        report = evaluate(query_set, retriever, reranker, per_query=args.per_query)
+
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print_report(report)
+        print(f"\nReport written to {args.out}")
@@ -1,18 +1,29 @@
 import os
 import re
 import sys
+import argparse
 from pathlib import Path
 
 # Ensure project root is importable (for `config/` etc.)
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
 from ai_calls import retrieval_pipeline
-
-from setup import retriever_setup, ai_model_setup
-from doc_processing import pdf_generator, exam_extractor
-from doc_processing.process_questions import tag_questions_with_llm, save_questions
-
-from config.constants import EXAM_DIR, PICKLE_PATH, REVISION_DIR
+from ai_calls.query_cache import QueryCache
+
+from setup import retriever_setup, tracing
+
+# Heavier modules (google-generativeai, PyMuPDF, pypdf/reportlab) are imported where
+# they are used, so `--lazy` can show the prompt before any of them load.
+from config.constants import (
+    EXAM_DIR,
+    JOB_BACKEND,
+    JOB_WORKERS,
+    PICKLE_PATH,
+    SERVE_HOST,
+    SERVE_PORT,
+    SERVE_THREADS,
+    TRACE_DIR,
+)
 
 # =================================================
 # PRE-RUN SETUP
@@ -23,14 +34,48 @@ def setup():
     Processes any necessary documents
     Initialises ensemble retriever with processed documents
     '''    
+    from setup import ai_model_setup
+    from doc_processing import exam_extractor
+    from doc_processing.process_questions import tag_questions_with_llm, save_questions, assign_question_ids
+
     ai_model_setup.google_api_setup()
     data = exam_extractor.process_exams(PICKLE_PATH)
+    data = assign_question_ids(data)
     data = tag_questions_with_llm(data)
     save_questions(data)
     retriever = retriever_setup.create_ensemble_retriever(data["questions"])
 
     return retriever
 
+
+def lazy_setup(warm_up=False):
+    '''
+    Fast startup: returns a LazyRetriever that loads the persisted pickle and indexes
+    when the first query arrives (no PDF sync or LLM tagging).
+    With `warm_up`, loading starts immediately on a background thread.
+    '''
+    retriever = retriever_setup.LazyRetriever(loader=load_for_queries)
+    if warm_up:
+        retriever.warm_up()
+    return retriever
+
+
+def load_for_queries():
+    '''Loader for lazy mode: the persisted retriever, plus the PDF generator import'''
+    from doc_processing import pdf_generator  # noqa: F401 - warms the pypdf/reportlab import
+
+    return retriever_setup.load_persisted_retriever()
+
+
+def bundle_setup():
+    '''
+    Read-only serving: queries go to the active corpus bundle (see setup/corpus_bundle.py),
+    which is memory-mapped and hot-swapped when a new version is activated
+    '''
+    from setup import corpus_bundle
+
+    return corpus_bundle.BundleStore()
+
 # =================================================
 # MAIN LOOP
 # =================================================
@@ -45,32 +90,116 @@ def run(retriever):
         print(f"Check that PDFs exist in '{EXAM_DIR}' and the pickle path '{PICKLE_PATH}' is valid.")
         return
 
+    cache = QueryCache()
+    pack_jobs = None  # created on the first query; it imports the PDF stack
+    pending = []  # pack jobs not reported yet
+
     while True:
+        pending = report_packs(pack_jobs, pending)
         print("\nWhat do you wish to revise? (Enter 'q' to quit)")
+        print("Optional filters: year:2023 difficulty:advanced tag:Calculus exam:<file>")
         query = input("> ")
 
         if query.lower() == "q":
+            print(f"Query cache: {cache.stats()}")
+            if pack_jobs is not None:
+                if pending:
+                    print(f"Waiting for {len(pending)} revision pack(s)...")
+                report_packs(pack_jobs, pending, wait=True)
+                print(f"Pack cache: {pack_jobs.cache.stats()}")
+                pack_jobs.close()
             print("Exiting...")
             break
 
         print("Searching for relevant questions and generating response...")
 
         try:
+            with tracing.span("query"):
+                query, filters = retrieval_pipeline.parse_filters(query)
+                response = retrieval_pipeline.get_response(query, retriever, cache=cache, filters=filters)
+                from doc_processing import thumbnails
+
+                # Frequently retrieved pages get their previews pre-rendered (thumbnails.py prewarm)
+                thumbnails.default_service().record_retrieved(response)
+                print("\n--- AI REVISION ASSISTANT ---")
+                print(response)
+                print("----------------------------")
+
+                if pack_jobs is None:
+                    from doc_processing.pack_jobs import PackJobQueue
+
+                    pack_jobs = PackJobQueue().start()
+
+                # The pack is built in the background and reported at the next prompt; packs
+                # are named by content, so identical result sets reuse one file
+                job = pack_jobs.submit(response, query=query)
+                if job is None:
+                    print("No exam pages found for a revision pack")
+                elif job["status"] == "done":
+                    print(f"Revision pack: {job['path']}")
+                else:
+                    print("Revision pack queued")
+                    pending.append(job["id"])
 
-            response = retrieval_pipeline.get_response(query, retriever)
-            print("\n--- AI REVISION ASSISTANT ---")
-            print(response)
-            print("----------------------------")
+        except Exception as e:
+            print(f"An error occurred: {e}")
 
-            pdf_name = f"{query}.pdf"
+        if tracing.is_enabled():
+            export_traces()
 
-            os.makedirs(REVISION_DIR, exist_ok=True)
-            out_path = os.path.join(REVISION_DIR, pdf_name)
-            pdf_generator.build_custom_pdf(response, EXAM_DIR, out_path)
 
-        except Exception as e:
-            print(f"An error occurred: {e}")
+def report_packs(pack_jobs, pending, wait=False):
+    '''Prints the packs among `pending` job IDs that have finished; returns the rest'''
+    still_pending = []
+    for job_id in pending:
+        job = pack_jobs.wait(job_id) if wait else pack_jobs.get(job_id)
+        if job is None:
+            continue
+        if job["status"] == "done":
+            print(f"Revision pack ready for '{job['query']}': {job['path']}")
+        elif job["status"] == "failed":
+            print(f"Revision pack for '{job['query']}' failed: {job['error']}")
+        else:
+            still_pending.append(job_id)
+    return still_pending
+
+
+def export_traces():
+    '''Writes the spans recorded so far as JSONL and as a Chrome trace (HSC_TRACE=1)'''
+    jsonl = tracing.export_jsonl(os.path.join(TRACE_DIR, "spans.jsonl"))
+    chrome = tracing.export_chrome_trace(os.path.join(TRACE_DIR, "trace.json"))
+    print(f"Traces written to {jsonl} and {chrome}")
 
 if __name__ == "__main__":
-    retriever = setup()
-    run(retriever)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="HSC exam revision assistant")
+    parser.add_argument("--lazy", action="store_true",
+                        help="Show the prompt immediately; load persisted corpus and indexes on the first query")
+    parser.add_argument("--warmup", action="store_true",
+                        help="With --lazy, start loading in the background straight away")
+    parser.add_argument("--bundle", action="store_true",
+                        help="Serve the active memory-mapped corpus bundle, swapping when a new version is activated")
+    parser.add_argument("--serve", action="store_true",
+                        help="Run the HTTP service (backend/server.py) instead of the interactive prompt")
+    parser.add_argument("--host", type=str, default=SERVE_HOST)
+    parser.add_argument("--port", type=int, default=SERVE_PORT)
+    parser.add_argument("--threads", type=int, default=SERVE_THREADS, help="With --serve, search threads")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="With --serve, run searches on this many forked query worker processes instead of threads")
+    parser.add_argument("--job-backend", choices=["memory", "sqlite"], default=JOB_BACKEND,
+                        help="With --serve, where pack build jobs are queued (sqlite: shared with pack_jobs.py workers)")
+    parser.add_argument("--job-workers", type=int, default=JOB_WORKERS,
+                        help="With --serve, pack build threads in this process (0 = leave builds to pack_jobs.py workers)")
+    args = parser.parse_args()
+
+    if args.bundle:
+        retriever = bundle_setup()
+    else:
+        retriever = lazy_setup(warm_up=args.warmup) if args.lazy else setup()
+
+    if args.serve:
+        import server
+
+        server.serve(retriever, host=args.host, port=args.port, threads=args.threads, workers=args.workers,
+                     job_backend=args.job_backend, job_workers=args.job_workers)
+    else:
+        run(retriever)
\ No newline at end of file
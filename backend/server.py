@@ -0,0 +1,343 @@
+'''
+HTTP service for the revision assistant: FastAPI served by uvicorn.
+
+    python backend/main.py --lazy --serve --port 8000
+
+The retriever, the models and the query, pack and preview caches are loaded once per
+process and shared by every request. Endpoints:
+
+    GET /search?q=...&top_k=10      reranked questions as JSON, with scores and metadata;
+                                    filter tokens work as at the prompt ("integration year:2023").
+                                    With &pack=true a pack build is queued and its job returned
+    POST /jobs?q=...&top_k=10       queues the revision pack build for a query (202 + job)
+    GET /jobs/{id}                  job status; a finished job links to its pack
+    GET /pack?q=...&top_k=10        the revision pack PDF for a query, waiting for its build
+    GET /packs/{key}.pdf            a cached pack by key
+    GET /pages/{exam}/{page}        page preview (?size=thumb|preview|full&format=png|jpg|webp)
+    GET /health, GET /stats
+
+Model, PDF and job store work never runs on the event loop. Searches go to SERVE_THREADS threads, or
+to query worker processes with --workers (see setup/worker_pool.py); pack builds and
+previews go to SERVE_PDF_THREADS threads, and pack builds run on the background job
+queue (doc_processing/pack_jobs.py), so no search waits for a PDF. Each pool admits at most SERVE_MAX_PENDING
+requests, running or queued. Past that (or with JOB_MAX_QUEUED builds queued) the server
+answers 503 with Retry-After instead of queueing without bound, and a request not
+answered within its timeout gets 504.
+'''
+from __future__ import annotations
+
+import os
+import re
+import sys
+import time
+import asyncio
+import threading
+import contextlib
+from urllib.parse import quote
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from config.constants import (
+    JOB_BACKEND,
+    JOB_WORKERS,
+    SERVE_CORS_ORIGINS,
+    SERVE_HOST,
+    SERVE_MAX_PENDING,
+    SERVE_PACK_TIMEOUT,
+    SERVE_PDF_THREADS,
+    SERVE_PORT,
+    SERVE_THREADS,
+    SERVE_TIMEOUT,
+    THUMBNAIL_FORMAT,
+    THUMBNAIL_SIZES,
+)
+
+from ai_calls import retrieval_pipeline
+from ai_calls.query_cache import QueryCache
+from setup import retriever_setup
+
+PACK_KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class Overloaded(Exception):
+    '''A pool already has `max_pending` requests running or queued'''
+
+
+class RequestTimeout(Exception):
+    '''A request's work did not finish within its timeout'''
+
+
+class BoundedPool:
+    '''
+    Admission control in front of anything that returns a concurrent Future (a thread
+    pool's `submit`, or `WorkerPool.submit`). A request holds its slot until the work
+    itself finishes, so work whose request already timed out still counts against the limit.
+    '''
+
+    def __init__(self, submit, max_pending=SERVE_MAX_PENDING, name="pool"):
+        self._submit = submit
+        self.max_pending = max_pending
+        self.name = name
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def submit(self, *args) -> Future:
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise Overloaded(self.name)
+            self.pending += 1
+        try:
+            future = self._submit(*args)
+        except BaseException:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, _future):
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+
+    async def run(self, *args, timeout):
+        '''
+        Submits the work and awaits it. On timeout only the wait is abandoned: the work
+        runs to completion and keeps its slot until then (a query worker cannot be
+        interrupted, and cancelling its Future would free the slot while it is busy)
+        '''
+        future = asyncio.wrap_future(self.submit(*args))
+        # Retrieves the outcome of work nobody waits for any more, so asyncio does not log it
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise RequestTimeout(self.name) from None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+            }
+
+
+class Service:
+    '''Everything the endpoints share: retriever, caches and the bounded work pools'''
+
+    def __init__(self, retriever, threads=SERVE_THREADS, pdf_threads=SERVE_PDF_THREADS, workers=None,
+                 max_pending=SERVE_MAX_PENDING, job_backend=JOB_BACKEND, job_workers=JOB_WORKERS):
+        from doc_processing import pack_jobs, thumbnails
+        from doc_processing.pack_cache import PackCache
+
+        self.retriever = retriever
+        self.cache = QueryCache()
+        self.pack_cache = PackCache()
+        self.thumbnails = thumbnails.default_service()
+        self.jobs = pack_jobs.PackJobQueue(pack_jobs.open_store(job_backend), workers=job_workers,
+                                           cache=self.pack_cache).start()
+        self.started = time.time()
+
+        self.worker_pool = None
+        self._executors = []
+        if workers:
+            from setup.worker_pool import WorkerPool
+
+            # Forked after the retriever and models are loaded here (see worker_pool.preload)
+            self.worker_pool = WorkerPool(workers, loader=lambda: retriever).start()
+            search_submit = self.worker_pool.submit
+        else:
+            from setup import encoding_scheduler
+
+            # Each search thread gets its share of the cores instead of all of them, and
+            # its own pair of retrieval leg threads
+            encoding_scheduler.configure_torch_threads(max(1, (os.cpu_count() or 1) // threads))
+            retriever_setup.set_leg_workers(2 * threads)
+            executor = ThreadPoolExecutor(threads, thread_name_prefix="search")
+            self._executors.append(executor)
+
+            def search_submit(query, top_k, filters):
+                return executor.submit(self._search, query, top_k, filters)
+
+        pdf_executor = ThreadPoolExecutor(pdf_threads, thread_name_prefix="pdf")
+        self._executors.append(pdf_executor)
+        self.search_pool = BoundedPool(search_submit, max_pending, name="search")
+        self.pdf_pool = BoundedPool(pdf_executor.submit, max_pending, name="pdf")
+
+    def _search(self, query, top_k, filters):
+        return retrieval_pipeline.get_response(query, self.retriever, top_k=top_k, cache=self.cache, filters=filters)
+
+    def close(self):
+        self.thumbnails.save()
+        self.jobs.close()
+        for executor in self._executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if self.worker_pool is not None:
+            self.worker_pool.close()
+
+
+def result_json(doc, rank) -> dict:
+    '''One search result: question text, metadata, retrieval/rerank scores and a preview URL'''
+    metadata = {k: v for k, v in doc.metadata.items() if k != "retrieval"}
+    retrieval = doc.metadata.get("retrieval", {})
+    exam, page = metadata.get("exam"), metadata.get("page")
+    return {
+        "rank": rank,
+        "id": metadata.get("id"),
+        "text": doc.page_content,
+        "scores": {k: v for k, v in retrieval.items() if k != "timings"},
+        "metadata": metadata,
+        "preview": f"/pages/{quote(str(exam))}/{page}" if exam and page is not None else None,
+    }
+
+
+def job_json(job) -> dict:
+    '''A pack job for clients: the server-side path is replaced by a download URL'''
+    out = {k: v for k, v in job.items() if k != "path"}
+    out["download"] = f"/packs/{job['key']}.pdf" if job["status"] == "done" else None
+    return out
+
+
+def create_app(service: Service):
+    from fastapi import FastAPI, HTTPException, Query
+    from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.responses import FileResponse, JSONResponse
+
+    from doc_processing.bulk_packs import slugify
+    from doc_processing.pack_jobs import QueueFull
+    from doc_processing.thumbnails import FORMATS, MEDIA_TYPES
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        yield
+        service.close()
+
+    app = FastAPI(title="HSC revision assistant", lifespan=lifespan)
+    app.add_middleware(CORSMiddleware, allow_origins=list(SERVE_CORS_ORIGINS), allow_methods=["GET", "POST"])
+
+    @app.exception_handler(Overloaded)
+    async def overloaded(request, exc):
+        return JSONResponse({"detail": f"Server busy ({exc}), retry shortly"}, status_code=503,
+                            headers={"Retry-After": "1"})
+
+    @app.exception_handler(QueueFull)
+    async def queue_full(request, exc):
+        return JSONResponse({"detail": str(exc)}, status_code=503, headers={"Retry-After": "5"})
+
+    @app.exception_handler(RequestTimeout)
+    async def timed_out(request, exc):
+        return JSONResponse({"detail": f"Request timed out ({exc})"}, status_code=504)
+
+    async def run_search(q, top_k):
+        query, filters = retrieval_pipeline.parse_filters(q)
+        if not query and not filters:
+            raise HTTPException(400, "Empty query")
+        docs = await service.search_pool.run(query, top_k, filters or None, timeout=SERVE_TIMEOUT)
+        service.thumbnails.record_retrieved(docs, save=False)
+        return query, filters, docs
+
+    async def submit_pack(query, docs):
+        job = await service.pdf_pool.run(service.jobs.submit, docs, query, timeout=SERVE_TIMEOUT)
+        if job is None:
+            raise HTTPException(404, "No exam pages found for this query")
+        return job
+
+    @app.get("/health")
+    async def health():
+        return {
+            "status": "ok",
+            "loaded": getattr(service.retriever, "loaded", True),
+            "corpus_version": retriever_setup.corpus_version(),
+            "uptime_s": round(time.time() - service.started, 1),
+        }
+
+    @app.get("/stats")
+    async def stats():
+        return {
+            "search_pool": service.search_pool.stats(),
+            "pdf_pool": service.pdf_pool.stats(),
+            "query_cache": service.cache.stats(),
+            "pack_cache": service.pack_cache.stats(),
+            "thumbnails": service.thumbnails.stats(),
+            "pack_jobs": await asyncio.to_thread(service.jobs.stats),
+        }
+
+    @app.get("/search")
+    async def search(q: str, top_k: int = Query(10, ge=1, le=50), pack: bool = False):
+        start = time.perf_counter()
+        query, filters, docs = await run_search(q, top_k)
+        response = {
+            "query": query,
+            "filters": filters,
+            "took_ms": round((time.perf_counter() - start) * 1000, 1),
+            "results": [result_json(d, rank) for rank, d in enumerate(docs, start=1)],
+        }
+        if pack:
+            response["pack_job"] = job_json(await submit_pack(query, docs)) if docs else None
+        return response
+
+    @app.post("/jobs", status_code=202)
+    async def create_job(q: str, top_k: int = Query(10, ge=1, le=50)):
+        query, _, docs = await run_search(q, top_k)
+        return job_json(await submit_pack(query, docs))
+
+    @app.get("/jobs/{job_id}")
+    async def job_status(job_id: str):
+        job = await asyncio.to_thread(service.jobs.get, job_id)
+        if job is None:
+            raise HTTPException(404, "No such job")
+        return job_json(job)
+
+    @app.get("/pack")
+    async def pack(q: str, top_k: int = Query(10, ge=1, le=50)):
+        query, _, docs = await run_search(q, top_k)
+        job = await submit_pack(query, docs)
+        deadline = time.monotonic() + SERVE_PACK_TIMEOUT
+        while job["status"] not in ("done", "failed"):
+            if time.monotonic() >= deadline:
+                raise RequestTimeout("pack build")
+            await asyncio.sleep(0.1)
+            job = await asyncio.to_thread(service.jobs.get, job["id"])
+        if job["status"] == "failed":
+            raise HTTPException(500, f"Pack build failed: {job['error']}")
+        return FileResponse(job["path"], media_type="application/pdf", filename=f"revision-{slugify(query)}.pdf")
+
+    @app.get("/packs/{key}.pdf")
+    async def cached_pack(key: str):
+        path = service.pack_cache.path(key)
+        if not PACK_KEY_RE.match(key) or not os.path.exists(path):
+            raise HTTPException(404, "No such pack")
+        return FileResponse(path, media_type="application/pdf", filename=f"revision-{key[:12]}.pdf")
+
+    @app.get("/pages/{exam}/{page}")
+    async def page_preview(exam: str, page: int, size: str = "preview", format: str = THUMBNAIL_FORMAT):
+        if size not in THUMBNAIL_SIZES or format not in FORMATS:
+            raise HTTPException(400, f"size must be one of {', '.join(THUMBNAIL_SIZES)}; "
+                                     f"format one of {', '.join(FORMATS)}")
+        path = await service.pdf_pool.run(service.thumbnails.render, exam, page, size, format, timeout=SERVE_TIMEOUT)
+        if path is None:
+            raise HTTPException(404, "No such exam page")
+        return FileResponse(path, media_type=MEDIA_TYPES[format], headers={"Cache-Control": "public, max-age=3600"})
+
+    return app
+
+
+def serve(retriever, host=SERVE_HOST, port=SERVE_PORT, threads=SERVE_THREADS, workers=None,
+          max_pending=SERVE_MAX_PENDING, job_backend=JOB_BACKEND, job_workers=JOB_WORKERS):
+    '''Runs the HTTP service on `retriever` until interrupted'''
+    import uvicorn
+
+    service = Service(retriever, threads=threads, workers=workers, max_pending=max_pending,
+                      job_backend=job_backend, job_workers=job_workers)
+    print(f"Serving on http://{host}:{port}")
+    uvicorn.run(create_app(service), host=host, port=port)
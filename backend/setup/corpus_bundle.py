@@ -0,0 +1,511 @@
+'''
+Versioned, memory-mapped corpus bundles.
+
+`build_bundle` writes everything a serving process needs into one immutable directory,
+BUNDLE_ROOT/<version>/:
+
+    bundle.json         manifest: version, corpus version stamp, sizes, BM25 parameters
+    records.bin         UTF-8 JSON of every question (page_content + metadata), back to back
+    record_offsets.npy  int64 byte offsets into records.bin (n + 1 entries)
+    embeddings.npy      float32 (n, dim) question-text embeddings, row i = record i
+    embedding_norms.npy float32 squared L2 norm of every row
+    index.faiss         trained ANN index for non-flat index types (label i = record i)
+    bm25_vocab.json     term -> term ID
+    bm25_indptr.npy     CSR postings: term t occupies [indptr[t], indptr[t + 1])
+    bm25_docs.npy       int32 record positions of each posting
+    bm25_tfs.npy        float32 term frequencies of each posting
+    bm25_idf.npy        float64 IDF per term (rank_bm25's BM25Okapi values)
+    bm25_norm.npy       float64 k1 * (1 - b + b * len / avgdl) per record
+    filters.json        metadata filter postings (field -> value -> record positions)
+    exam_pages.json     exam -> page -> record positions
+
+Serving processes open the arrays with `np.load(mmap_mode="r")` and ANN indexes with
+`faiss.IO_FLAG_MMAP`, so processes on one host share the pages through the OS page cache
+and nothing is unpickled. Flat bundles are searched directly over the mapped matrix
+(exactly what IndexFlatL2 computes), because reading a flat FAISS index copies it.
+
+Activation rewrites the BUNDLE_POINTER file with `os.replace`, so readers see either the
+old or the new version. `BundleStore` checks the pointer every BUNDLE_CHECK_INTERVAL
+seconds and swaps retrievers between queries; in-flight queries finish on the old bundle.
+
+Usage:
+    python backend/setup/corpus_bundle.py build
+    python backend/setup/corpus_bundle.py list
+    python backend/setup/corpus_bundle.py activate <version>
+'''
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import threading
+import numpy as np
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import TYPE_CHECKING, List
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from config.constants import (
+    BUNDLE_ROOT,
+    BUNDLE_POINTER,
+    BUNDLE_CHECK_INTERVAL,
+    BUNDLE_KEEP,
+    BM25_TOP_K,
+    FAISS_TOP_K,
+    EMBEDDING_MODEL,
+    FUSION_METHOD,
+    RRF_C,
+)
+
+from setup import encoding_scheduler, retriever_setup, tracing
+from setup.metadata_index import MetadataIndex
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+BUNDLE_FORMAT = 1
+MANIFEST_NAME = "bundle.json"
+
+
+# =================================================
+# BUILD
+# =================================================
+
+def build_bundle(data=None, root=BUNDLE_ROOT, version=None, index_type=None, activate=True) -> str:
+    '''
+    Writes a new bundle version from the questions pickle (or `data`) and returns its path.
+
+    Vectors come from the persisted FAISS index after syncing it, so only questions whose
+    text changed since the last index update are embedded. Bundles carry no tag/skill
+    field index, so bundle retrieval fuses BM25 and text vectors only. The bundle is written to a temporary
+    directory and renamed into place, so a half-written version is never visible.
+    '''
+    from doc_processing.process_questions import load_questions
+    from setup import index_factory
+
+    if data is None:
+        data = load_questions()
+    docs = retriever_setup.questions_to_docs(data.get("questions", []))
+    if not docs:
+        raise ValueError("No questions found — nothing to bundle")
+    docs = list(retriever_setup.index_docs_by_id(docs).values())
+    ids = [d.metadata["id"] for d in docs]
+    text_docs = retriever_setup.questions_to_docs(data.get("questions", []), expand=False)
+    texts_by_id = {d.metadata["id"]: d.page_content for d in text_docs}
+
+    embedding = retriever_setup.load_embedding()
+    vs = retriever_setup.load_or_update_faiss(text_docs, embedding, index_type)
+    index_type = index_factory.index_type_of(vs.index)
+    if index_type == "ivf_pq":
+        # PQ codes only approximate the vectors; the bundle keeps the exact matrix
+        vectors = encoding_scheduler.embed_documents(embedding, [texts_by_id[qid] for qid in ids])
+    else:
+        vectors = index_factory.stored_vectors(vs, ids)
+
+    version = version or datetime.now(timezone.utc).strftime("v%Y%m%d-%H%M%S")
+    final_path = os.path.join(root, version)
+    if os.path.exists(final_path):
+        raise FileExistsError(f"Bundle version {version} already exists")
+    tmp_path = os.path.join(root, f".tmp-{version}")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    start = time.perf_counter()
+    try:
+        write_records(tmp_path, docs)
+
+        np.save(os.path.join(tmp_path, "embeddings.npy"), np.ascontiguousarray(vectors))
+        np.save(os.path.join(tmp_path, "embedding_norms.npy"), (vectors ** 2).sum(axis=1).astype("float32"))
+        if index_type != "flat":
+            import faiss
+
+            index = index_factory.create_index(index_type, vectors.shape[1], len(vectors))
+            index_factory.train_index(index, vectors)
+            index.add(np.ascontiguousarray(vectors))
+            faiss.write_index(index, os.path.join(tmp_path, "index.faiss"))
+
+        bm25_params = write_bm25(tmp_path, docs)
+
+        metadata_index = MetadataIndex(docs)
+        _write_json(os.path.join(tmp_path, "filters.json"), {"ids": ids, "postings": metadata_index.postings()})
+        _write_json(os.path.join(tmp_path, "exam_pages.json"), exam_page_index(docs))
+
+        _write_json(os.path.join(tmp_path, MANIFEST_NAME), {
+            "format": BUNDLE_FORMAT,
+            "version": version,
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "corpus_version": retriever_setup.corpus_version(),
+            "index_type": index_type,
+            "embedding_model": EMBEDDING_MODEL,
+            "n_docs": len(docs),
+            "dim": int(vectors.shape[1]),
+            "bm25": bm25_params,
+        })
+        os.rename(tmp_path, final_path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    print(f"Built corpus bundle {version} ({len(docs)} questions, '{index_type}') in {time.perf_counter() - start:.1f}s")
+    if activate:
+        activate_bundle(version, root)
+        prune_bundles(root)
+    return final_path
+
+
+def write_records(path, docs: List[Document]) -> None:
+    '''Writes every Document as JSON into records.bin with an offsets array for random access'''
+    offsets = [0]
+    with open(os.path.join(path, "records.bin"), "wb") as f:
+        for d in docs:
+            blob = json.dumps({"page_content": d.page_content, "metadata": d.metadata},
+                              ensure_ascii=False, default=str).encode("utf-8")
+            f.write(blob)
+            offsets.append(offsets[-1] + len(blob))
+    np.save(os.path.join(path, "record_offsets.npy"), np.asarray(offsets, dtype="int64"))
+
+
+def write_bm25(path, docs: List[Document]) -> dict:
+    '''
+    Writes BM25 statistics as a term-major postings list. IDF values and length
+    normalisation come from the same BM25Okapi that BM25Retriever builds, so bundle
+    scores match the in-memory retriever. Returns the scoring parameters.
+    '''
+    from rank_bm25 import BM25Okapi
+    from langchain_community.retrievers.bm25 import default_preprocessing_func
+
+    corpus = [default_preprocessing_func(d.page_content) for d in docs]
+    bm25 = BM25Okapi(corpus)
+
+    vocab = {term: i for i, term in enumerate(sorted(bm25.idf))}
+    postings = defaultdict(list)
+    for pos, tokens in enumerate(corpus):
+        for term, tf in Counter(tokens).items():
+            postings[vocab[term]].append((pos, tf))
+
+    indptr = np.zeros(len(vocab) + 1, dtype="int64")
+    doc_ids, tfs = [], []
+    for term_id in range(len(vocab)):
+        entries = postings.get(term_id, [])
+        doc_ids.extend(p for p, _ in entries)
+        tfs.extend(tf for _, tf in entries)
+        indptr[term_id + 1] = len(doc_ids)
+
+    doc_len = np.asarray(bm25.doc_len, dtype="float64")
+    norm = bm25.k1 * (1 - bm25.b + bm25.b * doc_len / bm25.avgdl)
+    idf = np.asarray([bm25.idf[term] for term in vocab], dtype="float64")
+
+    _write_json(os.path.join(path, "bm25_vocab.json"), vocab)
+    np.save(os.path.join(path, "bm25_indptr.npy"), indptr)
+    np.save(os.path.join(path, "bm25_docs.npy"), np.asarray(doc_ids, dtype="int32"))
+    np.save(os.path.join(path, "bm25_tfs.npy"), np.asarray(tfs, dtype="float32"))
+    np.save(os.path.join(path, "bm25_idf.npy"), idf)
+    np.save(os.path.join(path, "bm25_norm.npy"), norm)
+    return {"k1": bm25.k1, "b": bm25.b, "avgdl": bm25.avgdl}
+
+
+def exam_page_index(docs: List[Document]) -> dict:
+    '''Maps exam -> page -> record positions, so page lookups need no record decoding'''
+    index = defaultdict(lambda: defaultdict(list))
+    for pos, d in enumerate(docs):
+        index[d.metadata.get("exam")][str(d.metadata.get("page"))].append(pos)
+    return {exam: dict(pages) for exam, pages in index.items()}
+
+
+# =================================================
+# VERSIONS
+# =================================================
+
+def current_version(root=BUNDLE_ROOT) -> str | None:
+    '''Version named by the pointer file, or None if no bundle has been activated'''
+    try:
+        with open(os.path.join(root, BUNDLE_POINTER), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def activate_bundle(version, root=BUNDLE_ROOT) -> None:
+    '''Points serving processes at `version`; the pointer is replaced atomically'''
+    if not os.path.exists(os.path.join(root, version, MANIFEST_NAME)):
+        raise FileNotFoundError(f"No bundle version {version} in {root}")
+    pointer = os.path.join(root, BUNDLE_POINTER)
+    tmp_path = pointer + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, pointer)
+    print(f"Activated corpus bundle {version}")
+
+
+def list_bundles(root=BUNDLE_ROOT) -> List[str]:
+    '''Completed bundle versions, oldest first'''
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        name for name in os.listdir(root)
+        if os.path.exists(os.path.join(root, name, MANIFEST_NAME))
+    )
+
+
+def prune_bundles(root=BUNDLE_ROOT, keep=BUNDLE_KEEP) -> List[str]:
+    '''
+    Deletes all but the newest `keep` inactive versions. Processes still mapping a
+    deleted version keep their pages until they swap (unlinked files stay readable).
+    '''
+    active = current_version(root)
+    inactive = [v for v in list_bundles(root) if v != active]
+    removed = inactive[:max(len(inactive) - keep, 0)]
+    for version in removed:
+        shutil.rmtree(os.path.join(root, version), ignore_errors=True)
+    if removed:
+        print(f"Removed {len(removed)} old corpus bundle(s)")
+    return removed
+
+
+# =================================================
+# SERVING
+# =================================================
+
+class CorpusBundle:
+    '''
+    Read-only view of one bundle version. Arrays are memory-mapped, and records are decoded
+    only when a hit is returned, so opening a bundle costs a few small JSON reads.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != BUNDLE_FORMAT:
+            raise ValueError(f"Unsupported bundle format {self.manifest.get('format')} in {path}")
+
+        self.version = self.manifest["version"]
+        self.index_type = self.manifest["index_type"]
+
+        self._records = np.memmap(os.path.join(path, "records.bin"), dtype=np.uint8, mode="r")
+        self._offsets = self._load("record_offsets.npy")
+        self.embeddings = self._load("embeddings.npy")
+        self.norms = self._load("embedding_norms.npy")
+
+        self.index = None
+        if self.index_type != "flat":
+            import faiss
+            from setup import index_factory
+
+            self.index = faiss.read_index(os.path.join(path, "index.faiss"), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            index_factory.configure_search(self.index)
+
+        with open(os.path.join(path, "bm25_vocab.json"), "r", encoding="utf-8") as f:
+            self.vocab = json.load(f)
+        self.bm25_indptr = self._load("bm25_indptr.npy")
+        self.bm25_docs = self._load("bm25_docs.npy")
+        self.bm25_tfs = self._load("bm25_tfs.npy")
+        self.bm25_idf = self._load("bm25_idf.npy")
+        self.bm25_norm = self._load("bm25_norm.npy")
+        self.k1 = self.manifest["bm25"]["k1"]
+
+        with open(os.path.join(path, "filters.json"), "r", encoding="utf-8") as f:
+            filters = json.load(f)
+        self.ids = filters["ids"]
+        self.metadata_index = MetadataIndex.from_postings(self.ids, filters["postings"])
+
+        with open(os.path.join(path, "exam_pages.json"), "r", encoding="utf-8") as f:
+            self.exam_pages = json.load(f)
+
+    def _load(self, name):
+        return np.load(os.path.join(self.path, name), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def record(self, pos: int) -> dict:
+        '''Decodes record `pos`: {"page_content": str, "metadata": dict}'''
+        start, end = int(self._offsets[pos]), int(self._offsets[pos + 1])
+        return json.loads(self._records[start:end].tobytes().decode("utf-8"))
+
+    def document(self, pos: int) -> Document:
+        from langchain_core.documents import Document
+
+        return Document(**self.record(pos))
+
+    def bm25_scores(self, tokens: List[str]) -> np.ndarray:
+        '''
+        BM25Okapi scores of every record, computed from the postings of the query terms only.
+        Repeated query tokens count repeatedly, as in rank_bm25.
+        '''
+        scores = np.zeros(len(self), dtype="float64")
+        for token in tokens:
+            term_id = self.vocab.get(token)
+            if term_id is None:
+                continue
+            lo, hi = self.bm25_indptr[term_id], self.bm25_indptr[term_id + 1]
+            docs, tfs = self.bm25_docs[lo:hi], self.bm25_tfs[lo:hi]
+            scores[docs] += self.bm25_idf[term_id] * tfs * (self.k1 + 1) / (tfs + self.bm25_norm[docs])
+        return scores
+
+    def bm25_search(self, query: str, k: int, positions=None) -> List[tuple]:
+        '''Top-k (Document, score) pairs, ranked like `retriever_setup.bm25_search`'''
+        from langchain_community.retrievers.bm25 import default_preprocessing_func
+
+        scores = self.bm25_scores(default_preprocessing_func(query))
+        if positions is None:
+            order = np.argsort(scores)[::-1][:k]
+            return [(self.document(i), scores[i]) for i in order]
+
+        if len(positions) == 0:
+            return []
+        subset = scores[positions]
+        order = np.argsort(-subset, kind="stable")[:k]
+        return [(self.document(positions[i]), subset[i]) for i in order]
+
+    def dense_search(self, vectors, k: int, labels=None) -> List[List[tuple]]:
+        '''(Document, squared L2 distance) pairs per query vector, like `faiss_search_batch`'''
+        x = np.ascontiguousarray(np.asarray(vectors, dtype="float32"))
+
+        if self.index is not None:
+            if labels is None:
+                distances, indices = self.index.search(x, k)
+            else:
+                from setup import index_factory
+
+                params = index_factory.search_params(self.index, labels)
+                distances, indices = self.index.search(x, min(k, len(labels)), params=params)
+            return [
+                [(self.document(i), float(d)) for d, i in zip(dist_row, idx_row) if i != -1]
+                for dist_row, idx_row in zip(distances, indices)
+            ]
+
+        candidates = np.arange(len(self)) if labels is None else np.asarray(labels, dtype="int64")
+        matrix = self.embeddings if labels is None else self.embeddings[candidates]
+        norms = self.norms if labels is None else self.norms[candidates]
+        distances = (x ** 2).sum(axis=1, keepdims=True) - 2 * (x @ matrix.T) + norms
+        k = min(k, len(candidates))
+
+        results = []
+        for row in distances:
+            top = np.argpartition(row, k - 1)[:k] if k < len(row) else np.arange(len(row))
+            top = top[np.argsort(row[top], kind="stable")]
+            results.append([(self.document(candidates[i]), float(max(row[i], 0.0))) for i in top])
+        return results
+
+
+class BundleRetriever(retriever_setup.FusionRetriever):
+    '''`FusionRetriever` whose BM25 and dense legs are served from a `CorpusBundle`'''
+
+    def __init__(self, bundle: CorpusBundle, weights=(0.4, 0.6), fusion=FUSION_METHOD, rrf_c=RRF_C,
+                 bm25_k=BM25_TOP_K, faiss_k=FAISS_TOP_K):
+        self.bundle = bundle
+        self.bm25_k = bm25_k
+        self._init_fusion(bundle.metadata_index, weights, fusion, rrf_c, faiss_k)
+
+    @property
+    def embedding(self):
+        return retriever_setup.load_embedding()
+
+    def _sparse_leg(self, queries, positions=None):
+        with tracing.span("bm25", queries=len(queries), bundle=self.bundle.version) as trace:
+            hits = [self.bundle.bm25_search(q, self.bm25_k, positions) for q in queries]
+            trace.set(candidates=sum(len(h) for h in hits))
+            return hits
+
+    def _dense_leg(self, queries, labels=None, positions=None, vectors=None):
+        if labels is not None and len(labels) == 0:
+            return [[] for _ in queries], [[] for _ in queries]
+        vectors = self._embed_queries(queries, vectors)
+        with tracing.span("faiss.search", k=self.faiss_k, bundle=self.bundle.version) as trace:
+            hits = self.bundle.dense_search(vectors, self.faiss_k, labels=labels)
+            trace.set(candidates=sum(len(h) for h in hits))
+        return hits, self._field_leg(vectors, positions)
+
+
+class BundleStore:
+    '''
+    Stand-in for a retriever that serves the active bundle version and hot-swaps when the
+    pointer changes. Like `LazyRetriever`, unknown attributes are forwarded to the current
+    `BundleRetriever`; a version that fails to open is skipped and the old one keeps serving.
+    '''
+
+    def __init__(self, root=BUNDLE_ROOT, check_interval=BUNDLE_CHECK_INTERVAL):
+        self.root = root
+        self.check_interval = check_interval
+        self.version = None  # the version being served
+        self._retriever = None
+        self._failed_version = None  # last version that failed to open, not retried
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def current(self) -> BundleRetriever:
+        '''Returns the retriever for the active version, swapping first if it changed'''
+        now = time.monotonic()
+        if self._retriever is None or now - self._checked_at >= self.check_interval:
+            with self._lock:
+                self._checked_at = now
+                version = current_version(self.root)
+                if version is not None and version not in (self.version, self._failed_version):
+                    self._swap(version)
+        if self._retriever is None:
+            raise FileNotFoundError(f"No active corpus bundle in {self.root} (run corpus_bundle.py build)")
+        return self._retriever
+
+    def _swap(self, version):
+        try:
+            with tracing.span("bundle.open", version=version):
+                retriever = BundleRetriever(CorpusBundle(os.path.join(self.root, version)))
+        except Exception as e:
+            if self._retriever is None:
+                raise
+            print(f"Could not open corpus bundle {version} ({e}); still serving {self.version}")
+            self._failed_version = version  # do not retry a broken version on every check
+            return
+        retriever_setup.use_corpus_version(retriever.bundle.manifest["corpus_version"])
+        self._retriever = retriever
+        self._failed_version = None
+        previous, self.version = self.version, version
+        print(f"Serving corpus bundle {version}" + (f" (was {previous})" if previous else ""))
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.current(), name)
+
+
+def _write_json(path, payload):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, default=str)
+
+
+# =================================================
+# ENTRY POINT
+# =================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="Write a new bundle version from the questions pickle")
+    build.add_argument("--version", type=str, default=None, help="Defaults to a UTC timestamp")
+    build.add_argument("--index-type", type=str, default=None)
+    build.add_argument("--no-activate", action="store_true", help="Build without switching serving processes to it")
+
+    sub.add_parser("list", help="List bundle versions")
+
+    activate = sub.add_parser("activate", help="Switch serving processes to an existing version (e.g. roll back)")
+    activate.add_argument("version")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_bundle(version=args.version, index_type=args.index_type, activate=not args.no_activate)
+    elif args.command == "list":
+        active = current_version()
+        for v in list_bundles():
+            print(("* " if v == active else "  ") + v)
+    else:
+        activate_bundle(args.version)
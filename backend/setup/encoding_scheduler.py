@@ -0,0 +1,178 @@
+'''
+Length-bucketed batching for the embedding model and the cross-encoder.
+
+Multi-part questions merged by `combine_snippets` sit next to one-line MCQs, so a batch
+in input order is padded to its longest member and most of its compute is wasted. The
+scheduler tokenises every input once, sorts by token length, and cuts the sorted order
+into batches whose padded size (batch size x longest length) stays under ENCODE_TOKEN_BUDGET,
+so short texts go through in large batches and long ones in small batches. Results are
+written back in the original input order.
+
+Torch intra-op threads are set once per process (ENCODE_THREADS, 0 = all cores).
+'''
+from __future__ import annotations
+
+import os
+import sys
+import time
+import numpy as np
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Sequence
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from config.constants import ENCODE_TOKEN_BUDGET, ENCODE_MAX_BATCH, ENCODE_THREADS
+
+from setup import tracing
+
+_threads_configured = False
+
+
+def configure_torch_threads(threads: int = ENCODE_THREADS) -> int:
+    '''Sets torch's intra-op thread count (0 = all cores); returns the count in use'''
+    global _threads_configured
+    import torch
+
+    torch.set_num_threads(threads or os.cpu_count() or 1)
+    _threads_configured = True
+    return torch.get_num_threads()
+
+
+def default_torch_threads(threads: int = ENCODE_THREADS) -> int:
+    '''
+    Applies `threads` only if nothing in this process has configured torch yet, so an
+    explicit `configure_torch_threads` (server, query workers) is never overridden
+    '''
+    if not _threads_configured:
+        return configure_torch_threads(threads)
+    import torch
+
+    return torch.get_num_threads()
+
+
+def plan_batches(lengths: Sequence[int], token_budget: int = ENCODE_TOKEN_BUDGET,
+                 max_batch_size: int = ENCODE_MAX_BATCH) -> List[np.ndarray]:
+    '''
+    Splits input positions into batches of similar token length, longest first (so
+    out-of-memory problems show up on the first batch, not the last). A batch grows
+    while batch size x longest length stays within `token_budget`.
+    '''
+    order = np.argsort(-np.asarray(lengths), kind="stable")
+    batches, current, longest = [], [], 0
+    for i in order:
+        length = max(int(lengths[i]), 1)
+        if current and (len(current) >= max_batch_size or max(longest, length) * (len(current) + 1) > token_budget):
+            batches.append(np.asarray(current))
+            current, longest = [], 0
+        current.append(i)
+        longest = max(longest, length)
+    if current:
+        batches.append(np.asarray(current))
+    return batches
+
+
+class EncodingScheduler:
+    '''
+    Runs a sentence-transformers embedder or cross-encoder over length-bucketed batches.
+    `last_stats` holds texts, batches, seconds, texts/sec and padding efficiency
+    (real tokens / padded tokens) of the most recent call.
+    '''
+
+    def __init__(self, token_budget=ENCODE_TOKEN_BUDGET, max_batch_size=ENCODE_MAX_BATCH, threads=ENCODE_THREADS):
+        self.token_budget = token_budget
+        self.max_batch_size = max_batch_size
+        self.threads = threads
+        self.last_stats = {}
+
+    def embed(self, model, texts: List[str], **encode_kwargs) -> np.ndarray:
+        '''Embeds `texts` with a SentenceTransformer; returns a float32 (n, dim) array in input order'''
+        if not texts:
+            return np.zeros((0, model.get_sentence_embedding_dimension()), dtype="float32")
+        lengths = token_lengths(model.tokenizer, texts, max_length=model.max_seq_length)
+        encode_kwargs = {k: v for k, v in encode_kwargs.items() if k not in ("batch_size", "show_progress_bar")}
+
+        def run(batch):
+            return model.encode([texts[i] for i in batch], batch_size=len(batch),
+                                show_progress_bar=False, convert_to_numpy=True, **encode_kwargs)
+
+        return self._run("encode.embed", lengths, run).astype("float32")
+
+    def predict(self, cross_encoder, pairs: List[Sequence[str]], max_batch_size: int | None = None) -> np.ndarray:
+        '''Scores (query, text) pairs with a CrossEncoder; returns scores in input order'''
+        if not pairs:
+            return np.zeros(0, dtype="float32")
+        tokenizer = cross_encoder.tokenizer
+        max_length = getattr(cross_encoder, "max_length", None) or tokenizer.model_max_length
+        lengths = token_lengths(tokenizer, [p[0] for p in pairs], [p[1] for p in pairs], max_length=max_length)
+
+        def run(batch):
+            return cross_encoder.predict([pairs[i] for i in batch], batch_size=len(batch),
+                                         show_progress_bar=False, convert_to_numpy=True)
+
+        return self._run("encode.rerank", lengths, run, max_batch_size)
+
+    def _run(self, name, lengths, run_batch, max_batch_size=None):
+        threads = default_torch_threads(self.threads)
+        batches = plan_batches(lengths, self.token_budget, max_batch_size or self.max_batch_size)
+        padded = sum(len(b) * max(lengths[i] for i in b) for b in batches)
+
+        out = None
+        start = time.perf_counter()
+        with tracing.span(name, texts=len(lengths), batches=len(batches)) as trace:
+            for batch in batches:
+                result = np.asarray(run_batch(batch))
+                if out is None:
+                    out = np.empty((len(lengths),) + result.shape[1:], dtype=result.dtype)
+                out[batch] = result
+            seconds = time.perf_counter() - start
+            self.last_stats = {
+                "texts": len(lengths),
+                "batches": len(batches),
+                "threads": threads,
+                "seconds": round(seconds, 3),
+                "texts_per_sec": round(len(lengths) / seconds, 1) if seconds else 0.0,
+                "padding_efficiency": round(sum(lengths) / padded, 3) if padded else 1.0,
+            }
+            trace.set(texts_per_sec=self.last_stats["texts_per_sec"])
+        return out
+
+
+def token_lengths(tokenizer, texts, text_pairs=None, max_length=None) -> List[int]:
+    '''Token counts (with special tokens, truncated like the model would) for texts or text pairs'''
+    encoded = tokenizer(
+        list(texts),
+        list(text_pairs) if text_pairs is not None else None,
+        truncation=True,
+        max_length=max_length,
+        add_special_tokens=True,
+        return_attention_mask=False,
+        return_token_type_ids=False,
+    )
+    return [len(ids) for ids in encoded["input_ids"]]
+
+
+@lru_cache(maxsize=1)
+def default_scheduler() -> EncodingScheduler:
+    return EncodingScheduler()
+
+
+def embed_documents(embedding, texts: List[str]) -> np.ndarray:
+    '''
+    Scheduler-backed replacement for `HuggingFaceEmbeddings.embed_documents`: uses the
+    wrapped SentenceTransformer and the wrapper's encode kwargs (e.g. normalisation).
+    Other embedding classes fall back to their own `embed_documents`.
+    '''
+    model = getattr(embedding, "_client", None) or getattr(embedding, "client", None)
+    if model is None or not hasattr(model, "tokenizer"):
+        return np.asarray(embedding.embed_documents(texts), dtype="float32")
+
+    texts = [t.replace("\n", " ") for t in texts]  # as HuggingFaceEmbeddings does
+    scheduler = default_scheduler()
+    vectors = scheduler.embed(model, texts, **(getattr(embedding, "encode_kwargs", None) or {}))
+    stats = scheduler.last_stats
+    if len(texts) > ENCODE_MAX_BATCH:
+        print(f"Embedded {stats['texts']} texts in {stats['seconds']:.1f}s "
+              f"({stats['texts_per_sec']:.0f} texts/s, {stats['batches']} batches, "
+              f"padding efficiency {stats['padding_efficiency']:.0%})")
+    return vectors
@@ -0,0 +1,130 @@
+'''
+Tag and skill field index for the dense side of retrieval.
+
+FAISS embeds the question text only. Tags and skill types are scored here instead:
+every distinct field value ("Calculus / Definite integrals", "modelling", ...) is
+embedded once, and a question's score for a field is the best cosine similarity between
+the query and any of its values. Field scores are combined with FIELD_WEIGHTS into one
+ranking that `FusionRetriever` fuses as a third leg.
+
+Re-tagging a question only changes which values it points at; the only embeddings ever
+computed are for value strings not seen before, which are cached in FIELD_VECTORS_NAME
+next to the FAISS index.
+'''
+from __future__ import annotations
+
+import os
+import sys
+import numpy as np
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from config.constants import FAISS_ROOT, FIELD_VECTORS_NAME, FIELD_WEIGHTS, EMBEDDING_MODEL
+
+from setup import tracing
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+# Field name -> metadata key holding its values
+FIELDS = {
+    "tags": "tags",
+    "skills": "skill_types",
+}
+
+
+class FieldIndex:
+    '''
+    Per-field value vocabularies, value embeddings and document -> value postings,
+    over a fixed document order (the BM25 order, like `MetadataIndex`). With
+    `persist=False`, values embedded for the first time are not written to the cache file.
+    '''
+
+    def __init__(self, docs: List[Document], embedding, weights: Dict[str, float] = FIELD_WEIGHTS,
+                 cache_path: str | None = None, persist=True):
+        self.embedding = embedding
+        self.persist = persist
+        self.weights = {f: w for f, w in weights.items() if f in FIELDS and w}
+        self.cache_path = cache_path or os.path.join(FAISS_ROOT, FIELD_VECTORS_NAME)
+        self._vectors = load_value_vectors(self.cache_path)
+        self.update(docs)
+
+    def update(self, docs: List[Document]) -> None:
+        '''
+        Rebuilds the postings from the documents' current metadata. Only value strings
+        that have never been embedded are sent to the model.
+        '''
+        self.docs = list(docs)
+        self.fields = {}
+        for field in self.weights:
+            key = FIELDS[field]
+            values = sorted({v for d in self.docs for v in (d.metadata.get(key) or [])})
+            value_id = {v: i for i, v in enumerate(values)}
+            members = [[value_id[v] for v in dict.fromkeys(d.metadata.get(key) or [])] for d in self.docs]
+            has_values = np.array([bool(m) for m in members])
+            starts = np.concatenate([[0], np.cumsum([len(m) for m in members])[:-1]]).astype("int64")
+            self.fields[field] = {
+                "values": values,
+                "flat": np.array([i for m in members for i in m], dtype="int64"),
+                "has_values": has_values,
+                # Start of each non-empty postings run; strictly increasing, as reduceat needs
+                "starts": starts[has_values],
+            }
+
+        new_values = sorted({v for f in self.fields.values() for v in f["values"]} - set(self._vectors))
+        if new_values:
+            with tracing.span("field_index.embed", values=len(new_values)):
+                vectors = np.asarray(self.embedding.embed_documents(new_values), dtype="float32")
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            self._vectors.update(zip(new_values, vectors))
+            if self.persist:
+                save_value_vectors(self.cache_path, self._vectors)
+            print(f"Embedded {len(new_values)} new field value(s)")
+
+        for f in self.fields.values():
+            if f["values"]:
+                f["matrix"] = np.stack([self._vectors[v] for v in f["values"]])
+
+    def scores(self, query_vectors) -> np.ndarray:
+        '''(queries, documents) weighted sum of per-field best-value cosine similarities'''
+        q = np.asarray(query_vectors, dtype="float32")
+        q = q / np.maximum(np.linalg.norm(q, axis=1, keepdims=True), 1e-12)
+        total = np.zeros((len(q), len(self.docs)), dtype="float32")
+        for field, f in self.fields.items():
+            if not len(f["flat"]):
+                continue
+            similarities = q @ f["matrix"].T  # (queries, values)
+            best = np.maximum.reduceat(similarities[:, f["flat"]], f["starts"], axis=1)
+            total[:, f["has_values"]] += self.weights[field] * best
+        return total
+
+    def search(self, query_vectors, k: int, positions=None) -> List[List[tuple]]:
+        '''Top-k (Document, field score) pairs per query; questions without any field values never match'''
+        scores = self.scores(query_vectors)
+        candidates = np.arange(len(self.docs)) if positions is None else np.asarray(positions, dtype="int64")
+        results = []
+        for row in scores:
+            subset = row[candidates]
+            order = np.argsort(-subset, kind="stable")[:k]
+            results.append([(self.docs[candidates[i]], float(subset[i])) for i in order if subset[i] > 0])
+        return results
+
+
+def load_value_vectors(path) -> Dict[str, np.ndarray]:
+    '''Cached value embeddings, or {} if missing or produced by another embedding model'''
+    if not os.path.exists(path):
+        return {}
+    with np.load(path, allow_pickle=False) as cache:
+        if str(cache["model"]) != EMBEDDING_MODEL:
+            return {}
+        return dict(zip(cache["values"].tolist(), cache["vectors"]))
+
+
+def save_value_vectors(path, vectors: Dict[str, np.ndarray]) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    values = sorted(vectors)
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, model=np.array(EMBEDDING_MODEL), values=np.array(values), vectors=np.stack([vectors[v] for v in values]))
+    os.replace(tmp_path, path)
@@ -0,0 +1,228 @@
+import sys
+import faiss
+import numpy as np
+from pathlib import Path
+from typing import List, Optional
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from config.constants import (
+    FAISS_INDEX_TYPE,
+    HNSW_M,
+    HNSW_EF_CONSTRUCTION,
+    HNSW_EF_SEARCH,
+    IVF_NLIST,
+    IVF_NPROBE,
+    PQ_M,
+    PQ_NBITS,
+    INDEX_TRAIN_SAMPLE,
+)
+
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+
+# =================================================
+# INDEX CONSTRUCTION
+# =================================================
+
+def default_nlist(n_vectors: int) -> int:
+    '''
+    Picks an IVF list count of ~4*sqrt(n), capped so every list gets
+    at least 39 training points (FAISS warns below that)
+    '''
+    nlist = IVF_NLIST or int(4 * np.sqrt(max(n_vectors, 1)))
+    return max(1, min(nlist, n_vectors // 39))
+
+
+def min_train_size(index_type: str) -> int:
+    '''Smallest corpus that can train the given index type sensibly'''
+    if index_type == "ivf_pq":
+        return max(39, 2 ** PQ_NBITS)
+    if index_type == "ivf_flat":
+        return 39
+    return 0
+
+
+def resolve_index_type(index_type: Optional[str], n_vectors: int) -> str:
+    '''
+    Validates `index_type` and falls back to a flat index when the corpus
+    is too small to train the requested quantiser
+    '''
+    index_type = (index_type or FAISS_INDEX_TYPE).lower()
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown FAISS index type '{index_type}' (expected one of {INDEX_TYPES})")
+    if n_vectors < min_train_size(index_type):
+        print(f"Only {n_vectors} vectors — too few to train '{index_type}', using flat index")
+        return "flat"
+    return index_type
+
+
+def create_index(index_type: str, dim: int, n_vectors: int) -> faiss.Index:
+    '''Creates an empty (untrained) FAISS index of the given type, using L2 distance like LangChain's default'''
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dim)
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return index
+
+    nlist = default_nlist(n_vectors)
+    quantizer = faiss.IndexFlatL2(dim)
+    if index_type == "ivf_flat":
+        return faiss.IndexIVFFlat(quantizer, dim, nlist)
+    if index_type == "ivf_pq":
+        if dim % PQ_M:
+            raise ValueError(f"PQ_M={PQ_M} must divide the embedding dimension {dim}")
+        return faiss.IndexIVFPQ(quantizer, dim, nlist, PQ_M, PQ_NBITS)
+
+    raise ValueError(f"Unknown FAISS index type '{index_type}'")
+
+
+def train_index(index: faiss.Index, vectors: np.ndarray, sample_size: int = INDEX_TRAIN_SAMPLE) -> None:
+    '''Trains `index` on a random sample of `vectors` (no-op for index types that need no training)'''
+    if index.is_trained:
+        return
+    if len(vectors) > sample_size:
+        rng = np.random.default_rng(0)
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    print(f"Training FAISS index on {len(vectors)} vectors")
+    index.train(np.ascontiguousarray(vectors, dtype="float32"))
+
+
+def configure_search(index: faiss.Index) -> faiss.Index:
+    '''
+    Applies query-time parameters, which FAISS does not persist with the index.
+    Must be called after building and after every load.
+    '''
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    else:
+        try:
+            faiss.extract_index_ivf(index).nprobe = IVF_NPROBE
+        except RuntimeError:
+            pass  # not an IVF index
+    return index
+
+
+def search_params(index: faiss.Index, labels: np.ndarray) -> faiss.SearchParameters:
+    '''
+    Builds search parameters that restrict a search to the given labels, keeping the
+    index's query-time settings (per-call parameters override the index's own).
+    '''
+    selector = faiss.IDSelectorBatch(np.ascontiguousarray(labels, dtype="int64"))
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=HNSW_EF_SEARCH)
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=IVF_NPROBE)
+    return faiss.SearchParameters(sel=selector)
+
+
+def index_type_of(index: faiss.Index) -> str:
+    '''Returns the INDEX_TYPES name for an existing FAISS index'''
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def supports_removal(index: faiss.Index) -> bool:
+    '''
+    Only flat indexes compact their labels on `remove_ids`, which is what LangChain's
+    positional docstore mapping assumes. Other types are rebuilt instead.
+    '''
+    return isinstance(index, faiss.IndexFlat)
+
+
+def stored_vectors(vs: FAISS, ids: List[str]) -> np.ndarray:
+    '''
+    Reconstructs the stored vectors for `ids` (in that order) without re-embedding.
+    PQ indexes only hold approximations, so callers needing exact vectors should re-embed those.
+    '''
+    if isinstance(vs.index, faiss.IndexIVF):
+        vs.index.make_direct_map()
+    label_of = {qid: label for label, qid in vs.index_to_docstore_id.items()}
+    return np.vstack([vs.index.reconstruct(label_of[qid]) for qid in ids]).astype("float32")
+
+
+def index_memory_bytes(index: faiss.Index) -> int:
+    '''Size of the serialised index, a close proxy for its resident memory'''
+    return int(faiss.serialize_index(index).nbytes)
+
+
+# =================================================
+# VECTORSTORE HELPERS
+# =================================================
+
+def build_vectorstore(
+    texts: List[str],
+    metadatas: List[dict],
+    ids: List[str],
+    embedding,
+    index_type: Optional[str] = None,
+) -> FAISS:
+    '''
+    Embeds `texts` and builds a LangChain FAISS vectorstore backed by the configured index type.
+    Trainable indexes are trained on a sample of the corpus before vectors are added.
+    '''
+    from setup import encoding_scheduler
+
+    vectors = encoding_scheduler.embed_documents(embedding, texts)
+    return build_vectorstore_from_vectors(texts, vectors, metadatas, ids, embedding, index_type)
+
+
+def build_vectorstore_from_vectors(texts, vectors, metadatas, ids, embedding, index_type=None) -> FAISS:
+    '''Same as `build_vectorstore` for callers that already hold the embeddings'''
+    index_type = resolve_index_type(index_type, len(vectors))
+    index = create_index(index_type, vectors.shape[1], len(vectors))
+    train_index(index, vectors)
+    configure_search(index)
+
+    vs = FAISS(
+        embedding_function=embedding,
+        index=index,
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+    )
+    vs.add_embeddings(zip(texts, vectors.tolist()), metadatas=metadatas, ids=ids)
+    print(f"Built '{index_type}' FAISS index with {index.ntotal} vectors")
+    return vs
+
+
+def rebuild_without(vs: FAISS, ids: List[str]) -> FAISS:
+    '''
+    Rebuilds `vs` without the given IDs, reusing the stored vectors and the trained
+    quantiser instead of re-embedding or re-training.
+    Used for index types that cannot remove vectors in place (HNSW, IVF).
+    '''
+    drop = set(ids)
+    keep = [
+        (pos, qid) for pos, qid in sorted(vs.index_to_docstore_id.items())
+        if qid not in drop
+    ]
+
+    if isinstance(vs.index, faiss.IndexIVF):
+        vs.index.make_direct_map()
+
+    index = faiss.clone_index(vs.index)
+    index.reset()
+    configure_search(index)
+    if keep:
+        vectors = np.vstack([vs.index.reconstruct(pos) for pos, _ in keep])
+        index.add(np.ascontiguousarray(vectors, dtype="float32"))
+
+    docstore = InMemoryDocstore({qid: vs.docstore.search(qid) for _, qid in keep})
+    index_to_docstore_id = {i: qid for i, (_, qid) in enumerate(keep)}
+    print(f"Rebuilt '{index_type_of(index)}' FAISS index without {len(drop)} entries")
+    return FAISS(
+        embedding_function=vs.embedding_function,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+    )
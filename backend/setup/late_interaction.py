@@ -0,0 +1,224 @@
+'''
+Late-interaction (ColBERT-style) reranking on CPU.
+
+Token embeddings of every question are computed once at index time with the embedding
+model, L2-normalised and stored as float16 next to the FAISS index:
+
+    <FAISS_ROOT>/<TOKEN_INDEX_NAME>/
+        tokens.npy     float16 (total tokens, dim), all questions back to back
+        offsets.npy    int64 row offsets, question i owns rows [offsets[i], offsets[i + 1])
+        manifest.json  {"model", "ids", "entries": {question ID: text hash}}
+
+At query time only the query is encoded. The score of a candidate is MaxSim: for every
+query token, the best cosine similarity with any of the candidate's tokens, summed over
+query tokens. All candidates are scored with one matrix product plus `np.maximum.reduceat`,
+so the cost grows with the candidates' token count rather than with a transformer pass per
+(query, document) pair like the cross-encoder.
+'''
+from __future__ import annotations
+
+import os
+import sys
+import json
+import numpy as np
+from pathlib import Path
+from typing import TYPE_CHECKING, List
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from config.constants import FAISS_ROOT, TOKEN_INDEX_NAME, EMBEDDING_MODEL, COLBERT_TOP_K
+
+from doc_processing.helpers import text_hash
+from setup import encoding_scheduler, tracing
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+
+def encode_tokens(model, texts: List[str]) -> List[np.ndarray]:
+    '''
+    Normalised float32 token embeddings per text (padding removed), encoded in
+    length-bucketed batches
+    '''
+    if not texts:
+        return []
+    lengths = encoding_scheduler.token_lengths(model.tokenizer, texts, max_length=model.max_seq_length)
+    out = [None] * len(texts)
+    with tracing.span("late_interaction.encode", texts=len(texts)):
+        for batch in encoding_scheduler.plan_batches(lengths):
+            embeddings = model.encode(
+                [texts[i] for i in batch],
+                batch_size=len(batch),
+                output_value="token_embeddings",
+                convert_to_numpy=False,
+                show_progress_bar=False,
+            )
+            for i, tokens in zip(batch, embeddings):
+                tokens = tokens.float().cpu().numpy()
+                out[i] = tokens / np.maximum(np.linalg.norm(tokens, axis=1, keepdims=True), 1e-12)
+    return out
+
+
+class TokenIndex:
+    '''Float16 token embeddings of every question, memory-mapped for reading'''
+
+    def __init__(self, path, ids, tokens, offsets, entries, model=EMBEDDING_MODEL):
+        self.path = path
+        self.ids = ids
+        self.tokens = tokens
+        self.offsets = offsets
+        self.entries = entries
+        self.model = model
+        self.position = {qid: i for i, qid in enumerate(ids)}
+
+    @classmethod
+    def load(cls, path=None) -> "TokenIndex" | None:
+        path = path or default_path()
+        manifest_path = os.path.join(path, "manifest.json")
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        return cls(
+            path,
+            manifest["ids"],
+            np.load(os.path.join(path, "tokens.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, "offsets.npy"), mmap_mode="r"),
+            manifest["entries"],
+            manifest.get("model", EMBEDDING_MODEL),
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, qid):
+        return qid in self.position
+
+    def doc_tokens(self, qid) -> np.ndarray:
+        i = self.position[qid]
+        return self.tokens[self.offsets[i]:self.offsets[i + 1]]
+
+    def nbytes(self) -> int:
+        return int(self.tokens.nbytes + self.offsets.nbytes)
+
+
+def default_path() -> str:
+    return os.path.join(FAISS_ROOT, TOKEN_INDEX_NAME)
+
+
+def sync_token_index(docs: List[Document], model=None, path=None, read_only=False) -> TokenIndex:
+    '''
+    Brings the stored token index in line with `docs` (text-field documents, see
+    `retriever_setup.questions_to_docs(expand=False)`) by question ID and text hash:
+    unchanged questions keep their stored rows, new or edited ones are encoded.
+    Files are written under temporary names and swapped in, manifest last.
+    With `read_only=True` an index that is missing or out of date raises ValueError instead.
+    '''
+    path = path or default_path()
+    existing = TokenIndex.load(path)
+    if existing is not None and existing.model != EMBEDDING_MODEL:
+        print(f"Token index was built with {existing.model} — re-encoding")
+        existing = None
+
+    ids, texts, hashes = [], [], {}
+    for d in docs:
+        qid = d.metadata.get("id")
+        if qid in hashes:
+            continue
+        ids.append(qid)
+        texts.append(d.page_content)
+        hashes[qid] = text_hash(d.page_content)
+
+    if existing is not None and existing.ids == ids and existing.entries == hashes:
+        print("No token index changes found")
+        return existing
+    if read_only:
+        raise ValueError(f"Token index at {path} is missing or out of date; rebuild it before a read-only load")
+
+    stale = [
+        i for i, qid in enumerate(ids)
+        if existing is None or qid not in existing or existing.entries.get(qid) != hashes[qid]
+    ]
+    if stale:
+        if model is None:
+            from setup import retriever_setup
+
+            model = retriever_setup.load_embedding()._client
+        encoded = dict(zip(stale, encode_tokens(model, [texts[i] for i in stale])))
+    else:
+        encoded = {}
+
+    blocks = [
+        encoded[i].astype("float16") if i in encoded else np.asarray(existing.doc_tokens(qid))
+        for i, qid in enumerate(ids)
+    ]
+    lengths = np.array([len(b) for b in blocks], dtype="int64")
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype("int64")
+    tokens = np.concatenate(blocks).astype("float16") if blocks else np.zeros((0, 0), dtype="float16")
+
+    os.makedirs(path, exist_ok=True)
+    _save_npy(os.path.join(path, "tokens.npy"), tokens)
+    _save_npy(os.path.join(path, "offsets.npy"), offsets)
+    manifest_path = os.path.join(path, "manifest.json")
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"model": EMBEDDING_MODEL, "ids": ids, "entries": hashes}, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    print(f"Token index updated: {len(stale)} of {len(ids)} questions encoded, "
+          f"{len(tokens)} tokens ({tokens.nbytes / 2**20:.1f} MB float16)")
+    return TokenIndex.load(path)
+
+
+def _save_npy(path, array):
+    tmp_path = path + ".tmp.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+class LateInteractionReranker:
+    '''
+    Drop-in alternative to the cross-encoder returned by `retriever_setup.load_reranker`
+    when RERANK_METHOD = "late_interaction"
+    '''
+
+    def __init__(self, token_index: TokenIndex, model):
+        self.token_index = token_index
+        self.model = model
+
+    def encode_query(self, query: str) -> np.ndarray:
+        return encode_tokens(self.model, [query])[0]
+
+    def scores(self, query_tokens: np.ndarray, qs: List[Document]) -> np.ndarray:
+        '''MaxSim score of every candidate; candidates missing from the index are encoded on the fly'''
+        if not qs:
+            return np.zeros(0, dtype="float32")
+        blocks = []
+        missing = [d for d in qs if d.metadata.get("id") not in self.token_index]
+        extra = dict(zip((id(d) for d in missing), encode_tokens(self.model, [d.page_content for d in missing])))
+        for d in qs:
+            qid = d.metadata.get("id")
+            blocks.append(extra[id(d)] if id(d) in extra else self.token_index.doc_tokens(qid))
+
+        starts = np.concatenate([[0], np.cumsum([len(b) for b in blocks])[:-1]])
+        doc_matrix = np.concatenate(blocks).astype("float32")
+        similarities = query_tokens @ doc_matrix.T  # (query tokens, candidate tokens)
+        return np.maximum.reduceat(similarities, starts, axis=1).sum(axis=0)
+
+    def rerank(self, query: str, qs: List[Document], top_k: int = COLBERT_TOP_K) -> List[Document]:
+        from setup import retriever_setup
+
+        with tracing.span("rerank.late_interaction", candidates=len(qs)):
+            scores = self.scores(self.encode_query(query), qs)
+        return retriever_setup.top_k_by_score(scores.tolist(), qs, top_k)
+
+    def rerank_batch(self, queries, candidate_lists, top_k: int = COLBERT_TOP_K) -> List[List[Document]]:
+        '''Encodes all queries in one pass, then scores each candidate list'''
+        from setup import retriever_setup
+
+        queries = list(queries)
+        with tracing.span("rerank.late_interaction", queries=len(queries)):
+            encoded = encode_tokens(self.model, queries)
+            return [
+                retriever_setup.top_k_by_score(self.scores(q_tokens, qs).tolist(), qs, top_k)
+                for q_tokens, qs in zip(encoded, candidate_lists)
+            ]
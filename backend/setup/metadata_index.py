@@ -0,0 +1,131 @@
+import re
+import numpy as np
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+FILTER_FIELDS = ("year", "exam", "difficulty", "tag")
+
+YEAR_RE = re.compile(r"\b((?:19|20)\d{2})\b")
+
+
+def field_values(metadata: dict) -> Dict[str, set]:
+    '''
+    Extracts the filterable values of one question's metadata (all lowercased strings):
+        - year: four-digit year parsed from the exam filename
+        - exam: the exam filename
+        - difficulty: LLM difficulty label
+        - tag: every full "<topic> / <subtopic>" tag plus its topic on its own
+    '''
+    values = defaultdict(set)
+
+    exam = str(metadata.get("exam") or "")
+    if exam:
+        values["exam"].add(exam.lower())
+        match = YEAR_RE.search(exam)
+        if match:
+            values["year"].add(match.group(1))
+
+    if metadata.get("difficulty"):
+        values["difficulty"].add(str(metadata["difficulty"]).lower())
+
+    for tag in metadata.get("tags") or []:
+        values["tag"].add(tag.lower())
+        values["tag"].add(tag.split(" / ")[0].lower())
+
+    return values
+
+
+class MetadataIndex:
+    '''
+    Precomputed per-field bitmaps over a fixed document order (the order the
+    BM25 index was built in), used to restrict retrieval before scoring.
+
+    `faiss_labels[i]` is the FAISS label of document i, so a mask can be turned
+    into an ID selector for the dense index without another lookup.
+    '''
+
+    def __init__(self, docs, faiss_label_of: Optional[Dict[str, int]] = None):
+        self.ids = [d.metadata.get("id") for d in docs]
+        n = len(self.ids)
+
+        self.bitmaps: Dict[str, Dict[str, np.ndarray]] = {f: {} for f in FILTER_FIELDS}
+        for i, d in enumerate(docs):
+            for field, values in field_values(d.metadata).items():
+                for value in values:
+                    bitmap = self.bitmaps[field].get(value)
+                    if bitmap is None:
+                        bitmap = self.bitmaps[field][value] = np.zeros(n, dtype=bool)
+                    bitmap[i] = True
+
+        faiss_label_of = faiss_label_of or {}
+        self.faiss_labels = np.array([faiss_label_of.get(qid, -1) for qid in self.ids], dtype="int64")
+
+    @classmethod
+    def from_postings(cls, ids: List[str], postings: Dict[str, Dict[str, List[int]]], faiss_labels=None):
+        '''
+        Rebuilds an index from `postings()` output (field -> value -> document positions),
+        e.g. as stored in a corpus bundle, without re-reading any document metadata
+        '''
+        index = cls.__new__(cls)
+        index.ids = list(ids)
+        n = len(index.ids)
+        index.bitmaps = {f: {} for f in FILTER_FIELDS}
+        for field, by_value in postings.items():
+            for value, positions in by_value.items():
+                bitmap = np.zeros(n, dtype=bool)
+                bitmap[np.asarray(positions, dtype="int64")] = True
+                index.bitmaps[field][value] = bitmap
+        if faiss_labels is None:
+            faiss_labels = np.arange(n, dtype="int64")
+        index.faiss_labels = np.asarray(faiss_labels, dtype="int64")
+        return index
+
+    def postings(self) -> Dict[str, Dict[str, List[int]]]:
+        '''Serialisable form of the bitmaps: field -> value -> document positions'''
+        return {
+            field: {value: np.flatnonzero(bitmap).tolist() for value, bitmap in by_value.items()}
+            for field, by_value in self.bitmaps.items()
+        }
+
+    def __len__(self):
+        return len(self.ids)
+
+    def mask(self, filters: Optional[dict]) -> Optional[np.ndarray]:
+        '''
+        Returns a boolean mask of documents matching every filter field
+        (values within one field are OR-ed), or None when there are no filters.
+
+        Example: {"year": [2022, 2023], "difficulty": "advanced", "tag": "Calculus"}
+        '''
+        if not filters:
+            return None
+        mask = np.ones(len(self), dtype=bool)
+        for field, wanted in filters.items():
+            if field not in self.bitmaps:
+                raise ValueError(f"Unknown filter field '{field}' (expected one of {FILTER_FIELDS})")
+            field_mask = np.zeros(len(self), dtype=bool)
+            for value in _as_list(wanted):
+                bitmap = self.bitmaps[field].get(str(value).lower())
+                if bitmap is not None:
+                    field_mask |= bitmap
+            mask &= field_mask
+        return mask
+
+    def positions(self, mask: np.ndarray) -> np.ndarray:
+        '''Document positions (BM25 order) selected by `mask`'''
+        return np.flatnonzero(mask)
+
+    def labels(self, mask: np.ndarray) -> np.ndarray:
+        '''FAISS labels selected by `mask` (documents missing from FAISS are dropped)'''
+        labels = self.faiss_labels[mask]
+        return labels[labels >= 0]
+
+    def values(self, field: str) -> List[str]:
+        '''Known values for a filter field, e.g. every year in the corpus'''
+        return sorted(self.bitmaps.get(field, {}))
+
+
+def _as_list(value) -> Iterable:
+    if isinstance(value, (list, tuple, set)):
+        return value
+    return [value]
@@ -1,8 +1,16 @@
+from __future__ import annotations
+
 import os
 import sys
-import torch
+import json
+import time
+import hashlib
+import threading
+import numpy as np
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Iterable, List
+from typing import TYPE_CHECKING, Iterable, List
 
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
@@ -11,19 +19,37 @@ from config.constants import (
     FAISS_TOP_K, 
     FAISS_ROOT, 
     FAISS_NAME, 
+    FAISS_MANIFEST,
     EMBEDDING_MODEL, 
-    COLBERT_TOP_K
+    COLBERT_TOP_K,
+    RERANK_BATCH_SIZE,
+    RERANK_METHOD,
+    RERANK_CASCADE,
+    CASCADE_RECALL_BIAS,
+    CASCADE_CHUNK_SIZE,
+    FUSION_METHOD,
+    RRF_C,
+    FIELD_LEG_WEIGHT,
+    RETRIEVAL_LEG_WORKERS,
 )
 
-from doc_processing.helpers import flatten, docs_to_texts_and_meta
+from doc_processing.helpers import flatten, docs_to_texts_and_meta, content_hash, text_hash
+from doc_processing.process_questions import assign_question_ids
+from setup import encoding_scheduler, late_interaction, tracing
+from setup.metadata_index import MetadataIndex
 
-from langchain_community.retrievers import BM25Retriever
-from langchain_community.vectorstores import FAISS
-from langchain_classic.retrievers import EnsembleRetriever
-from langchain_huggingface import HuggingFaceEmbeddings
-from sentence_transformers import CrossEncoder
-from langchain_core.documents import Document
+# Heavy dependencies (torch, sentence-transformers, LangChain, FAISS) are imported
+# inside the functions that need them, so importing this module stays cheap and
+# lazy startup only pays for them when the first query arrives.
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.documents import Document
 
+_corpus_version = None
+_rerank_counts = {}  # mode -> {"queries": int, "pairs": int}
+_leg_workers = RETRIEVAL_LEG_WORKERS
+_leg_executor = None
+_leg_lock = threading.Lock()
 
 
 # =================================================
@@ -31,33 +57,67 @@ from langchain_core.documents import Document
 # =================================================
 
 def setup_bm25_retriever(docs: List[Document]):
+    from langchain_community.retrievers import BM25Retriever
+
     retriever = BM25Retriever.from_documents(docs)
     retriever.k = BM25_TOP_K
     print("BM25 retriever created")
     return retriever
 
 
-def setup_faiss_retriever(docs: List[Document]):
-    '''Creates a FAISS dense retriever, loading or updating a persisted index as needed'''
+@lru_cache(maxsize=1)
+def load_embedding():
+    '''Loads the sentence-transformers embedding model (once per process)'''
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    with tracing.span("load_embedding"):
+        return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+
+
+def setup_faiss_retriever(docs: List[Document], read_only=False) -> FAISS:
+    '''Creates the FAISS dense vectorstore, loading or updating a persisted index as needed'''
     if not docs:
         raise ValueError("No documents provided for FAISS indexing")
 
-    embedding = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
-    vs = load_or_update_faiss(docs, embedding)
+    embedding = load_embedding()
+    vs = load_or_update_faiss(docs, embedding, read_only=read_only)
 
     print("FAISS retriever created")
-    return vs.as_retriever(search_kwargs={"k": FAISS_TOP_K})
+    return vs
 
 
-def load_or_update_faiss(docs: List[Document], embedding) -> FAISS:
+def load_or_update_faiss(docs: List[Document], embedding, index_type: str | None = None, read_only=False) -> FAISS:
     '''
-    Loads an existing FAISS index and appends any new documents, or creates one from scratch.
-    Rebuilds the index if tag-enriched content is detected in new docs but not the saved index.
+    Loads an existing FAISS index and syncs it with `docs` by question ID, or creates one from scratch.
+
+    `docs` are text-field documents (see `questions_to_docs(expand=False)`). The ID manifest
+    (question ID -> text hash) saved next to the index is used to find stale and new entries,
+    so only questions whose text changed are deleted and re-embedded; metadata-only changes
+    such as re-tagging just refresh the stored Documents.
+    Indexes saved without a text-hash manifest, or with a different index type, are rebuilt.
+
+    With `read_only=True` nothing is embedded or written: the index is loaded as saved, and
+    a ValueError is raised if it is missing or out of date with `docs`. Metadata changes are
+    still applied to the loaded Documents, in memory only.
     '''
-    index_path = os.path.join(FAISS_ROOT, FAISS_NAME)
-    texts, metadatas = docs_to_texts_and_meta(docs)
+    from langchain_community.vectorstores import FAISS
+    from setup import index_factory
 
-    if os.path.exists(index_path):
+    index_path = os.path.join(FAISS_ROOT, FAISS_NAME)
+    docs_by_id = index_docs_by_id(docs)
+    hashes = {qid: text_hash(d.page_content) for qid, d in docs_by_id.items()}
+    index_type = index_factory.resolve_index_type(index_type, len(docs_by_id))
+    # The served version covers metadata too, so re-tagging still invalidates cached results
+    set_corpus_version(index_type, {qid: content_hash(d) for qid, d in docs_by_id.items()})
+    manifest = load_manifest(index_path)
+
+    if os.path.exists(index_path) and manifest is None:
+        print("FAISS index has no ID manifest — rebuilding")
+    elif os.path.exists(index_path) and manifest.get("hash") != "text":
+        print("FAISS index was keyed on expanded content — rebuilding on question text")
+    elif os.path.exists(index_path) and manifest["index_type"] != index_type:
+        print(f"FAISS index type changed ({manifest['index_type']} -> {index_type}) — rebuilding")
+    elif os.path.exists(index_path):
         print(f"Loading FAISS index from {index_path}")
         try:
             vs = FAISS.load_local(
@@ -68,40 +128,175 @@ def load_or_update_faiss(docs: List[Document], embedding) -> FAISS:
         except Exception as e:
             print(f"FAISS index unreadable ({e}) — rebuilding")
         else:
-            existing = {d.page_content for d in vs.docstore._dict.values()}
-
-            # Detect format mismatch: new docs have tag enrichment but the saved
-            # index was built before tags existed. Rebuild to avoid duplicates.
-            new_have_tags = any("Topics:" in d.page_content for d in docs)
-            old_have_tags = any("Topics:" in c for c in existing)
-            if new_have_tags and not old_have_tags:
-                print("Tag-enriched content detected — rebuilding FAISS index")
-                # Fall through to rebuild; save_local overwrites files in-place
-            else:
-                new_docs = [d for d in docs if d.page_content not in existing]
-                if new_docs:
-                    print(f"Appending {len(new_docs)} new items to FAISS index")
-                    new_texts, new_metas = docs_to_texts_and_meta(new_docs)
-                    vs.add_texts(new_texts, metadatas=new_metas)
-                    vs.save_local(index_path)
-                else:
-                    print("No new FAISS entries found")
+            index_factory.configure_search(vs.index)
+            entries = manifest["entries"]
+            stale_ids = [qid for qid, h in entries.items() if hashes.get(qid) != h]
+            new_ids = [qid for qid, h in hashes.items() if entries.get(qid) != h]
+
+            refreshed = refresh_docstore(vs, [d for qid, d in docs_by_id.items() if qid not in new_ids])
+
+            if not stale_ids and not new_ids and not refreshed:
+                print("No FAISS changes found")
                 return vs
+            if read_only and (stale_ids or new_ids):
+                raise ValueError(f"FAISS index at {index_path} is out of date ({len(stale_ids)} stale, "
+                                 f"{len(new_ids)} new questions); rebuild it before a read-only load")
+            if read_only:
+                return vs
+
+            vs = delete_from_faiss(vs, stale_ids, entries)
+            vs = upsert_into_faiss(vs, [docs_by_id[qid] for qid in new_ids], entries)
+            vs.save_local(index_path)
+            save_manifest(index_path, index_type, entries)
+            return vs
 
+    if read_only:
+        raise ValueError(f"No usable FAISS index at {index_path}; rebuild it before a read-only load")
     print(f"Creating new FAISS index at {index_path}")
     os.makedirs(FAISS_ROOT, exist_ok=True)
-    vs = FAISS.from_texts(texts, embedding, metadatas=metadatas)
+    texts, metadatas = docs_to_texts_and_meta(list(docs_by_id.values()))
+    vs = index_factory.build_vectorstore(texts, metadatas, list(docs_by_id), embedding, index_type)
     vs.save_local(index_path)
+    save_manifest(index_path, index_type, hashes)
+    return vs
+
+
+def index_docs_by_id(docs: List[Document]) -> dict:
+    '''Maps question ID -> Document, keeping the first Document seen for duplicated IDs'''
+    docs_by_id = {}
+    for d in docs:
+        qid = d.metadata.get("id")
+        if not qid:
+            raise ValueError(f"Document is missing a question 'id': {d.metadata}")
+        if qid in docs_by_id:
+            print(f"Warning: duplicate question ID '{qid}' — keeping first occurrence")
+            continue
+        docs_by_id[qid] = d
+    return docs_by_id
+
+
+def upsert_into_faiss(vs: FAISS, docs: List[Document], entries: dict) -> FAISS:
+    '''
+    Replaces (or inserts) the vectors for `docs`, keyed by their question IDs.
+    Updates the manifest `entries` in place and returns the (possibly rebuilt) vectorstore.
+    '''
+    if not docs:
+        return vs
+    ids = [d.metadata["id"] for d in docs]
+    vs = delete_from_faiss(vs, ids, entries)
+    texts, metadatas = docs_to_texts_and_meta(docs)
+    vectors = encoding_scheduler.embed_documents(vs.embedding_function, texts)
+    vs.add_embeddings(zip(texts, vectors.tolist()), metadatas=metadatas, ids=ids)
+    for d in docs:
+        entries[d.metadata["id"]] = text_hash(d.page_content)
+    print(f"Upserted {len(docs)} FAISS entries")
+    return vs
+
+
+def refresh_docstore(vs: FAISS, docs: List[Document]) -> int:
+    '''
+    Replaces stored Documents whose metadata changed (e.g. new LLM tags) without touching
+    their vectors. Returns the number of Documents replaced.
+    '''
+    changed = []
+    for d in docs:
+        stored = vs.docstore.search(d.metadata["id"])
+        if not isinstance(stored, str) and stored.metadata != d.metadata:
+            changed.append(d)
+    if changed:
+        vs.docstore.delete([d.metadata["id"] for d in changed])
+        vs.docstore.add({d.metadata["id"]: d for d in changed})
+        print(f"Refreshed metadata of {len(changed)} FAISS entries")
+    return len(changed)
+
+
+def delete_from_faiss(vs: FAISS, ids: Iterable[str], entries: dict) -> FAISS:
+    '''
+    Removes the vectors for `ids` (e.g. questions from a withdrawn exam).
+    IDs that are not in the index are ignored. Index types that cannot remove
+    in place are rebuilt from their stored vectors. Updates `entries` in place.
+    '''
+    from setup import index_factory
+
+    ids = list(ids)
+    stored = set(vs.index_to_docstore_id.values())
+    present = [qid for qid in ids if qid in stored]
+    if present and index_factory.supports_removal(vs.index):
+        vs.delete(present)
+    elif present:
+        vs = index_factory.rebuild_without(vs, present)
+    if present:
+        print(f"Deleted {len(present)} FAISS entries")
+    for qid in ids:
+        entries.pop(qid, None)
     return vs
 
 
+def load_manifest(index_path: str) -> dict | None:
+    '''
+    Loads the manifest stored with the index, or None if absent.
+    Format: {"index_type": str, "hash": "text", "entries": {question ID: text hash}}
+    '''
+    path = os.path.join(index_path, FAISS_MANIFEST)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"FAISS manifest unreadable ({e})")
+        return None
+    if not isinstance(manifest.get("entries"), dict):
+        return None
+    manifest.setdefault("index_type", "flat")
+    return manifest
+
+
+def save_manifest(index_path: str, index_type: str, entries: dict) -> None:
+    '''Writes the manifest atomically so a crash never leaves it out of sync with a half-written file'''
+    path = os.path.join(index_path, FAISS_MANIFEST)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"index_type": index_type, "hash": "text", "entries": entries}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def set_corpus_version(index_type: str, entries: dict) -> str:
+    '''
+    Stamps the corpus/index version served by this process: a digest of the index type
+    and every question's content hash. Caches keyed on retrieval results compare against it.
+    '''
+    global _corpus_version
+    payload = json.dumps({"index_type": index_type, "entries": entries}, sort_keys=True)
+    _corpus_version = hashlib.sha1(payload.encode("utf-8")).hexdigest()
+    return _corpus_version
+
+
+def use_corpus_version(version: str) -> str:
+    '''Adopts a precomputed version stamp, e.g. the one recorded in a corpus bundle'''
+    global _corpus_version
+    _corpus_version = version
+    return _corpus_version
+
+
+def corpus_version() -> str | None:
+    '''Returns the version stamp of the loaded corpus, or None if no index has been loaded'''
+    return _corpus_version
+
+
+def embed_query(retriever, query: str):
+    '''Embeds `query` with the dense retriever's embedding model'''
+    return retriever.embedding.embed_query(query)
+
+
 def expand_content(question: dict) -> str:
-    '''Build the text stored in page_content for retrieval.
+    '''Build the text stored in page_content for BM25 and reranking.
 
-    Tags, difficulty, and skill types are appended so both BM25 and FAISS
-    can match against them directly, e.g. a query for 'integration' will
-    surface questions tagged 'Calculus / Integration' even when the raw
-    question text uses different wording.
+    Tags, difficulty, and skill types are appended so BM25 can match against
+    them directly, e.g. a query for 'integration' will surface questions
+    tagged 'Calculus / Integration' even when the raw question text uses
+    different wording. FAISS embeds the question text alone; tags reach the
+    dense side through the field index instead (see `field_index`).
     '''
     parts = [question.get("text", "")]
     if question.get("tags"):
@@ -113,63 +308,551 @@ def expand_content(question: dict) -> str:
     return "\n".join(p for p in parts if p)
 
 
-def create_ensemble_retriever(nested_questions, weights=[0.4, 0.6]):
+def create_ensemble_retriever(nested_questions, weights=(0.4, 0.6), fusion=FUSION_METHOD, read_only=False):
     '''
-    Builds a BM25 + FAISS ensemble retriever from the nested questions structure.
+    Builds a BM25 + FAISS + field-index fusion retriever from the nested questions structure.
     Returns None if no questions are found after flattening.
-    '''
 
-    flat_questions = flatten(nested_questions)
+    With `read_only=True` the persisted indexes are used exactly as saved and never
+    rewritten; a ValueError is raised if any of them is out of date (see `load_or_update_faiss`).
+
+    BM25 indexes the expanded content, FAISS (and the late-interaction token index) the
+    question text only, and the field index the tags and skills. Re-tagging therefore
+    re-embeds nothing but any new tag names.
+    '''
+    from setup.field_index import FieldIndex
 
-    if not flat_questions:
+    docs = questions_to_docs(nested_questions)
+    if not docs:
         print("No questions found")
         return None
+    text_docs = questions_to_docs(nested_questions, expand=False)
+
+    # Create fusion retriever
+    bm25 = setup_bm25_retriever(docs)
+    vs = setup_faiss_retriever(text_docs, read_only=read_only)
+    if RERANK_METHOD == "late_interaction":
+        late_interaction.sync_token_index(text_docs, read_only=read_only)
+    field_index = FieldIndex(bm25.docs, load_embedding(), persist=not read_only)
+    retriever = FusionRetriever(bm25, vs, weights=weights, fusion=fusion, field_index=field_index)
+
+    return retriever
+
+
+def questions_to_docs(nested_questions, expand=True) -> List[Document]:
+    '''
+    Flattens the nested questions into Documents with stable IDs. page_content is the
+    expanded content (`expand_content`), or with expand=False the question text only.
+    '''
+    from langchain_core.documents import Document
 
-    docs = [
+    # Stable IDs become FAISS docstore keys, so make sure every question has one
+    assign_question_ids({"questions": nested_questions})
+    return [
         Document(
-            page_content= expand_content(q),
+            page_content= expand_content(q) if expand else q.get("text", ""),
             metadata={k: v for k, v in q.items() if k != "text"},
         )
-        for q in flat_questions
+        for q in flatten(nested_questions)
     ]
 
-    # Create ensemble retriever
-    bm25 = setup_bm25_retriever(docs)
-    faiss = setup_faiss_retriever(docs)
-    retriever = EnsembleRetriever(retrievers=[bm25, faiss], weights=weights)
 
-    return retriever
+def load_persisted_retriever():
+    '''
+    Builds the retriever from persisted artifacts only: the questions pickle and the
+    saved FAISS index. No PDF sync and no LLM tagging, so nothing is re-embedded
+    unless the pickle changed since the index was saved.
+    '''
+    from doc_processing.process_questions import load_questions
+
+    data = load_questions()
+    return create_ensemble_retriever(data.get("questions", []))
+
+
+class LazyRetriever:
+    '''
+    Stand-in for `FusionRetriever` that loads the corpus, indexes and models on first use.
+
+    Any retriever attribute (invoke, invoke_batch, embedding, ...) blocks until loading
+    has finished. `warm_up()` starts loading on a background thread so it overlaps with
+    the user typing their first query.
+    '''
+
+    def __init__(self, loader=load_persisted_retriever, preload_reranker=True):
+        self._loader = loader
+        self._preload_reranker = preload_reranker
+        self._retriever = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._retriever is not None
+
+    def load(self):
+        '''Loads the retriever (once) and returns it; None if there are no questions'''
+        with self._lock:
+            if self._retriever is None:
+                with tracing.span("lazy_load"):
+                    self._retriever = self._loader()
+                    if self._retriever is not None and self._preload_reranker:
+                        load_reranker()
+        return self._retriever
+
+    def warm_up(self) -> threading.Thread:
+        '''Starts loading in the background and returns the thread'''
+        thread = threading.Thread(target=self._warm, name="warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def _warm(self):
+        try:
+            self.load()
+        except Exception as e:
+            print(f"Background warm-up failed ({e}); retrying on first query")
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        retriever = self.load()
+        if retriever is None:
+            raise AttributeError(f"Retriever has no questions loaded ('{name}' unavailable)")
+        return getattr(retriever, name)
+
+
+# =================================================
+# FUSION RETRIEVER
+# =================================================
+
+class FusionRetriever:
+    '''
+    Sparse (BM25) + dense (FAISS) retriever that runs both legs concurrently on a
+    thread pool and fuses their rankings by question ID. With a `FieldIndex`, the dense
+    leg also ranks questions by their tags and skills, fused as a third ranking with
+    weight `field_weight`.
+
+    fusion="rrf":   weighted reciprocal rank fusion, sum(w / (rank + c)). Without the
+                    field ranking (`field_index=None` or `field_weight=0`) this gives the
+                    same ranking as LangChain's EnsembleRetriever with the same weights;
+                    by default FIELD_LEG_WEIGHT adds the field ranking as a third input.
+    fusion="score": weighted sum of per-leg min-max normalised scores.
+
+    Returned Documents always carry the BM25 (expanded) content, whichever leg found them.
+
+    Each returned Document is a copy whose metadata["retrieval"] holds the per-leg
+    ranks and scores, the fused score and the leg timings for that query.
+    '''
+
+    def __init__(self, bm25, vectorstore, weights=(0.4, 0.6), fusion=FUSION_METHOD, rrf_c=RRF_C, faiss_k=FAISS_TOP_K,
+                 field_index=None, field_weight=FIELD_LEG_WEIGHT):
+        self.bm25 = bm25
+        self.vectorstore = vectorstore
+        faiss_label_of = {qid: label for label, qid in vectorstore.index_to_docstore_id.items()}
+        self._init_fusion(MetadataIndex(bm25.docs, faiss_label_of), weights, fusion, rrf_c, faiss_k,
+                          field_index, field_weight, documents=bm25.docs)
+
+    def _init_fusion(self, metadata_index, weights, fusion, rrf_c, faiss_k, field_index=None, field_weight=0.0,
+                     documents=None):
+        '''Shared setup for retrievers that supply their own sparse and dense legs'''
+        if fusion not in ("rrf", "score"):
+            raise ValueError(f"Unknown fusion method '{fusion}' (expected 'rrf' or 'score')")
+        self.weights = tuple(weights)
+        self.fusion = fusion
+        self.rrf_c = rrf_c
+        self.faiss_k = faiss_k
+        self.field_index = field_index
+        self.field_weight = field_weight
+        self.last_timings = {}
+        self.metadata_index = metadata_index
+        self._documents = {d.metadata.get("id"): d for d in documents or []}
+
+    def after_fork(self):
+        '''Drops the leg thread pool in a forked child (the parent's threads do not exist there)'''
+        global _leg_executor, _leg_lock
+        _leg_executor = None
+        _leg_lock = threading.Lock()
+
+    @property
+    def embedding(self):
+        return self.vectorstore.embedding_function
+
+    def invoke(self, query: str, filters: dict | None = None, query_vector=None) -> List[Document]:
+        '''Retrieves fused candidates for one query (see `invoke_batch`)'''
+        query_vectors = None if query_vector is None else [query_vector]
+        return self.invoke_batch([query], filters=filters, query_vectors=query_vectors)[0]
+
+    get_relevant_documents = invoke
+
+    def invoke_batch(self, queries: List[str], filters: dict | None = None, query_vectors=None) -> List[List[Document]]:
+        '''
+        Retrieves fused candidates for many queries. The BM25 leg scores every query
+        while the dense leg embeds all queries in one batch and searches FAISS once;
+        the two legs run concurrently, so latency is max(leg) rather than the sum.
+
+        `filters` (see `MetadataIndex.mask`) restrict both legs to eligible questions
+        before any scoring happens. `query_vectors`, if the caller has already embedded the
+        queries (e.g. for a semantic cache lookup), are used instead of embedding them again.
+        '''
+        queries = list(queries)
+        with tracing.span("retrieve", queries=len(queries), filtered=bool(filters)) as trace:
+            positions = labels = None
+            if filters:
+                with tracing.span("filter.mask") as mask_trace:
+                    mask = self.metadata_index.mask(filters)
+                    positions = self.metadata_index.positions(mask)
+                    labels = self.metadata_index.labels(mask)
+                    mask_trace.set(eligible=len(positions))
+                print(f"Filters {filters} matched {len(positions)} question(s)")
+
+            start = time.perf_counter()
+            executor = leg_executor()
+            bm25_future = executor.submit(_timed, self._sparse_leg, queries, positions)
+            faiss_future = executor.submit(_timed, self._dense_leg, queries, labels, positions, query_vectors)
+            bm25_lists, bm25_ms = bm25_future.result()
+            (faiss_lists, field_lists), faiss_ms = faiss_future.result()
+            total_ms = (time.perf_counter() - start) * 1000
+
+            timings = {"bm25_ms": round(bm25_ms, 3), "faiss_ms": round(faiss_ms, 3), "total_ms": round(total_ms, 3)}
+            self.last_timings = timings
+            with tracing.span("fuse", method=self.fusion):
+                results = [self.fuse(b, f, timings, fl) for b, f, fl in zip(bm25_lists, faiss_lists, field_lists)]
+            trace.set(candidates=sum(len(r) for r in results))
+            return results
+
+    def _sparse_leg(self, queries, positions=None):
+        with tracing.span("bm25", queries=len(queries)) as trace:
+            hits = [bm25_search(self.bm25, q, self.bm25.k, positions) for q in queries]
+            trace.set(candidates=sum(len(h) for h in hits))
+            return hits
+
+    def _embed_queries(self, queries, vectors=None):
+        if vectors is not None:
+            return vectors
+        with tracing.span("faiss.embed", queries=len(queries)):
+            return self.embedding.embed_documents(queries)
+
+    def _dense_leg(self, queries, labels=None, positions=None, vectors=None):
+        '''Returns (FAISS hits, field hits) per query; both rank against one batch of query vectors'''
+        if labels is not None and len(labels) == 0:
+            return [[] for _ in queries], [[] for _ in queries]
+        vectors = self._embed_queries(queries, vectors)
+        with tracing.span("faiss.search", k=self.faiss_k) as trace:
+            hits = faiss_search_batch(self.vectorstore, vectors, self.faiss_k, labels=labels)
+            trace.set(candidates=sum(len(h) for h in hits))
+        return hits, self._field_leg(vectors, positions)
+
+    def _field_leg(self, vectors, positions=None):
+        if self.field_index is None or not self.field_weight:
+            return [[] for _ in vectors]
+        with tracing.span("fields.search", k=self.faiss_k) as trace:
+            hits = self.field_index.search(vectors, self.faiss_k, positions)
+            trace.set(candidates=sum(len(h) for h in hits))
+            return hits
+
+    def fuse(self, bm25_hits, faiss_hits, timings=None, field_hits=None) -> List[Document]:
+        '''
+        Fuses the (Document, score) rankings by question ID. BM25 and field scores are
+        higher-is-better, FAISS scores are L2 distances (lower-is-better).
+        Ties keep first-seen order (BM25 hits first), as EnsembleRetriever does.
+        '''
+        from langchain_core.documents import Document
+
+        legs = [("bm25", bm25_hits, False, self.weights[0]), ("faiss", faiss_hits, True, self.weights[1])]
+        if field_hits:
+            legs.append(("fields", field_hits, False, self.field_weight))
+        docs, details, fused = {}, {}, {}
+
+        for name, hits, lower_is_better, weight in legs:
+            normalised = _min_max([s for _, s in hits], invert=lower_is_better)
+            for rank, ((doc, score), norm) in enumerate(zip(hits, normalised), start=1):
+                qid = doc.metadata.get("id") or doc.page_content
+                docs.setdefault(qid, self._documents.get(qid, doc))
+                details.setdefault(qid, {})
+                if f"{name}_rank" in details[qid]:
+                    continue
+                details[qid][f"{name}_rank"] = rank
+                details[qid][f"{name}_score"] = float(score)
+                if self.fusion == "rrf":
+                    fused[qid] = fused.get(qid, 0.0) + weight / (rank + self.rrf_c)
+                else:
+                    fused[qid] = fused.get(qid, 0.0) + weight * norm
+
+        ranked = sorted(docs, key=lambda qid: fused[qid], reverse=True)
+        return [
+            Document(
+                page_content=docs[qid].page_content,
+                metadata={
+                    **docs[qid].metadata,
+                    "retrieval": {**details[qid], "fused_score": fused[qid], "timings": timings or {}},
+                },
+            )
+            for qid in ranked
+        ]
+
+
+def bm25_search(bm25, query: str, k: int, positions=None) -> List[tuple]:
+    '''
+    Returns the top-k (Document, score) pairs for `query`. Without `positions` this
+    matches BM25Retriever's own ranking; with them, only the documents at those
+    positions (BM25 document order) are scored, so cost tracks the eligible set.
+    '''
+    tokens = bm25.preprocess_func(query)
+    if positions is None:
+        scores = np.asarray(bm25.vectorizer.get_scores(tokens))
+        order = np.argsort(scores)[::-1][:k]
+        return [(bm25.docs[i], scores[i]) for i in order]
+
+    if len(positions) == 0:
+        return []
+    scores = np.asarray(bm25.vectorizer.get_batch_scores(tokens, positions.tolist()))
+    order = np.argsort(-scores, kind="stable")[:k]
+    return [(bm25.docs[positions[i]], scores[i]) for i in order]
+
+
+def faiss_search_batch(vs: FAISS, vectors, k: int, labels=None) -> List[List[tuple]]:
+    '''
+    Searches the FAISS index for every query vector in one call and returns
+    (Document, L2 distance) pairs per query, like `similarity_search_with_score_by_vector`.
+    If `labels` is given, only those FAISS labels are searched (ID selector).
+    '''
+    x = np.asarray(vectors, dtype="float32")
+    if getattr(vs, "_normalize_L2", False):
+        x = x / np.linalg.norm(x, axis=1, keepdims=True)
+    x = np.ascontiguousarray(x)
+
+    if labels is None:
+        distances, indices = vs.index.search(x, k)
+    else:
+        from setup import index_factory
+
+        params = index_factory.search_params(vs.index, labels)
+        distances, indices = vs.index.search(x, min(k, len(labels)), params=params)
+
+    results = []
+    for dist_row, idx_row in zip(distances, indices):
+        results.append([
+            (vs.docstore.search(vs.index_to_docstore_id[i]), float(d))
+            for d, i in zip(dist_row, idx_row)
+            if i != -1
+        ])
+    return results
+
+
+def _min_max(scores, invert=False):
+    '''Min-max normalises scores to [0, 1]; `invert` for distances'''
+    if not scores:
+        return []
+    lo, hi = min(scores), max(scores)
+    if hi == lo:
+        return [1.0] * len(scores)
+    norm = [(s - lo) / (hi - lo) for s in scores]
+    return [1.0 - n for n in norm] if invert else norm
+
+
+def leg_executor() -> ThreadPoolExecutor:
+    '''The thread pool every retriever in this process runs its retrieval legs on'''
+    global _leg_executor
+    with _leg_lock:
+        if _leg_executor is None:
+            _leg_executor = ThreadPoolExecutor(max_workers=_leg_workers, thread_name_prefix="retrieval-leg")
+        return _leg_executor
+
+
+def set_leg_workers(workers: int):
+    '''
+    Resizes the retrieval leg pool. Each query holds two leg threads, so a process that
+    searches from N threads at once needs 2 * N to keep queries from queueing on each other
+    '''
+    global _leg_executor, _leg_workers
+    with _leg_lock:
+        old, _leg_executor, _leg_workers = _leg_executor, None, workers
+    if old is not None:
+        old.shutdown(wait=False)
+
+
+def _timed(fn, *args):
+    '''Runs fn(*args) and returns (result, elapsed milliseconds)'''
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
 
 
 # =================================================
 # COLBERT RERANKER FUNCTIONS
 # =================================================
 
-def load_reranker():
-    '''Loads the cross-encoder reranker model, using GPU if available'''
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    model_name = "cross-encoder/ms-marco-MiniLM-L-6-v2"
-    reranker = CrossEncoder(model_name, device=device)
+@lru_cache(maxsize=2)
+def load_reranker(method=RERANK_METHOD):
+    '''
+    Loads the reranker: the cross-encoder model (using GPU if available), or with
+    method="late_interaction" a MaxSim reranker over the stored token index
+    '''
+    if method == "late_interaction":
+        return load_late_interaction_reranker()
+    if method != "cross_encoder":
+        raise ValueError(f"Unknown rerank method '{method}' (expected 'cross_encoder' or 'late_interaction')")
+
+    import torch
+    from sentence_transformers import CrossEncoder
+
+    with tracing.span("load_reranker"):
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        model_name = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+        reranker = CrossEncoder(model_name, device=device)
     return reranker
 
 
-def rerank_documents(reranker, query, qs, top_k=COLBERT_TOP_K):
+def load_late_interaction_reranker():
+    with tracing.span("load_reranker", method="late_interaction"):
+        token_index = late_interaction.TokenIndex.load()
+        if token_index is None:
+            raise FileNotFoundError(
+                "No token index found — build the retriever with RERANK_METHOD='late_interaction' first"
+            )
+        return late_interaction.LateInteractionReranker(token_index, load_embedding()._client)
+
+
+def rerank_documents(reranker, query, qs, top_k=COLBERT_TOP_K, cascade=RERANK_CASCADE, recall_bias=CASCADE_RECALL_BIAS):
     '''
     Scores each document against the query using the cross-encoder
-    and returns the top_k highest-scoring documents
+    and returns the top_k highest-scoring documents.
+    With `cascade=True`, only an adaptive prefix of the fused ranking is scored
+    (see `cascade_rerank`). A late-interaction reranker always scores every candidate.
     '''
+    if isinstance(reranker, late_interaction.LateInteractionReranker):
+        return reranker.rerank(query, qs, top_k=top_k)
+    if cascade:
+        return cascade_rerank(reranker, query, qs, top_k=top_k, recall_bias=recall_bias)
+
     # Extract text from Document objects if needed
     texts = [q.page_content if hasattr(q, 'page_content') else q for q in qs]
     
     # Create query-document pairs
     pairs = [[query, text] for text in texts]
     
-    # Get scores from cross-encoder
-    scores = reranker.predict(pairs)
+    # Get scores from cross-encoder, batched by length
+    with tracing.span("rerank.predict", pairs=len(pairs)):
+        scores = encoding_scheduler.default_scheduler().predict(reranker, pairs)
+    _record_rerank("full", len(pairs))
     
-    # Sort by score and return top-k
-    reranked = sorted(zip(scores.tolist(), qs), key=lambda x: x[0], reverse=True)
-    return [doc for score, doc in reranked[:top_k]]
+    return top_k_by_score(scores.tolist(), qs, top_k)
+
+
+def cascade_depth(qs, top_k, recall_bias=CASCADE_RECALL_BIAS) -> int:
+    '''
+    Cheap first stage: decides how many fused candidates go to the cross-encoder.
+
+    Confidence is the mean of
+      - agreement: share of the fused top_k that both BM25 and FAISS returned
+      - margin: fused-score gap between rank top_k and rank 2*top_k, relative to the full spread
+    and depth = top_k + (n - top_k) * max(recall_bias, 1 - confidence).
+    recall_bias=1 always scores everything; 0 lets confident rankings stop at top_k.
+    '''
+    n = len(qs)
+    if n <= top_k:
+        return n
+
+    details = [getattr(q, "metadata", {}).get("retrieval") or {} for q in qs]
+    head = details[:top_k]
+    agreement = sum("bm25_rank" in d and "faiss_rank" in d for d in head) / top_k
+
+    fused = [d.get("fused_score") for d in details]
+    if all(f is not None for f in fused) and fused[0] != fused[-1]:
+        tail = fused[min(2 * top_k, n) - 1]
+        margin = min(max((fused[top_k - 1] - tail) / (fused[0] - fused[-1]), 0.0), 1.0)
+    else:
+        margin = 0.0
+
+    confidence = (agreement + margin) / 2
+    extra = (n - top_k) * max(recall_bias, 1.0 - confidence)
+    return min(n, top_k + int(np.ceil(extra)))
+
+
+def cascade_rerank(reranker, query, qs, top_k=COLBERT_TOP_K, recall_bias=CASCADE_RECALL_BIAS, chunk_size=CASCADE_CHUNK_SIZE):
+    '''
+    Reranks the fused ranking in small chunks, in fused order, up to `cascade_depth`
+    candidates, and stops early once a chunk leaves the top_k set unchanged.
+    '''
+    depth = cascade_depth(qs, top_k, recall_bias)
+    texts = [q.page_content if hasattr(q, 'page_content') else q for q in qs[:depth]]
+
+    scores = []
+    previous_top = None
+    end = min(depth, max(top_k, chunk_size))
+    start = 0
+    with tracing.span("rerank.cascade", candidates=len(qs), depth=depth) as trace:
+        while start < depth:
+            chunk_scores = reranker.predict([[query, t] for t in texts[start:end]])
+            scores.extend(chunk_scores.tolist())
+
+            current_top = set(np.argsort(scores)[::-1][:top_k].tolist())
+            if current_top == previous_top:
+                break
+            previous_top = current_top
+            start, end = end, min(depth, end + chunk_size)
+        trace.set(pairs=len(scores))
+
+    _record_rerank("cascade", len(scores))
+    return top_k_by_score(scores, qs[: len(scores)], top_k)
+
+
+def rerank_stats() -> dict:
+    '''Average number of cross-encoder pairs per query, per rerank mode'''
+    return {
+        mode: {**counts, "avg_pairs": round(counts["pairs"] / counts["queries"], 2) if counts["queries"] else 0.0}
+        for mode, counts in _rerank_counts.items()
+    }
+
+
+def reset_rerank_stats() -> None:
+    _rerank_counts.clear()
+
+
+def _record_rerank(mode: str, pairs: int) -> None:
+    counts = _rerank_counts.setdefault(mode, {"queries": 0, "pairs": 0})
+    counts["queries"] += 1
+    counts["pairs"] += pairs
+
+
+def rerank_batch(reranker, queries, candidate_lists, top_k=COLBERT_TOP_K, batch_size=RERANK_BATCH_SIZE):
+    '''
+    Reranks the candidates of many queries with one length-bucketed cross-encoder pass
+    (`batch_size` caps the pairs per forward pass). Returns one top_k list per query,
+    identical to calling `rerank_documents` (full mode) per query.
+    '''
+    if isinstance(reranker, late_interaction.LateInteractionReranker):
+        return reranker.rerank_batch(queries, candidate_lists, top_k=top_k)
+
+    pairs, offsets = [], [0]
+    for query, qs in zip(queries, candidate_lists):
+        pairs.extend([query, q.page_content if hasattr(q, 'page_content') else q] for q in qs)
+        offsets.append(len(pairs))
+
+    with tracing.span("rerank.predict", pairs=len(pairs), batch_size=batch_size):
+        scores = encoding_scheduler.default_scheduler().predict(reranker, pairs, max_batch_size=batch_size).tolist()
+    for start, end in zip(offsets, offsets[1:]):
+        _record_rerank("full", end - start)
+
+    return [
+        top_k_by_score(scores[start:end], qs, top_k)
+        for start, end, qs in zip(offsets, offsets[1:], candidate_lists)
+    ]
+
+
+def top_k_by_score(scores, qs, top_k):
+    '''
+    Sorts documents by descending score (stable for ties) and returns the top_k.
+    Documents come back as copies with the score in metadata["retrieval"]["rerank_score"],
+    so the candidates (possibly shared with other queries) are never modified.
+    '''
+    reranked = sorted(zip(scores, qs), key=lambda x: x[0], reverse=True)
+    return [_with_rerank_score(doc, score) for score, doc in reranked[:top_k]]
+
+
+def _with_rerank_score(doc, score):
+    if not hasattr(doc, "metadata"):
+        return doc
+    retrieval = {**doc.metadata.get("retrieval", {}), "rerank_score": float(score)}
+    return type(doc)(page_content=doc.page_content, metadata={**doc.metadata, "retrieval": retrieval})
 
 
 if __name__ == "__main__":
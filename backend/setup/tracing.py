@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+from functools import wraps
+from itertools import count
+from typing import List
+
+# Tracing is off unless HSC_TRACE=1 or `enable()` is called. When off, `span()`
+# returns a shared no-op object, so instrumented code pays one flag check per span.
+_enabled = os.getenv("HSC_TRACE", "") == "1"
+_spans = deque(maxlen=100_000)  # oldest spans are dropped in long-running processes
+_lock = threading.Lock()
+_local = threading.local()
+_ids = count(1)
+_epoch = time.perf_counter()
+
+
+def enable() -> None:
+    global _enabled
+    _enabled = True
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+class _NoopSpan:
+    '''Returned by `span()` while tracing is disabled'''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        return self
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    '''
+    Records wall time (perf_counter), CPU time of the current thread (thread_time)
+    and arbitrary attributes such as candidate counts. Nested spans on the same
+    thread record their parent's ID.
+    '''
+
+    __slots__ = ("name", "attrs", "span_id", "parent_id", "_wall", "_cpu")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.span_id = next(_ids)
+        self.parent_id = None
+
+    def set(self, **attrs):
+        '''Adds attributes (e.g. candidates=50) to the span'''
+        self.attrs.update(attrs)
+        return self
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        self.parent_id = stack[-1] if stack else None
+        stack.append(self.span_id)
+        self._cpu = time.thread_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall_end = time.perf_counter()
+        cpu_ms = (time.thread_time() - self._cpu) * 1000
+        _local.stack.pop()
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        record = {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "thread": threading.current_thread().name,
+            "tid": threading.get_ident(),
+            "start_ms": round((self._wall - _epoch) * 1000, 3),
+            "wall_ms": round((wall_end - self._wall) * 1000, 3),
+            "cpu_ms": round(cpu_ms, 3),
+            "attrs": self.attrs,
+        }
+        with _lock:
+            _spans.append(record)
+        return False
+
+
+def span(name: str, **attrs):
+    '''
+    Context manager timing a block:
+
+        with tracing.span("faiss.search", k=25) as s:
+            ...
+            s.set(candidates=len(hits))
+    '''
+    if not _enabled:
+        return _NOOP
+    return Span(name, attrs)
+
+
+def traced(name: str):
+    '''Decorator form of `span` for whole functions'''
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with Span(name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# =================================================
+# EXPORT
+# =================================================
+
+def spans() -> List[dict]:
+    '''Returns a copy of the finished spans'''
+    with _lock:
+        return list(_spans)
+
+
+def clear() -> None:
+    with _lock:
+        _spans.clear()
+
+
+def export_jsonl(path: str) -> str:
+    '''Writes one JSON object per finished span'''
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for record in spans():
+            f.write(json.dumps(record, default=str) + "\n")
+    return path
+
+
+def export_chrome_trace(path: str) -> str:
+    '''
+    Writes spans in Chrome trace-event format ("X" complete events, microseconds),
+    viewable as a flame chart in chrome://tracing or https://ui.perfetto.dev
+    '''
+    pid = os.getpid()
+    events = [
+        {
+            "name": record["name"],
+            "ph": "X",
+            "ts": round(record["start_ms"] * 1000, 1),
+            "dur": round(record["wall_ms"] * 1000, 1),
+            "pid": pid,
+            "tid": record["tid"],
+            "args": {**record["attrs"], "cpu_ms": record["cpu_ms"]},
+        }
+        for record in spans()
+    ]
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+    return path
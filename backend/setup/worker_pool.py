@@ -0,0 +1,260 @@
+'''
+Multi-process query workers that share one copy of the models and corpus.
+
+With `preload=True` (the default) the parent loads the retriever, the embedding model and
+the cross-encoder, runs one warm-up query, freezes the garbage collector and then forks
+the workers. Model weights and index pages are shared copy-on-write, so each worker only
+adds its own private pages instead of a full copy of torch + models.
+
+Torch threading: the parent pins torch to WORKER_TORCH_THREADS before touching a model,
+because OpenMP thread pools do not survive fork (a child can hang on a pool its parent
+started). Each worker also gets a fresh retrieval-leg thread pool after the fork.
+
+With `preload=False` each worker is spawned and loads everything itself, which is the
+baseline `benchmarks/worker_memory_benchmark.py` compares against.
+
+Each worker records the task it is running in a shared array. A worker that dies mid-query
+(OOM kill, segfault) has that query failed and is replaced by a fresh worker.
+'''
+from __future__ import annotations
+
+import gc
+import io
+import os
+import sys
+import queue
+import itertools
+import threading
+import contextlib
+import multiprocessing as mp
+from concurrent.futures import Future
+from pathlib import Path
+from typing import List
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from config.constants import SERVE_WORKERS, WORKER_TORCH_THREADS
+
+from setup import encoding_scheduler, retriever_setup
+
+# Set in the parent before forking (preload) or in each worker (spawn)
+_retriever = None
+
+
+def preload(loader=retriever_setup.load_persisted_retriever, warm_query="integration"):
+    '''
+    Loads the retriever and models in the current process and runs one query so every
+    lazily initialised piece (tokenizers, index search params) exists before forking
+    '''
+    from ai_calls import retrieval_pipeline
+
+    global _retriever
+    encoding_scheduler.configure_torch_threads(WORKER_TORCH_THREADS)
+    _retriever = loader()
+    if _retriever is None:
+        raise ValueError("Retriever has no questions loaded")
+    retriever_setup.load_reranker()
+    with contextlib.redirect_stdout(io.StringIO()):
+        retrieval_pipeline.get_response(warm_query, _retriever)
+    # Objects created so far are never collected, so the collector does not write to
+    # (and un-share) their pages in the workers
+    gc.freeze()
+    return _retriever
+
+
+def _worker_main(tasks, results, loader, quiet, slot, current):
+    global _retriever
+    from ai_calls import retrieval_pipeline
+
+    if quiet:
+        sys.stdout = open(os.devnull, "w")
+
+    if _retriever is None:
+        encoding_scheduler.configure_torch_threads(WORKER_TORCH_THREADS)
+        _retriever = loader()
+        retriever_setup.load_reranker()
+    else:
+        _retriever.after_fork()
+    results.put(("ready", os.getpid(), None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, query, top_k, filters = task
+        # Shared memory, so the parent sees it even if this process is killed before
+        # anything it put on `results` is flushed
+        current[slot] = task_id
+        try:
+            docs = retrieval_pipeline.get_response(query, _retriever, top_k=top_k, filters=filters)
+            results.put((task_id, docs, None))
+        except Exception as e:
+            results.put((task_id, None, f"{type(e).__name__}: {e}"))
+
+
+class WorkerPool:
+    '''
+    Pool of query worker processes. `submit` returns a Future of the reranked Documents,
+    so several threads can share one pool; `search` is the blocking batch form.
+    '''
+
+    def __init__(self, workers=SERVE_WORKERS, loader=retriever_setup.load_persisted_retriever,
+                 preload=True, quiet=True):
+        self.workers = workers or os.cpu_count() or 1
+        self.loader = loader
+        self.preload = preload
+        self.quiet = quiet
+        self.pids = []
+        self.restarts = 0
+        self._processes = []
+        self._current = None  # worker slot -> id of the task it last started
+        self._closing = False
+        self._futures = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._collector = None
+
+    def start(self, timeout=600):
+        '''Starts the workers and waits until each one has its models loaded'''
+        if self.preload:
+            if _retriever is None:
+                preload(self.loader)
+            ctx = mp.get_context("fork")
+        else:
+            ctx = mp.get_context("spawn")
+
+        self._ctx = ctx
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        self._current = ctx.Array("q", [-1] * self.workers, lock=False)
+        self._processes = [self._spawn(slot) for slot in range(self.workers)]
+
+        for _ in range(self.workers):
+            _, pid, _ = self._results.get(timeout=timeout)
+            self.pids.append(pid)
+
+        self._collector = threading.Thread(target=self._collect, name="worker-results", daemon=True)
+        self._collector.start()
+        return self
+
+    def _spawn(self, slot):
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(self._tasks, self._results, self.loader, self.quiet, slot, self._current),
+            name=f"query-worker-{slot}",
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    def _collect(self):
+        while True:
+            try:
+                task_id, docs, error = self._results.get(timeout=1.0)
+            except queue.Empty:
+                task_id = None
+            except (EOFError, OSError):
+                return
+            if not self._check_workers():
+                self._fail_pending("All query workers exited")
+                return
+            if task_id is None:
+                continue
+            if task_id == "ready":  # a replacement worker has loaded its models
+                self.pids.append(docs)
+                continue
+            with self._lock:
+                future = self._futures.pop(task_id, None)
+            # A caller may have cancelled the Future while the worker was busy
+            if future is None or not future.set_running_or_notify_cancel():
+                continue
+            if error:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(docs)
+
+    def _check_workers(self) -> bool:
+        '''
+        Fails the in-flight query of every worker that died and starts a replacement.
+        A worker that dies before it is ready is not replaced, so a worker that cannot
+        start does not respawn forever. Returns False once no worker is left.
+        '''
+        for slot, process in enumerate(self._processes):
+            if process.is_alive() or self._closing:
+                continue
+            with self._lock:
+                future = self._futures.pop(self._current[slot], None)
+            self._current[slot] = -1
+            if future is not None and future.set_running_or_notify_cancel():
+                future.set_exception(RuntimeError(f"Query worker {process.pid} exited with code {process.exitcode}"))
+            if process.pid not in self.pids:
+                continue
+            print(f"Query worker {process.pid} exited with code {process.exitcode}; starting a replacement")
+            self.pids.remove(process.pid)
+            self._processes[slot] = self._spawn(slot)
+            self.restarts += 1
+        return any(p.is_alive() for p in self._processes)
+
+    def _fail_pending(self, message):
+        with self._lock:
+            pending, self._futures = self._futures, {}
+        for future in pending.values():
+            if future.set_running_or_notify_cancel():
+                future.set_exception(RuntimeError(message))
+
+    def submit(self, query: str, top_k: int = 10, filters: dict | None = None) -> Future:
+        '''Queues one query for the next free worker'''
+        if self._collector is None:
+            raise RuntimeError("WorkerPool.start() has not been called")
+        future = Future()
+        task_id = next(self._ids)
+        with self._lock:
+            self._futures[task_id] = future
+        self._tasks.put((task_id, query, top_k, filters))
+        return future
+
+    def search(self, queries: List[str], top_k: int = 10, filters: dict | None = None, timeout=None) -> List[list]:
+        '''Runs `queries` across the workers and returns the results in query order'''
+        futures = [self.submit(q, top_k, filters) for q in queries]
+        return [f.result(timeout=timeout) for f in futures]
+
+    def memory(self) -> List[dict]:
+        '''Per-worker memory (MB) from /proc: RSS, PSS (shared pages split) and USS (private)'''
+        return [{"pid": pid, **process_memory(pid)} for pid in self.pids]
+
+    def close(self, timeout=10):
+        self._closing = True
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._fail_pending("Worker pool closed")
+        self._processes = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def process_memory(pid: int) -> dict:
+    '''
+    Reads /proc/<pid>/smaps_rollup (Linux). PSS charges each shared page to the processes
+    mapping it, so the sum of PSS over workers is their real combined footprint.
+    '''
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[1].isdigit():
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    uss = fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    return {
+        "rss_mb": round(fields.get("Rss", 0) / 1024, 1),
+        "pss_mb": round(fields.get("Pss", 0) / 1024, 1),
+        "uss_mb": round(uss / 1024, 1),
+    }
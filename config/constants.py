@@ -4,6 +4,35 @@ from pathlib import Path
 BM25_TOP_K = 25
 FAISS_TOP_K = 25
 COLBERT_TOP_K = 10
+# Tag / skill field index (see backend/setup/field_index.py): per-field weights within the
+# field ranking, and the weight of that ranking in fusion next to BM25 (0.4) and FAISS (0.6)
+FIELD_WEIGHTS = {"tags": 1.0, "skills": 0.3}
+FIELD_LEG_WEIGHT = 0.3
+FUSION_METHOD = "rrf"  # "rrf" (weighted reciprocal rank) or "score" (weighted normalised scores)
+RRF_C = 60
+# Threads running retrieval legs, shared by every retriever in the process. A query holds
+# two (BM25 and dense) at once; the HTTP service raises this to 2 x its search threads
+RETRIEVAL_LEG_WORKERS = 2
+# "cross_encoder" (full transformer pass per pair) or "late_interaction" (MaxSim over stored
+# token embeddings; see backend/setup/late_interaction.py)
+RERANK_METHOD = "cross_encoder"
+RERANK_BATCH_SIZE = 64  # max (query, document) pairs per cross-encoder forward pass in batch reranking
+
+# Length-bucketed encoding (embedding + cross-encoder): a batch may hold at most
+# ENCODE_TOKEN_BUDGET padded tokens (batch size x longest input) and ENCODE_MAX_BATCH inputs
+ENCODE_TOKEN_BUDGET = 16_384
+ENCODE_MAX_BATCH = 128
+ENCODE_THREADS = 0  # torch intra-op threads; 0 = all cores
+
+# Query worker processes (see backend/setup/worker_pool.py)
+SERVE_WORKERS = 0  # 0 = one per core
+WORKER_TORCH_THREADS = 1  # per worker; parallelism comes from the processes
+
+# Cascade reranking: score an adaptive prefix of the fused ranking in chunks.
+# CASCADE_RECALL_BIAS in [0, 1]: 1 = always score every candidate, 0 = trust confident fusions fully.
+RERANK_CASCADE = False
+CASCADE_RECALL_BIAS = 0.3
+CASCADE_CHUNK_SIZE = 8
 
 # =================================================
 # PATHS (resolved from project root)
@@ -17,9 +46,93 @@ REVISION_DIR = str(PROJECT_ROOT / "documents" / "revision_files")
 
 FAISS_ROOT = str(PROJECT_ROOT / "data" / "faiss" / "indexes")
 FAISS_NAME = "corpus_faiss"
+FAISS_MANIFEST = "manifest.json"
+FIELD_VECTORS_NAME = "field_values.npz"  # cached embeddings of tag / skill names
+TOKEN_INDEX_NAME = "corpus_tokens"  # float16 token embeddings for late-interaction reranking
+
+# FAISS index type: "flat" (exact), "hnsw", "ivf_flat" or "ivf_pq".
+# Query-time parameters (efSearch / nprobe) trade recall for latency.
+FAISS_INDEX_TYPE = "flat"
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+IVF_NLIST = 0  # 0 = derive from corpus size (~4*sqrt(n))
+IVF_NPROBE = 16
+PQ_M = 48  # sub-quantisers; must divide the embedding dimension (384 for MiniLM)
+PQ_NBITS = 8
+INDEX_TRAIN_SAMPLE = 50_000
+
+# Query result cache (exact LRU + semantic near-duplicate tier)
+QUERY_CACHE_SIZE = 256
+SEMANTIC_CACHE_SIZE = 256
+QUERY_CACHE_TTL = 60 * 60  # seconds
+SEMANTIC_CACHE_THRESHOLD = 0.95  # cosine similarity between query embeddings
+
+# Versioned, memory-mapped corpus bundles (see backend/setup/corpus_bundle.py)
+BUNDLE_ROOT = str(PROJECT_ROOT / "data" / "bundles")
+BUNDLE_POINTER = "CURRENT"  # file in BUNDLE_ROOT naming the active version
+BUNDLE_CHECK_INTERVAL = 2.0  # seconds between checks for a newly activated version
+BUNDLE_KEEP = 3  # inactive versions kept on disk for rollback
 
 SYLLABUS_DIR = "data/syllabus/Year_12_Maths_Advanced_FULL.json"
 
+TRACE_DIR = str(PROJECT_ROOT / "data" / "traces")  # span exports when HSC_TRACE=1
+
+EVAL_DIR = str(PROJECT_ROOT / "data" / "eval")
+EVAL_KS = (5, 10, 25)
+EVAL_MIN_RELEVANT = 3  # a subtopic needs this many tagged questions to become an eval query
+
+PDF_READER_POOL_SIZE = 32  # parsed exam PDFs kept open between revision packs
+PDF_ENGINES = ("pypdf", "pymupdf", "stream")
+PDF_ENGINE = "pypdf"  # revision pack assembly backend, see doc_processing/pdf_generator.py
+PDF_STREAM_CHUNK_SIZE = 64 * 1024  # bytes per chunk from pdf_stream.iter_custom_pdf
+# Output optimisation presets for revision packs (pdf_generator.optimize_pdf):
+#   dedupe     merge byte-identical objects (fonts, images, the reference sheet) across pages
+#   compress   deflate uncompressed content streams, fonts and images; pack objects into object streams
+#   image_dpi      downsample images shown above this resolution (None = keep images as they are)
+#   image_quality  JPEG quality of downsampled images
+PDF_IMAGE_QUALITY = 75
+PDF_OPTIMIZE_PRESETS = {
+    "none": {"dedupe": False, "compress": False, "image_dpi": None, "image_quality": PDF_IMAGE_QUALITY},
+    "compact": {"dedupe": True, "compress": True, "image_dpi": None, "image_quality": PDF_IMAGE_QUALITY},
+    "mobile": {"dedupe": True, "compress": True, "image_dpi": 150, "image_quality": PDF_IMAGE_QUALITY},
+}
+# Default preset per engine ("default" wherever an optimize argument is taken). The stream
+# engine skips it: the PyMuPDF rewrite loads the whole pack, undoing its flat memory use
+PDF_OPTIMIZE = "compact"
+PDF_STREAM_OPTIMIZE = None
+PACK_CACHE_DIR = str(PROJECT_ROOT / "documents" / "revision_files" / "packs")
+PACK_CACHE_MAX_MB = 500  # generated packs kept on disk, least recently used evicted first
+BULK_PACK_DIR = str(PROJECT_ROOT / "documents" / "revision_files" / "bulk")
+BULK_PACK_WORKERS = 0  # PDF build processes for doc_processing/bulk_packs.py; 0 = one per CPU
+
+# Page previews (doc_processing/thumbnails.py)
+THUMBNAIL_DIR = str(PROJECT_ROOT / "data" / "thumbnails")
+THUMBNAIL_SIZES = {"thumb": 36, "preview": 96, "full": 150}  # size name -> render DPI
+THUMBNAIL_FORMAT = "png"  # png | jpg | webp (webp needs Pillow)
+THUMBNAIL_PREWARM = 200  # most frequently retrieved pages rendered by `prewarm`
+THUMBNAIL_PREWARM_SIZES = ("thumb", "preview")
+
+# HTTP service (backend/server.py)
+SERVE_HOST = "127.0.0.1"
+SERVE_PORT = 8000
+SERVE_THREADS = 4  # threads running model work (embedding, retrieval, reranking) in-process
+SERVE_PDF_THREADS = 2  # threads building packs and rendering previews
+SERVE_MAX_PENDING = 32  # requests running or queued per pool; beyond this the server answers 503
+SERVE_TIMEOUT = 30.0  # seconds before a search or preview request is answered with 504
+SERVE_PACK_TIMEOUT = 120.0  # the same for pack builds
+SERVE_CORS_ORIGINS = ("http://localhost:5173",)  # the Vite dev server
+
+# Background revision pack builds (doc_processing/pack_jobs.py)
+JOB_BACKEND = "memory"  # "memory" (in-process) or "sqlite" (one queue shared by several processes)
+JOB_DB_PATH = str(PROJECT_ROOT / "data" / "jobs" / "pack_jobs.sqlite")
+JOB_WORKERS = 2  # build threads per process
+JOB_MAX_QUEUED = 256  # queued jobs before submissions are refused
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_DELAY = 2.0  # seconds before the first retry, doubled after every further failure
+JOB_LEASE = 600  # seconds a claimed SQLite job may run before another worker takes it over
+JOB_RETENTION = 24 * 60 * 60  # seconds finished jobs stay available for status polling
+
 PICKLE_PATH = str(PROJECT_ROOT / "backend" / "doc_processing" / "data" / "all_questions.pkl")
 
 AI_MODEL = "gemini-3-pro"